@@ -0,0 +1,50 @@
+"""Seeded synthetic datasets for the benchmarks."""
+import numpy as np
+import pandas as pd
+
+
+def make_dataset(rows, columns, cardinality=10, skew=0.0, dependence=0.0, duplicates=0.0, seed=0):
+    """Generate a categorical dataset.
+
+    :param rows: the number of rows
+    :param columns: the number of columns
+    :param cardinality: the number of distinct values per column, or a sequence with one number per column
+    :param skew: the exponent of the Zipf distribution of the values of every column. 0 gives uniform values.
+    :param dependence: the probability that a value is determined by the value of the previous column, instead of
+        being drawn independently
+    :param duplicates: the fraction of rows that are copies of other rows
+    :param seed: seed of the random generator
+    :return: a Pandas DataFrame with integer columns 'c0', 'c1', ...
+    """
+    rng = np.random.default_rng(seed)
+    cardinalities = np.broadcast_to(cardinality, columns)
+    data = np.empty((rows, columns), dtype=np.int64)
+    for j, cardinality in enumerate(cardinalities):
+        p = 1 / np.arange(1, cardinality + 1) ** skew
+        data[:, j] = rng.choice(cardinality, rows, p=p / p.sum())
+        if j and dependence:
+            # a fixed mapping of the values of the previous column
+            mapping = rng.integers(0, cardinality, cardinalities[j - 1])
+            dependent = rng.random(rows) < dependence
+            data[dependent, j] = mapping[data[dependent, j - 1]]
+    num_duplicates = int(rows * duplicates)
+    if num_duplicates and num_duplicates < rows:
+        copies = rng.choice(rows, num_duplicates, replace=False)
+        originals = np.setdiff1d(np.arange(rows), copies)
+        data[copies] = data[rng.choice(originals, num_duplicates)]
+    return pd.DataFrame(data, columns=['c{}'.format(j) for j in range(columns)])
+
+
+def make_accuracies(columns, fraction=0.5, low=0.6, high=0.95, seed=0):
+    """Generate `feature_accuracies` below 1 for a random subset of the columns.
+
+    :param columns: the number of columns
+    :param fraction: the fraction of the columns with an accuracy below 1
+    :param low: the lowest accuracy
+    :param high: the highest accuracy
+    :param seed: seed of the random generator
+    :return: dictionary mapping column index to accuracy
+    """
+    rng = np.random.default_rng(seed)
+    inaccurate = rng.choice(columns, int(round(columns * fraction)), replace=False)
+    return {int(i): float(rng.uniform(low, high)) for i in sorted(inaccurate)}
@@ -0,0 +1,153 @@
+"""Benchmark the public entry points of piflib on synthetic data.
+
+Every measurement runs in a fresh process, so that the peak RSS belongs to a single call. Run from the repository root,
+e.g.
+
+    python benchmarks/run.py --rows 1000 10000 100000 --skew 0 1.2 --output results.json
+    python benchmarks/run.py --rows 1000 10000 100000 --skew 0 1.2 --baseline results.json
+
+With `--baseline`, the wall times are compared against a stored result file, and the script exits with status 1 if any
+measurement is slower than the baseline by more than the tolerance.
+"""
+import argparse
+import concurrent.futures
+import itertools
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datagen import make_accuracies, make_dataset  # noqa: E402
+from piflib import entropy, pif_calculator  # noqa: E402
+
+FUNCTIONS = {
+    'compute_cigs': lambda df, accuracies: pif_calculator.compute_cigs(df, feature_accuracies=accuracies),
+    'compute_weighted_cigs': lambda df, accuracies: pif_calculator.compute_weighted_cigs(
+        df, feature_accuracies=accuracies),
+    'compute_csfs': lambda df, accuracies: pif_calculator.compute_csfs(df, feature_accuracies=accuracies),
+    'create_entropy_mi_table': lambda df, accuracies: entropy.create_entropy_mi_table(df),
+    'create_conditional_entropy_table': lambda df, accuracies: entropy.create_conditional_entropy_table(df),
+}
+
+# the parameters of the synthetic data, in the order of the result table
+DATA_PARAMETERS = ['rows', 'columns', 'cardinality', 'skew', 'dependence', 'duplicates', 'accuracy_fraction']
+
+
+def _peak_rss_mb():
+    # kilobytes on Linux, bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+
+
+def measure(function, parameters, repeat, seed):
+    """Time a function on a synthetic dataset, in the current process.
+
+    :return: dictionary with the best wall time of `repeat` calls in seconds, the records per second and the peak RSS
+    """
+    df = make_dataset(parameters['rows'], parameters['columns'], parameters['cardinality'], parameters['skew'],
+                      parameters['dependence'], parameters['duplicates'], seed)
+    accuracies = make_accuracies(parameters['columns'], parameters['accuracy_fraction'], seed=seed)
+    data_rss = _peak_rss_mb()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        FUNCTIONS[function](df, accuracies)
+        times.append(time.perf_counter() - start)
+    best = min(times)
+    return {'seconds': best, 'rows_per_second': parameters['rows'] / best, 'peak_rss_mb': _peak_rss_mb(),
+            'data_rss_mb': data_rss}
+
+
+def run(functions, grid, repeat=3, seed=0):
+    """Measure every function on every dataset of the grid, each in a fresh process.
+
+    :param functions: names of functions in `FUNCTIONS`
+    :param grid: iterable of dictionaries with the `DATA_PARAMETERS`
+    :return: list of result dictionaries
+    """
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for parameters in grid:
+        for function in functions:
+            with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as executor:
+                measurement = executor.submit(measure, function, parameters, repeat, seed).result()
+            result = dict(function=function, **parameters, **measurement)
+            results.append(result)
+            print(_format_row(result), flush=True)
+    return results
+
+
+def compare(results, baseline):
+    """Compare wall times against a baseline.
+
+    :return: list of (result, baseline result, ratio) for the measurements that are in the baseline
+    """
+    baseline = {_key(result): result for result in baseline}
+    comparisons = []
+    for result in results:
+        reference = baseline.get(_key(result))
+        if reference is not None:
+            comparisons.append((result, reference, result['seconds'] / reference['seconds']))
+    return comparisons
+
+
+def _key(result):
+    return (result['function'],) + tuple(result[name] for name in DATA_PARAMETERS)
+
+
+def _format_row(result):
+    return '{:<34}{:>9}{:>5}{:>6}{:>6}{:>6}{:>6}{:>6}  {:>9.3f}s {:>12.0f} rows/s {:>8.1f} MB'.format(
+        result['function'], *(result[name] for name in DATA_PARAMETERS),
+        result['seconds'], result['rows_per_second'], result['peak_rss_mb'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--functions', nargs='+', choices=sorted(FUNCTIONS), default=list(FUNCTIONS))
+    parser.add_argument('--rows', nargs='+', type=int, default=[1000, 10000, 100000])
+    parser.add_argument('--columns', nargs='+', type=int, default=[8])
+    parser.add_argument('--cardinality', nargs='+', type=int, default=[10])
+    parser.add_argument('--skew', nargs='+', type=float, default=[0.0],
+                        help='exponent of the Zipf distribution of the values')
+    parser.add_argument('--dependence', nargs='+', type=float, default=[0.0],
+                        help='probability that a value depends on the previous column')
+    parser.add_argument('--duplicates', nargs='+', type=float, default=[0.0],
+                        help='fraction of rows that copy other rows')
+    parser.add_argument('--accuracy-fraction', nargs='+', type=float, default=[0.0],
+                        help='fraction of the features with an accuracy below 1')
+    parser.add_argument('--repeat', type=int, default=3, help='number of calls per measurement, the best one counts')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against the results in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='relative slowdown against the baseline that counts as a regression')
+    args = parser.parse_args(argv)
+
+    values = [args.rows, args.columns, args.cardinality, args.skew, args.dependence, args.duplicates,
+              args.accuracy_fraction]
+    grid = [dict(zip(DATA_PARAMETERS, combination)) for combination in itertools.product(*values)]
+    header = ['function', 'rows', 'cols', 'card', 'skew', 'dep', 'dup', 'acc']
+    print('{:<34}{:>9}{:>5}{:>6}{:>6}{:>6}{:>6}{:>6}'.format(*header))
+    results = run(args.functions, grid, args.repeat, args.seed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': sys.version, 'results': results}, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = 0
+        print('\ncomparison with {} (tolerance {:.0%}):'.format(args.baseline, args.tolerance))
+        for result, reference, ratio in compare(results, baseline):
+            slower = ratio > 1 + args.tolerance
+            regressions += slower
+            print('{}  {:>6.2f}x{}'.format(_format_row(result), ratio, '  REGRESSION' if slower else ''))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,7 @@
-import collections
-
 import matplotlib.pyplot as plt
 import numpy as np
 
-from piflib.data_util import calculate_distribution
+from piflib.pif_calculator import compute_posterior_distributions  # noqa: F401 (used by the tutorials)
 
 
 def horizontal_bar_plot(results, category_names):
@@ -35,19 +33,3 @@ def horizontal_bar_plot(results, category_names):
                loc='lower center', fontsize='small')
 
     return fig, ax
-
-
-def compute_posterior_distributions(feature, df):
-    known_features = tuple(col_name for col_name in df.columns if col_name != feature)
-    bucket = collections.defaultdict(list)
-    bucket_map = []
-    for idx, row in df.iterrows():
-        key = tuple(row[known_feature] for known_feature in known_features)
-        bucket[key].append(row[feature])
-        bucket_map.append(key)
-    bucket_distributions = {key: calculate_distribution(el_bucket) for key, el_bucket in bucket.items()}
-    feature_vals = df[feature].unique()
-    dists = {}
-    for key, distribution in bucket_distributions.items():
-        dists[str(key)] = [distribution.get(feature_val, 0) for feature_val in feature_vals]
-    return dists, feature_vals
@@ -1,10 +1,58 @@
-import pkg_resources
+"""Compute the personal information factor (PIF) of tabular data.
 
-from piflib.pif_calculator import compute_cigs, compute_weighted_cigs, compute_csfs
+The submodules, and with them NumPy and Pandas, are only imported when one of their names is first used, so that
+`import piflib` is fast in command line tools and worker processes.
+"""
+import importlib
+
+# public name: module that defines it
+_EXPORTS = {
+    'encode': 'piflib.encoding',
+    'compute_cigs': 'piflib.pif_calculator',
+    'compute_weighted_cigs': 'piflib.pif_calculator',
+    'compute_csfs': 'piflib.pif_calculator',
+    'compute_metrics': 'piflib.pif_calculator',
+    'compute_posteriors': 'piflib.posterior',
+    'ReferenceIndex': 'piflib.reference',
+    'suggest_suppressions': 'piflib.suppression',
+}
+
+# submodules that are imported on first attribute access, e.g. `piflib.pif_calculator.compute_pif`
+_SUBMODULES = ('buckets', 'cache', 'cli', 'data_util', 'encoding', 'entropy', 'factored', 'incremental',
+               'instrumentation', 'lattice', 'mapreduce', 'parallel', 'pif_calculator', 'posterior', 'reference', 'rig',
+               'service', 'sketch', 'streaming', 'suppression')
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    if name == '__version__':
+        # importlib.metadata is slow to import
+        globals()[name] = _version()
+        return globals()[name]
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(_EXPORTS[name]), name)
+        globals()[name] = value
+        return value
+    if name in _SUBMODULES:
+        # importing a submodule also binds it as an attribute of the package
+        return importlib.import_module('piflib.' + name)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS) | set(_SUBMODULES))
+
+
+def _version():
+    try:
+        from importlib import metadata
+    except ImportError:  # Python < 3.8
+        return "development"
+    try:
+        return metadata.version('piflib')
+    except metadata.PackageNotFoundError:
+        return "development"
 
-try:
-    __version__ = pkg_resources.get_distribution('clkhash').version
-except pkg_resources.DistributionNotFound:
-    __version__ = "development"
 
 __author__ = "Data61"
@@ -0,0 +1,243 @@
+"""Vectorized bucket statistics.
+
+The calculators group the rows of a dataset into buckets of rows that agree on all 'known' features, and compare the
+distribution of an 'unknown' feature within each bucket against the prior of that feature. This module computes those
+bucket distributions with NumPy on an encoded dataset (see `piflib.encoding`), instead of building a Python list per
+bucket.
+"""
+import collections
+
+import numpy as np
+
+from piflib.encoding import group_ids
+from piflib.instrumentation import stage, traced
+
+BucketCounts = collections.namedtuple(
+    'BucketCounts', ['pair_bucket', 'pair_value', 'pair_counts', 'bucket_totals', 'row_pair'])
+BucketCounts.__doc__ = """Occurrence counts of the values of one feature within the buckets of a dataset.
+
+Each (bucket, value) combination that occurs in the data is called a pair.
+
+:param pair_bucket: bucket id of every pair
+:param pair_value: value code of every pair
+:param pair_counts: number of rows in every pair
+:param bucket_totals: number of rows in every bucket
+:param row_pair: pair index of every row of the dataset
+"""
+
+
+def count_buckets(bucket_ids, num_buckets, values, num_values, weights=None):
+    """Count how often each value occurs in each bucket.
+
+    :param bucket_ids: bucket id of every row
+    :param num_buckets: number of buckets
+    :param values: value code of every row
+    :param num_values: upper bound (exclusive) of the value codes
+    :param weights: optional multiplicity of every row
+    :return: BucketCounts. The pairs are sorted by bucket, and within a bucket by first occurrence. Summing over
+        pairs in this order gives the same floating point results as summing over a `collections.Counter` per bucket.
+    """
+    pair_keys = bucket_ids.astype(np.int64) * max(num_values, 1) + values
+    pair_keys, first_rows, row_pair = np.unique(pair_keys, return_index=True, return_inverse=True)
+    pair_bucket, pair_value = np.divmod(pair_keys, max(num_values, 1))
+    order = np.lexsort((first_rows, pair_bucket))
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    pair_bucket, pair_value = pair_bucket[order], pair_value[order]
+    row_pair = rank[row_pair.reshape(-1)]
+    pair_counts = np.bincount(row_pair, weights=weights, minlength=len(pair_keys)).astype(float)
+    bucket_totals = np.bincount(pair_bucket, weights=pair_counts, minlength=num_buckets)
+    return BucketCounts(pair_bucket, pair_value, pair_counts, bucket_totals, row_pair)
+
+
+FeaturePrior = collections.namedtuple('FeaturePrior', ['probabilities', 'mass'])
+FeaturePrior.__doc__ = """The prior of a feature in the form the kernels need it.
+
+:param probabilities: array of prior probabilities, indexed by value code
+:param mass: the total prior probability of the whole domain of the prior, including values that do not occur in the
+    data. Only needed for accuracies < 1.
+"""
+
+
+def prior_probabilities(dictionary, prior):
+    """Look up the prior probability of every value of a feature.
+
+    :param dictionary: the distinct values of the feature, ordered by code
+    :param prior: dictionary mapping feature values to probabilities
+    :return: array of prior probabilities, indexed by value code
+    """
+    return np.array([prior[value] for value in dictionary], dtype=float)
+
+
+@traced
+def prepare_priors(dataset, feature_priors):
+    """Convert the prior dictionaries of all features of an encoded dataset.
+
+    :param dataset: an EncodedDataset
+    :param feature_priors: dictionary mapping every feature index to a prior distribution
+    :return: dictionary mapping feature index to FeaturePrior
+    """
+    return {i: FeaturePrior(prior_probabilities(dataset.dictionaries[i], feature_priors[i]),
+                            sum(prob for prob in feature_priors[i].values() if prob > 0))
+            for i in range(dataset.num_features)}
+
+
+def bucket_kls(counts, prior, accuracy=1):
+    """Compute the KL divergence of every bucket distribution from the prior, in bits.
+
+    This is the vectorized equivalent of calling `calculate_kl(calculate_distribution(bucket, accuracy, prior), prior)`
+    for every bucket.
+
+    :param counts: BucketCounts of the feature
+    :param prior: FeaturePrior of the feature
+    :param accuracy: the accuracy of the feature
+    :return: array with the KL divergence of every bucket
+    """
+    num_buckets = len(counts.bucket_totals)
+    if accuracy == 1:
+        p = counts.pair_counts / counts.bucket_totals[counts.pair_bucket]
+        terms = p * np.log2(p / prior.probabilities[counts.pair_value])
+        return np.bincount(counts.pair_bucket, weights=terms, minlength=num_buckets)
+    # The posterior mixes the bucket counts with the prior, so it has support on the whole domain of the prior. For a
+    # value that does not occur in a bucket the posterior is q * (1 - accuracy), and its KL term q * (1 - accuracy) *
+    # log2(1 - accuracy) only depends on q. The sum of these terms over a bucket therefore follows from the total prior
+    # mass minus the prior mass of the values observed in the bucket, and we only need to visit the observed values.
+    onemacc = 1 - accuracy
+    q = prior.probabilities[counts.pair_value]
+    p = counts.pair_counts * (accuracy / counts.bucket_totals[counts.pair_bucket]) + q * onemacc
+    observed_terms = np.bincount(counts.pair_bucket, weights=p * np.log2(p / q), minlength=num_buckets)
+    observed_mass = np.bincount(counts.pair_bucket, weights=q, minlength=num_buckets)
+    unobserved_mass = np.maximum(prior.mass - observed_mass, 0)
+    return observed_terms + unobserved_mass * onemacc * np.log2(onemacc) if onemacc > 0 else observed_terms
+
+
+def bucket_prob_changes(counts, prior, accuracy=1):
+    """Compute the change in probability between the bucket distribution and the prior for every pair.
+
+    This is the vectorized equivalent of `calculate_prob_change(calculate_distribution(bucket, accuracy, prior), prior)`.
+
+    :param counts: BucketCounts of the feature
+    :param prior: FeaturePrior of the feature
+    :param accuracy: the accuracy of the feature
+    :return: array with the absolute probability change of every pair
+    """
+    q = prior.probabilities[counts.pair_value]
+    totals = counts.bucket_totals[counts.pair_bucket]
+    if accuracy == 1:
+        p = counts.pair_counts / totals
+    else:
+        p = counts.pair_counts * (accuracy / totals) + q * (1 - accuracy)
+    return np.abs(p - q)
+
+
+def bucket_conditional_entropy(counts, total):
+    """Compute the conditional entropy of the feature given the bucket, H(X|known features), in bits.
+
+    :param counts: BucketCounts of the feature
+    :param total: the number of rows of the dataset, i.e. the sum of the weights
+    :return: the conditional entropy
+    """
+    p_pair = counts.pair_counts / total
+    p_value_given_bucket = counts.pair_counts / counts.bucket_totals[counts.pair_bucket]
+    return -np.sum(p_pair * np.log2(p_value_given_bucket))
+
+
+def bucket_feature(dataset, feature_is):
+    """Bucket the distinct rows of an encoded dataset on all features not in `feature_is`.
+
+    Datasets from a `piflib.cache.DatasetCache` load the buckets from the cache.
+
+    :param dataset: an EncodedDataset, or any object with `codes`, `cardinalities`, `weights` and `num_features`
+    :param feature_is: indices of the 'unknown' features
+    :return: tuple of the bucket id of every distinct row, the number of buckets, and a BucketCounts for every feature
+        in `feature_is`
+    """
+    if hasattr(dataset, 'cached_buckets'):
+        return dataset.cached_buckets(feature_is)
+    return compute_buckets(dataset, feature_is)
+
+
+def compute_buckets(dataset, feature_is):
+    """Bucket the distinct rows of an encoded dataset, see `bucket_feature`, without looking at any cache."""
+    known = [i for i in range(dataset.num_features) if i not in feature_is]
+    cardinalities = dataset.cardinalities
+    with stage('bucketing', features=list(feature_is)) as bucketing:
+        bucket_ids, num_buckets = group_ids(dataset.codes[:, known], [cardinalities[i] for i in known])
+        counts = [count_buckets(bucket_ids, num_buckets, dataset.codes[:, i], cardinalities[i], dataset.weights)
+                  for i in feature_is]
+        bucketing.annotate(buckets=num_buckets, pairs=[len(feature_counts.pair_bucket) for feature_counts in counts],
+                           domain_sizes=[cardinalities[i] for i in feature_is])
+    return bucket_ids, num_buckets, counts
+
+
+def feature_kls(dataset, feature_is, priors, accuracies):
+    """Find the KL divergence of feature values against the prior for every distinct row of an encoded dataset.
+
+    The rows are bucketed on all features not in `feature_is`.
+
+    :param dataset: an EncodedDataset, see `bucket_feature`
+    :param feature_is: indices of the 'unknown' features
+    :param priors: dictionary mapping feature index to FeaturePrior
+    :param accuracies: dictionary mapping feature index to accuracy
+    :return: list with an array of KL divergences per distinct row for every feature in `feature_is`
+    """
+    return [values[bucket_ids] for values, bucket_ids in feature_bucket_kls(dataset, feature_is, priors, accuracies)]
+
+
+def feature_bucket_kls(dataset, feature_is, priors, accuracies):
+    """Find the KL divergence of feature values against the prior for every bucket of an encoded dataset.
+
+    This is `feature_kls` before the KL divergences are looked up for every distinct row.
+
+    :param dataset: an EncodedDataset, see `bucket_feature`
+    :param feature_is: indices of the 'unknown' features
+    :param priors: dictionary mapping feature index to FeaturePrior
+    :param accuracies: dictionary mapping feature index to accuracy
+    :return: list with a tuple of the KL divergence of every bucket and the bucket id of every distinct row, for every
+        feature in `feature_is`
+    """
+    bucket_ids, _, feature_counts = bucket_feature(dataset, feature_is)
+    with stage('bucket_kls', features=list(feature_is)):
+        return [(bucket_kls(counts, priors[i], accuracies[i]), bucket_ids)
+                for i, counts in zip(feature_is, feature_counts)]
+
+
+def feature_prob_changes(dataset, feature_is, priors, accuracies):
+    """Find the change in probability of the feature values for every distinct row of an encoded dataset.
+
+    :param dataset: an EncodedDataset, see `bucket_feature`
+    :param feature_is: indices of the 'unknown' features
+    :param priors: dictionary mapping feature index to FeaturePrior
+    :param accuracies: dictionary mapping feature index to accuracy
+    :return: list with an array of probability changes per distinct row for every feature in `feature_is`
+    """
+    _, _, feature_counts = bucket_feature(dataset, feature_is)
+    with stage('bucket_prob_changes', features=list(feature_is)):
+        return [bucket_prob_changes(counts, priors[i], accuracies[i])[counts.row_pair]
+                for i, counts in zip(feature_is, feature_counts)]
+
+
+def feature_metrics(dataset, feature_is, priors, accuracies, metrics):
+    """Compute several statistics of the features in `feature_is` from a single bucketing of the distinct rows.
+
+    :param dataset: an EncodedDataset, see `bucket_feature`
+    :param feature_is: indices of the 'unknown' features
+    :param priors: dictionary mapping feature index to FeaturePrior
+    :param accuracies: dictionary mapping feature index to accuracy
+    :param metrics: collection of the statistics to compute: 'kl' and 'prob_change' give an array per distinct row (see
+        `feature_kls` and `feature_prob_changes`), 'conditional_entropy' gives H(X|known features)
+    :return: list with a dictionary mapping the name of each statistic to its value for every feature in `feature_is`
+    """
+    bucket_ids, _, feature_counts = bucket_feature(dataset, feature_is)
+    results = []
+    for i, counts in zip(feature_is, feature_counts):
+        with stage('feature_metrics', feature=i, metrics=list(metrics)):
+            result = {}
+            if 'kl' in metrics:
+                result['kl'] = bucket_kls(counts, priors[i], accuracies[i])[bucket_ids]
+            if 'prob_change' in metrics:
+                result['prob_change'] = bucket_prob_changes(counts, priors[i], accuracies[i])[counts.row_pair]
+            if 'conditional_entropy' in metrics:
+                result['conditional_entropy'] = bucket_conditional_entropy(counts, dataset.weights.sum())
+        results.append(result)
+    return results
@@ -0,0 +1,221 @@
+"""An on-disk cache of encoded datasets and their buckets.
+
+Encoding a dataset and bucketing its rows only depend on the data, not on the priors and accuracies. When the same
+data is analysed many times, a `DatasetCache` keeps the results of these steps in a directory, keyed by a hash of the
+content of the data, and later runs memory-map them instead of recomputing them:
+
+    cache = DatasetCache('~/.cache/piflib', max_bytes=2 ** 30)
+    dataset = cache.encode(df)
+    cigs = piflib.compute_cigs(dataset, feature_accuracies={3: 0.8})
+    csfs = piflib.compute_csfs(dataset)
+
+The code matrix, weights and row index of the dataset, and the buckets and bucket counts of every feature, are stored
+as `.npy` files. The dictionaries, which can hold arbitrary Python values, are pickled. The cache holds the buckets that
+the calculators use for a single unknown feature; with `n_jobs` > 1 the workers compute their buckets themselves.
+
+When the cache grows beyond `max_bytes`, the least recently used datasets are removed.
+"""
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+
+from piflib.buckets import BucketCounts, compute_buckets
+from piflib.encoding import EncodedDataset, encode
+from piflib.instrumentation import stage
+
+# part of every key, to be changed whenever the layout of the files changes
+_FORMAT = b'piflib-cache-1'
+_KEY_LENGTH = 32
+
+
+def content_hash(data, counts=None):
+    """Hash the content of a table, see `piflib.encoding.encode` for the supported types.
+
+    Two tables with the same column names, types and values get the same hash.
+
+    :param data: the table
+    :param counts: optional name of the column with the multiplicity of every row
+    :return: hexadecimal string
+    """
+    digest = hashlib.blake2b(_FORMAT, digest_size=_KEY_LENGTH // 2)
+    digest.update(repr(counts).encode())
+    if type(data).__module__.split('.')[0] == 'pyarrow':
+        import pyarrow as pa
+
+        # the IPC stream covers the schema, the dictionaries and the validity of every column
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, data.schema) as writer:
+            writer.write(data)
+        digest.update(sink.getvalue())
+    elif isinstance(data, np.ndarray) and data.dtype.kind != 'O':
+        digest.update(repr((data.shape, data.dtype.descr)).encode())
+        digest.update(np.ascontiguousarray(data).view(np.uint8).reshape(-1))
+    else:
+        import pandas as pd
+
+        if isinstance(data, np.ndarray):
+            data = pd.DataFrame(data)
+        for name in data.columns:
+            column = data[name]
+            digest.update(repr((name, str(column.dtype))).encode())
+            if column.dtype.kind == 'O':
+                # hash_pandas_object hashes the string form of mixed objects, so 1 and '1' would collide. The codes
+                # and the types of the distinct values tell them apart, like `encode` does.
+                codes, uniques = pd.factorize(column)
+                digest.update(codes.astype(np.int64))
+                digest.update(repr([(type(value).__module__, type(value).__qualname__) for value in uniques]).encode())
+                column = pd.Series(uniques, dtype=object)
+            digest.update(pd.util.hash_pandas_object(column, index=False).to_numpy())
+    return digest.hexdigest()
+
+
+class DatasetCache:
+    """A directory of encoded datasets and buckets, see the module documentation.
+
+    :param directory: the cache directory. It is created if it does not exist.
+    :param max_bytes: optional upper bound of the size of all files in the cache. When it is exceeded, the least
+        recently used datasets are removed, except the one that was just stored.
+    """
+
+    def __init__(self, directory, max_bytes=None):
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def encode(self, data, counts=None):
+        """Encode a table like `piflib.encoding.encode`, reusing an earlier encoding of the same content.
+
+        :param data: the table
+        :param counts: optional name of the column with the multiplicity of every row
+        :return: a CachedDataset, which the calculators accept in place of the table
+        """
+        key = content_hash(data, counts)
+        path = os.path.join(self.directory, key)
+        with stage('cache_lookup', key=key) as lookup:
+            arrays = _load_arrays(os.path.join(path, 'dataset'))
+            lookup.annotate(hit=arrays is not None)
+        if arrays is None:
+            dataset = encode(data, counts)
+            arrays = {'codes': dataset.codes, 'weights': dataset.weights}
+            if dataset.inverse is not None:
+                arrays['inverse'] = dataset.inverse
+            arrays['extra'] = {'dictionaries': dataset.dictionaries, 'columns': dataset.columns}
+            self._store(key, 'dataset', arrays)
+        else:
+            # a use counts as an access for the eviction
+            os.utime(path)
+        extra = arrays['extra']
+        return CachedDataset(arrays['codes'], extra['dictionaries'], extra['columns'], arrays['weights'],
+                             arrays.get('inverse'), cache=self, key=key)
+
+    def size(self):
+        """The size of all files in the cache, in bytes."""
+        return sum(size for _, size, _ in self._entries())
+
+    def clear(self):
+        """Remove all datasets from the cache."""
+        for key, _, _ in self._entries():
+            shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+
+    def buckets(self, dataset, feature_is):
+        """Return the buckets of a cached dataset, see `piflib.buckets.bucket_feature`, computing them on a miss."""
+        name = 'buckets-' + '-'.join(str(i) for i in feature_is)
+        path = os.path.join(self.directory, dataset.key, name)
+        with stage('cache_lookup', key=dataset.key, features=list(feature_is)) as lookup:
+            arrays = _load_arrays(path)
+            lookup.annotate(hit=arrays is not None)
+        if arrays is None:
+            bucket_ids, num_buckets, counts = compute_buckets(dataset, feature_is)
+            arrays = {'bucket_ids': bucket_ids, 'extra': {'num_buckets': num_buckets}}
+            for position, feature_counts in enumerate(counts):
+                for field, array in zip(BucketCounts._fields, feature_counts):
+                    arrays['{}.{}'.format(position, field)] = array
+            self._store(dataset.key, name, arrays)
+            return bucket_ids, num_buckets, counts
+        counts = [BucketCounts(*(arrays['{}.{}'.format(position, field)] for field in BucketCounts._fields))
+                  for position in range(len(feature_is))]
+        return arrays['bucket_ids'], arrays['extra']['num_buckets'], counts
+
+    def _store(self, key, name, arrays):
+        # `arrays` maps file names to arrays, except for 'extra', which is pickled
+        path = os.path.join(self.directory, key)
+        os.makedirs(path, exist_ok=True)
+        # write to a temporary directory first, so that readers never see a partial entry
+        temporary = tempfile.mkdtemp(dir=path, prefix='.tmp-')
+        try:
+            for array_name, array in arrays.items():
+                if array_name != 'extra':
+                    np.save(os.path.join(temporary, array_name + '.npy'), array)
+            with open(os.path.join(temporary, 'extra.pickle'), 'wb') as f:
+                pickle.dump(arrays['extra'], f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.rename(temporary, os.path.join(path, name))
+        except OSError:
+            # another process stored the same entry first, or the disk is full; the results are simply not cached
+            shutil.rmtree(temporary, ignore_errors=True)
+        os.utime(path)
+        self._evict(keep=key)
+
+    def _entries(self):
+        # (key, size, last access) of every dataset in the cache
+        entries = []
+        for key in os.listdir(self.directory):
+            path = os.path.join(self.directory, key)
+            if len(key) != _KEY_LENGTH or not os.path.isdir(path):
+                continue
+            size = sum(os.path.getsize(os.path.join(root, file))
+                       for root, _, files in os.walk(path) for file in files)
+            entries.append((key, size, os.path.getmtime(path)))
+        return entries
+
+    def _evict(self, keep):
+        if self.max_bytes is None:
+            return
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for key, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if key != keep:
+                shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+                total -= size
+
+
+def _load_arrays(path):
+    # the arrays of a cache entry, memory-mapped, plus the pickled extras, or None if there is no such entry
+    try:
+        with open(os.path.join(path, 'extra.pickle'), 'rb') as f:
+            arrays = {'extra': pickle.load(f)}
+        for file in os.listdir(path):
+            if file.endswith('.npy'):
+                arrays[file[:-len('.npy')]] = _load_array(os.path.join(path, file))
+    except FileNotFoundError:
+        return None
+    return arrays
+
+
+def _load_array(path):
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError:
+        # empty arrays cannot be memory-mapped
+        return np.load(path)
+
+
+class CachedDataset(EncodedDataset):
+    """An EncodedDataset whose buckets are kept in a `DatasetCache`.
+
+    :param cache: the DatasetCache
+    :param key: the content hash of the dataset
+    """
+
+    def __init__(self, codes, dictionaries, columns, weights=None, inverse=None, cache=None, key=None):
+        super().__init__(codes, dictionaries, columns, weights, inverse)
+        self.cache = cache
+        self.key = key
+
+    def cached_buckets(self, feature_is):
+        return self.cache.buckets(self, feature_is)
@@ -0,0 +1,190 @@
+"""The `piflib` command: assess the PIF of many CSV or Parquet files.
+
+    piflib --metric cig --metric csf --format parquet --output-dir out/ 'exports/*.csv'
+
+Every input file is streamed through the calculators, see `piflib.streaming`: a first pass counts its distinct rows, the
+CIG and CSF values are computed on them, and a second pass writes the values of every row chunk by chunk. Next to the
+outputs, `<name>.summary.json` holds the PIF at several percentiles, the timings of the passes and the sizes of the
+buckets. The summary of every file is also printed to standard output, as one line of JSON.
+
+Several files are processed at the same time on a pool of worker processes. The heavy modules are only imported when
+a file is processed, so that the command starts quickly.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+METRICS = ('cig', 'wcig', 'csf')
+FORMATS = {'csv': '.csv', 'parquet': '.parquet'}
+DEFAULT_PERCENTILES = (50, 90, 95, 99, 100)
+
+
+def expand_inputs(patterns):
+    """Expand file names and glob patterns into a list of files, in order and without duplicates.
+
+    :param patterns: file names or glob patterns, which may contain '**'
+    :return: list of file names
+    :raises FileNotFoundError: if a pattern matches no file
+    """
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        matches = [match for match in matches if os.path.isfile(match)]
+        if not matches:
+            raise FileNotFoundError('no input file matches {}'.format(pattern))
+        paths.extend(match for match in matches if match not in paths)
+    return paths
+
+
+def output_stem(path, output_dir=None):
+    """The path of the outputs of an input file, without the suffixes."""
+    name = os.path.basename(path)
+    for extension in ('.csv', '.parquet', '.pq'):
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+            break
+    return os.path.join(os.path.dirname(path) if output_dir is None else output_dir, name)
+
+
+def assess_file(path, output_dir=None, metrics=('cig',), output_format='csv', percentiles=DEFAULT_PERCENTILES,
+                feature_accuracies={}, counts=None, chunksize=100000):
+    """Compute the metrics and the PIF of a CSV or Parquet file and write them next to a JSON summary.
+
+    :param path: the input file, see `piflib.streaming.read_chunks`
+    :param output_dir: the directory of the outputs, defaults to the directory of the input
+    :param metrics: the metrics to write, any of 'cig', 'wcig' and 'csf'
+    :param output_format: 'csv' or 'parquet'
+    :param percentiles: the percentiles of the RIG values to report as the PIF
+    :param feature_accuracies: dictionary mapping the name or index of a feature to its accuracy
+    :param counts: optional name of a column with the multiplicity of every row
+    :param chunksize: the number of rows per chunk
+    :return: the summary, a JSON serializable dictionary
+    """
+    import numpy as np
+
+    from piflib.instrumentation import Trace
+    from piflib.pif_calculator import compute_metrics, weighted_percentile
+    from piflib.streaming import ChunkWriter, count_distinct_rows, read_chunks
+
+    stem = output_stem(path, output_dir)
+    timings = {}
+    start = time.perf_counter()
+    distinct = count_distinct_rows(lambda: read_chunks(path, chunksize), counts)
+    table = distinct.table()
+    if table is None:
+        raise ValueError('{} contains no rows'.format(path))
+    columns = list(distinct.columns)
+    timings['counting'] = time.perf_counter() - start
+
+    accuracies = {}
+    for feature, accuracy in feature_accuracies.items():
+        i = columns.index(feature) if feature in columns else int(feature)
+        accuracies[i] = accuracy
+    start = time.perf_counter()
+    with Trace() as trace:
+        values = compute_metrics(table, sorted(set(metrics) | {'cig'}), feature_accuracies=accuracies)
+    rigs = values['cig'].values.sum(axis=1)
+    pifs = np.atleast_1d(weighted_percentile(rigs, table.weights, list(percentiles)))
+    timings['computing'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    outputs = {metric: stem + '.' + metric + FORMATS[output_format] for metric in metrics}
+    writers = {metric: ChunkWriter(output) for metric, output in outputs.items()}
+    try:
+        for chunk in read_chunks(path, chunksize):
+            rows = distinct.lookup(chunk)
+            for metric, writer in writers.items():
+                writer.write(values[metric].iloc[rows])
+    finally:
+        for writer in writers.values():
+            writer.close()
+    timings['writing'] = time.perf_counter() - start
+
+    summary = {
+        'input': path,
+        'rows': int(table.total) if float(table.total).is_integer() else float(table.total),
+        'distinct_rows': int(table.num_distinct),
+        'columns': [str(column) for column in columns],
+        'pif': {'{:g}'.format(percentile): float(pif) for percentile, pif in zip(percentiles, pifs)},
+        'outputs': outputs,
+        'timings': timings,
+        'buckets': [{'features': [str(columns[i]) for i in event['attributes']['features']],
+                     'buckets': int(event['attributes']['buckets']),
+                     'pairs': [int(pairs) for pairs in event['attributes']['pairs']]}
+                    for event in trace.events if event['name'] == 'bucketing'],
+    }
+    with open(stem + '.summary.json', 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def _parse_accuracy(text):
+    feature, separator, accuracy = text.rpartition('=')
+    if not separator:
+        raise argparse.ArgumentTypeError('expected FEATURE=ACCURACY, got {!r}'.format(text))
+    return feature, float(accuracy)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='piflib', description='Assess the PIF of CSV and Parquet files.')
+    parser.add_argument('inputs', nargs='+', metavar='INPUT', help='CSV or Parquet files, or glob patterns')
+    parser.add_argument('--metric', action='append', choices=METRICS, dest='metrics',
+                        help='a metric to write, can be repeated (default: cig)')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv', help='the format of the outputs')
+    parser.add_argument('--output-dir', help='the directory of the outputs (default: next to every input)')
+    parser.add_argument('--percentile', action='append', type=float, dest='percentiles',
+                        help='a percentile of the RIG values to report, can be repeated (default: 50 90 95 99 100)')
+    parser.add_argument('--accuracy', action='append', type=_parse_accuracy, default=[], metavar='FEATURE=ACCURACY',
+                        help='the accuracy of a feature, given by name or index, can be repeated')
+    parser.add_argument('--counts', help='the column with the multiplicity of every row, for frequency tables')
+    parser.add_argument('--chunksize', type=int, default=100000, help='the number of rows per chunk')
+    parser.add_argument('--workers', type=int, default=1, help='the number of files to process at the same time')
+    args = parser.parse_args(argv)
+
+    try:
+        paths = expand_inputs(args.inputs)
+    except FileNotFoundError as e:
+        parser.error(str(e))
+    stems = [output_stem(path, args.output_dir) for path in paths]
+    if len(set(stems)) < len(stems):
+        parser.error('several inputs would write to the same outputs, use different file names')
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+    options = dict(output_dir=args.output_dir, metrics=tuple(args.metrics or ['cig']), output_format=args.format,
+                   percentiles=tuple(args.percentiles or DEFAULT_PERCENTILES),
+                   feature_accuracies=dict(args.accuracy), counts=args.counts, chunksize=args.chunksize)
+
+    failures = 0
+
+    def report(path, result, error=None):
+        nonlocal failures
+        if error is not None:
+            failures += 1
+            print('piflib: {}: {}'.format(path, error), file=sys.stderr)
+        else:
+            print(json.dumps(result), flush=True)
+
+    if args.workers <= 1 or len(paths) == 1:
+        for path in paths:
+            try:
+                report(path, assess_file(path, **options))
+            except Exception as e:
+                report(path, None, e)
+    else:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+
+        with ProcessPoolExecutor(min(args.workers, len(paths))) as executor:
+            futures = {executor.submit(assess_file, path, **options): path for path in paths}
+            for future in as_completed(futures):
+                try:
+                    report(futures[future], future.result())
+                except Exception as e:
+                    report(futures[future], None, e)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,9 @@
 import collections
-import operator
+
+import numpy as np
+
+from piflib.encoding import encode
+from piflib.instrumentation import traced
 
 
 def calculate_distribution(values, accuracy=1, feature_distribution=None):
@@ -13,7 +17,8 @@ def calculate_distribution(values, accuracy=1, feature_distribution=None):
     feature. We assume that we draw from `values` `accuracy` of the time
     and from `feature_distribution` 1 - `accuracy` of the time.
 
-    The case where `accuracy` < 1 is slow.
+    The case where `accuracy` < 1 visits the whole domain of `feature_distribution`. The calculators use
+    `piflib.buckets.bucket_kls` instead, which only visits the observed values.
     """
     assert accuracy == 1 or feature_distribution is not None
     counts = collections.Counter(values)
@@ -29,14 +34,16 @@ def calculate_distribution(values, accuracy=1, feature_distribution=None):
         return {v: p for v, p in probs if p > 0}
 
 
+@traced
 def complete_feature_priors(df, feature_priors):
+    dataset = encode(df)
     feature_priors = feature_priors.copy()
-    for i in range(len(df.columns)):
+    for i in range(dataset.num_features):
         if i in feature_priors:
             fd = feature_priors[i]
             # TODO: consider if we need to check if complete?
         else:
-            ffs = tuple(map(operator.itemgetter(i), df.values))
-            fd = calculate_distribution(ffs)
+            counts = np.bincount(dataset.codes[:, i], weights=dataset.weights, minlength=dataset.cardinalities[i])
+            fd = dict(zip(dataset.dictionaries[i], (counts / dataset.total).tolist()))
         feature_priors[i] = fd
     return feature_priors
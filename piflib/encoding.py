@@ -0,0 +1,386 @@
+"""Dictionary encoding of tabular data into integer code matrices.
+
+The calculators in this library only ever compare cell values for equality. We therefore replace every column by
+integer codes once, and do all the bucketing on the resulting code matrix with NumPy.
+"""
+import numpy as np
+
+from piflib.instrumentation import stage
+
+_MAX_KEY = np.iinfo(np.int64).max
+_MISSING = object()
+
+
+class EncodedDataset:
+    """A dataset in which every column has been dictionary encoded and identical rows have been collapsed.
+
+    Identical rows always get identical CIG and CSF values, so the calculators only process the distinct rows,
+    weighted by their multiplicity, and expand their results back to the original rows at the end.
+
+    :param codes: 2-D integer array of shape (distinct rows, features). `codes[r, i]` is the position of the value of
+        distinct row `r` in `dictionaries[i]`.
+    :param dictionaries: list with one sequence of distinct values per feature
+    :param columns: the feature names
+    :param weights: the multiplicity of every distinct row. Defaults to 1 for every row.
+    :param inverse: the distinct row of every row of the original data. Defaults to the distinct rows themselves.
+    """
+
+    def __init__(self, codes, dictionaries, columns, weights=None, inverse=None):
+        self.codes = codes
+        self.dictionaries = dictionaries
+        self.columns = columns
+        self.weights = np.ones(codes.shape[0]) if weights is None else weights
+        self.inverse = inverse
+
+    @property
+    def num_rows(self):
+        """The number of rows of the original data."""
+        return self.codes.shape[0] if self.inverse is None else len(self.inverse)
+
+    @property
+    def num_distinct(self):
+        return self.codes.shape[0]
+
+    @property
+    def num_features(self):
+        return self.codes.shape[1]
+
+    @property
+    def cardinalities(self):
+        return [len(dictionary) for dictionary in self.dictionaries]
+
+    @property
+    def total(self):
+        """The number of records, i.e. the sum of the weights."""
+        return self.weights.sum()
+
+    def column_indices(self, names):
+        columns = list(self.columns)
+        return [columns.index(name) for name in names]
+
+    def expand(self, values):
+        """Map per distinct row values back to the rows of the original data."""
+        return values if self.inverse is None else values[self.inverse]
+
+
+def encode(data, counts=None):
+    """Dictionary encode a table and collapse identical rows.
+
+    Every column is factorized on its own, so no object array copy of the whole table is made. Missing values form a
+    category of their own. Columns that are already dictionary encoded (Pandas categoricals and Arrow dictionary
+    arrays) keep their codes; only the values that occur are kept, in the order of their first occurrence.
+
+    The table can also be a frequency table, e.g. the result of a SQL `GROUP BY`: `counts` then names the column
+    that holds the number of records each row stands for. The calculators return one value per row of the frequency
+    table.
+
+    :param data: a Pandas DataFrame, a PyArrow Table or RecordBatch, a NumPy structured array, a 2-D NumPy array
+        (whose columns are named 0, 1, ...), or an already encoded dataset which is returned as is
+    :param counts: optional name of a column with the (positive) multiplicity of every row
+    :return: an EncodedDataset
+    """
+    if isinstance(data, EncodedDataset):
+        return data
+    with stage('encode') as encode_stage:
+        columns, arrays = _columns(data)
+        weights = None
+        if counts is not None:
+            position = list(columns).index(counts)
+            weights = _to_numpy(arrays.pop(position)).astype(float)
+            columns = columns.delete(position) if hasattr(columns, 'delete') else columns[:position] + columns[position + 1:]
+        num_rows = data.num_rows if _is_arrow(data) else len(data)
+        codes = np.empty((num_rows, len(arrays)), dtype=np.intp)
+        dictionaries = []
+        for i, array in enumerate(arrays):
+            codes[:, i], dictionary = encode_column(array)
+            dictionaries.append(dictionary)
+        dataset = deduplicate(codes, dictionaries, columns, weights)
+        encode_stage.annotate(rows=num_rows, distinct_rows=dataset.num_distinct, domain_sizes=dataset.cardinalities)
+    return dataset
+
+
+def encode_column(column):
+    """Dictionary encode a single column.
+
+    :param column: a Pandas Series, a PyArrow Array or ChunkedArray, or a 1-D NumPy array
+    :return: tuple of the codes and the list of distinct values. The values are in the order of their first
+        occurrence; a missing value, if any, comes last.
+    """
+    if _is_arrow(column):
+        return _encode_arrow(column)
+    if getattr(getattr(column, 'dtype', None), 'name', None) == 'category':
+        return _first_occurrence_codes(column.cat.codes.to_numpy(), column.cat.categories)
+    if isinstance(column, np.ndarray) and column.dtype.kind in 'biufcUSmM':
+        values = column
+        missing = np.isnan(column) if column.dtype.kind in 'fcmM' else None
+        if missing is not None and missing.any():
+            values = column[~missing]
+        uniques, codes = np.unique(values, return_inverse=True)
+        if values is not column:
+            column_codes = np.full(len(column), -1, dtype=np.intp)
+            column_codes[~missing] = codes.reshape(-1)
+            codes = column_codes
+        return _first_occurrence_codes(codes.reshape(-1), uniques)
+    import pandas as pd
+    codes, uniques = pd.factorize(column)
+    uniques = list(uniques)
+    missing = codes < 0
+    if missing.any():
+        codes[missing] = len(uniques)
+        uniques.append(np.nan)
+    return codes, uniques
+
+
+def _first_occurrence_codes(codes, dictionary):
+    # renumber the codes of the values that occur in the order of their first occurrence, the order pd.factorize
+    # produces, so that all inputs give identical results. Missing values have the code -1.
+    used, first_rows = np.unique(codes, return_index=True)
+    has_missing = len(used) > 0 and used[0] < 0
+    if has_missing:
+        used, first_rows = used[1:], first_rows[1:]
+    used = used[np.argsort(first_rows, kind='stable')]
+    # the extra last entry maps the negative codes to the missing value
+    rank = np.full(len(dictionary) + 1, len(used), dtype=np.intp)
+    rank[used] = np.arange(len(used))
+    values = dictionary.take(used).to_pylist() if _is_arrow(dictionary) else [dictionary[j] for j in used]
+    if has_missing:
+        values.append(np.nan)
+    return rank[codes], values
+
+
+def _encode_arrow(column):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    chunks = column.chunks if isinstance(column, pa.ChunkedArray) else [column]
+    chunks = [chunk if pa.types.is_dictionary(chunk.type) else chunk.dictionary_encode() for chunk in chunks]
+    if not chunks:
+        return np.empty(0, dtype=np.intp), []
+    dictionary = chunks[0].dictionary
+    unify = not all(chunk.dictionary.equals(dictionary) for chunk in chunks[1:])
+    if unify:
+        # the chunks come with dictionaries of their own, map them into a common one
+        dictionary = pa.concat_arrays([chunk.dictionary for chunk in chunks]).unique()
+    codes = []
+    for chunk in chunks:
+        indices = chunk.indices
+        if indices.null_count:
+            indices = indices.cast(pa.int64()).fill_null(-1)
+        chunk_codes = indices.to_numpy(zero_copy_only=False)
+        if unify:
+            positions = pc.index_in(chunk.dictionary, value_set=dictionary).to_numpy(zero_copy_only=False)
+            chunk_codes = np.where(chunk_codes < 0, -1, positions[chunk_codes])
+        codes.append(chunk_codes.astype(np.intp, copy=False))
+    return _first_occurrence_codes(np.concatenate(codes), dictionary)
+
+
+def _columns(data):
+    # the column names and one array per column of a supported table type
+    if _is_arrow(data):
+        return list(data.column_names), [data.column(i) for i in range(data.num_columns)]
+    if isinstance(data, np.ndarray):
+        if data.dtype.names is not None:
+            return list(data.dtype.names), [data[name] for name in data.dtype.names]
+        if data.ndim != 2:
+            raise ValueError('expected a 2-D or a structured array, got an array with shape {}'.format(data.shape))
+        return list(range(data.shape[1])), [data[:, i] for i in range(data.shape[1])]
+    return data.columns, [data.iloc[:, i] for i in range(data.shape[1])]
+
+
+def _to_numpy(column):
+    if _is_arrow(column):
+        return column.to_numpy()
+    return np.asarray(column)
+
+
+def _is_arrow(data):
+    # without importing PyArrow
+    return type(data).__module__.split('.')[0] == 'pyarrow'
+
+
+class DictionaryEncoder:
+    """Encode DataFrames that arrive one at a time with dictionaries that grow as new values are seen.
+
+    The codes of a value never change, so code matrices of different DataFrames can be combined.
+
+    :param columns: the feature names
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.dictionaries = [[] for _ in columns]
+        self._positions = None
+
+    @property
+    def cardinalities(self):
+        return [len(dictionary) for dictionary in self.dictionaries]
+
+    def encode(self, frame, grow=True, unknown=None):
+        """Encode a DataFrame with the columns of this encoder.
+
+        :param frame: the DataFrame
+        :param grow: whether to add new values to the dictionaries. If False, new values raise a ValueError, or get
+            the code `unknown`.
+        :param unknown: optional code of new values if `grow` is False
+        :return: 2-D integer code matrix
+        """
+        if list(frame.columns) != list(self.columns):
+            raise ValueError('expected the columns {}, got {}'.format(list(self.columns), list(frame.columns)))
+        import pandas as pd
+
+        codes = np.empty(frame.shape, dtype=np.intp)
+        for i in range(len(self.columns)):
+            column_codes, uniques = pd.factorize(frame.iloc[:, i])
+            values = list(uniques)
+            missing = column_codes < 0
+            if missing.any():
+                column_codes[missing] = len(values)
+                values.append(_MISSING)
+            codes[:, i] = self.encode_values(values, i, grow, unknown)[column_codes]
+        return codes
+
+    def encode_values(self, values, i, grow=True, unknown=None):
+        """Find the codes of `values` in the dictionary of feature `i`.
+
+        :param values: sequence of values
+        :param i: the feature index
+        :param grow: whether to add new values to the dictionary. If False, new values raise a ValueError, or get
+            the code `unknown`.
+        :param unknown: optional code of new values if `grow` is False
+        :return: array of codes
+        """
+        positions = self._value_positions(i)
+        dictionary = self.dictionaries[i]
+        codes = np.empty(len(values), dtype=np.intp)
+        for j, value in enumerate(values):
+            key = _MISSING if value is _MISSING or _is_missing(value) else value
+            code = positions.get(key)
+            if code is None:
+                if not grow:
+                    if unknown is not None:
+                        codes[j] = unknown
+                        continue
+                    raise ValueError('unknown value {!r} in column {!r}'.format(value, self.columns[i]))
+                code = positions[key] = len(dictionary)
+                dictionary.append(np.nan if key is _MISSING else value)
+            codes[j] = code
+        return codes
+
+    def __getstate__(self):
+        # the value positions are keyed by a sentinel for missing values, which does not survive pickling
+        state = self.__dict__.copy()
+        state['_positions'] = None
+        return state
+
+    def _value_positions(self, i):
+        if self._positions is None:
+            self._positions = [{_MISSING if _is_missing(value) else value: code for code, value in enumerate(dictionary)}
+                               for dictionary in self.dictionaries]
+        return self._positions[i]
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and value != value)
+
+
+def deduplicate(codes, dictionaries, columns, weights=None):
+    """Collapse the identical rows of a code matrix.
+
+    The distinct rows keep the order of their first occurrence, so that the calculators see values in the same order
+    as in the original data.
+
+    :param codes: 2-D integer array of shape (rows, features)
+    :param dictionaries: list with one sequence of distinct values per feature
+    :param columns: the feature names
+    :param weights: optional multiplicity of every row
+    :return: an EncodedDataset
+    """
+    ids, num_distinct = group_ids(codes, [len(dictionary) for dictionary in dictionaries])
+    ids, first_rows = first_occurrence_order(ids, num_distinct)
+    distinct_weights = np.bincount(ids, weights=weights, minlength=num_distinct).astype(float)
+    return EncodedDataset(codes[first_rows], dictionaries, columns, distinct_weights, ids)
+
+
+def first_occurrence_order(ids, num_groups):
+    """Renumber group ids in order of first occurrence.
+
+    :param ids: group ids in [0, num_groups)
+    :param num_groups: the number of groups
+    :return: tuple of the renumbered ids and the index of the first occurrence of every group
+    """
+    # the first row of a group is the smallest row index among its rows; grouping with an unstable sort and taking the
+    # minimum of every group is much faster than the stable sort of np.unique(..., return_index=True)
+    rows = np.argsort(ids)
+    starts = np.zeros(num_groups, dtype=np.intp)
+    np.cumsum(np.bincount(ids, minlength=num_groups)[:-1], out=starts[1:])
+    first_rows = np.minimum.reduceat(rows, starts) if num_groups else starts
+    order = np.argsort(first_rows)
+    rank = np.empty(num_groups, dtype=np.intp)
+    rank[order] = np.arange(num_groups)
+    return rank[ids], first_rows[order]
+
+
+def group_ids(codes, cardinalities):
+    """Assign the same id to all rows of `codes` with identical values.
+
+    The columns are packed into a single int64 key with mixed-radix arithmetic. Whenever the next column would overflow
+    the key, the partial key is first compressed to dense ids.
+
+    :param codes: 2-D integer array, one column per feature
+    :param cardinalities: upper bound (exclusive) of the codes in each column
+    :return: tuple of an array of group ids in [0, num_groups) and num_groups. Ids follow the lexicographic order of
+        the rows.
+    """
+    num_rows, num_columns = codes.shape
+    if num_columns == 0:
+        return np.zeros(num_rows, dtype=np.intp), min(num_rows, 1)
+    key = codes[:, 0].astype(np.int64)
+    radix = max(int(cardinalities[0]), 1)
+    for i in range(1, num_columns):
+        cardinality = max(int(cardinalities[i]), 1)
+        if radix * cardinality > _MAX_KEY:
+            key, radix = _compress(key)
+        key = key * cardinality + codes[:, i]
+        radix *= cardinality
+    return _compress(key)
+
+
+def _compress(key):
+    uniques, ids = np.unique(key, return_inverse=True)
+    return ids.reshape(-1), len(uniques)
+
+
+def mix64(x):
+    """Scramble unsigned 64-bit integers with the splitmix64 finalizer, a fast hash with good avalanche behaviour."""
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+
+def hash_cells(codes, seed=0):
+    """Hash every cell of a code matrix, salted by its column.
+
+    The sum of the hashes of a row (wrapping around) is a key of the whole row; see `leave_one_out_keys` for the keys
+    of the rows without one feature.
+
+    :param codes: 2-D integer array of shape (rows, features)
+    :param seed: the seed of the hash function
+    :return: array of unsigned 64-bit hashes of shape (rows, features)
+    """
+    salts = mix64(np.arange(1, codes.shape[1] + 1, dtype=np.uint64) + np.uint64(seed << 32))
+    return mix64(codes.astype(np.uint64) + salts)
+
+
+def leave_one_out_keys(codes, seed=0):
+    """Hash the leave-one-out bucket of every feature of every row of a code matrix.
+
+    Two rows get the same key for feature i if they agree on all other features. Different buckets get the same key
+    with a probability of about 2^-64.
+
+    :param codes: 2-D integer array of shape (rows, features)
+    :param seed: the seed of the hash function
+    :return: array of unsigned 64-bit keys of shape (rows, features)
+    """
+    hashes = hash_cells(codes, seed)
+    # the sum over all features wraps around; subtracting the hash of a feature leaves the key of the other features
+    return hashes.sum(axis=1, dtype=np.uint64)[:, None] - hashes
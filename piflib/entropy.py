@@ -1,8 +1,107 @@
-"""Implement various entropy measures to improve CIG, RIG."""
+"""Implement various entropy measures to improve CIG, RIG.
+
+All functions accept a Pandas DataFrame or an encoded dataset (see `piflib.encoding.encode`). The distributions are
+computed on the distinct rows of the data, weighted by their multiplicity. Missing values (None or NaN) are an outcome
+of their own, as in the CIG calculators; rows with missing values are not dropped.
+
+Joint entropies are memoized in `entropy_cache`, so that e.g. the H(X) that `conditional_entropy` needs for the mutual
+information is only computed once. Entries are keyed by the identity of the encoded dataset, so pass the result of
+`piflib.encoding.encode` instead of a DataFrame to share them between calls. Encoded datasets must not be modified.
+`entropy` of a DataFrame only encodes the given columns and bypasses the cache.
+"""
+import collections
+import functools
 import itertools
+import threading
+import weakref
+
 import numpy as np
 import pandas as pd
 
+from piflib.encoding import encode, encode_column, group_ids
+from piflib.instrumentation import stage, traced
+
+CacheInfo = collections.namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class EntropyCache:
+    """Least recently used cache of joint entropies.
+
+    The entries are keyed by the identity of an encoded dataset and the set of columns. They are dropped when the
+    dataset is garbage collected. A DataFrame is encoded anew by every call, so only callers that pass the same encoded
+    dataset to several calls get hits across calls.
+
+    :param maxsize: the maximum number of cached entropies. None means unbounded, 0 disables the cache.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._datasets = {}
+        self._lock = threading.Lock()
+
+    def entropy(self, dataset, columns, compute):
+        """Return the cached entropy of `columns` in `dataset`, computing it with `compute()` on a miss."""
+        key = (id(dataset), frozenset(columns))
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+        H = compute()
+        if self.maxsize == 0:
+            return H
+        with self._lock:
+            if id(dataset) not in self._datasets:
+                self._datasets[id(dataset)] = weakref.finalize(dataset, self._forget, id(dataset))
+            self._entries[key] = H
+            self._evict()
+        return H
+
+    def info(self):
+        """Report the cache statistics."""
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
+
+    def resize(self, maxsize):
+        """Change the maximum number of cached entropies, evicting the least recently used ones if necessary."""
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def clear(self):
+        """Remove all entries and reset the statistics."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def _evict(self):
+        while self.maxsize is not None and len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _forget(self, dataset_id):
+        with self._lock:
+            self._datasets.pop(dataset_id, None)
+            for key in [key for key in self._entries if key[0] == dataset_id]:
+                del self._entries[key]
+
+
+entropy_cache = EntropyCache()
+
+
+def cache_info():
+    """Report the hits and misses of the entropy cache."""
+    return entropy_cache.info()
+
+
+def _marginal_counts(dataset, columns):
+    indices = dataset.column_indices(columns)
+    cardinalities = dataset.cardinalities
+    ids, num_groups = group_ids(dataset.codes[:, indices], [cardinalities[i] for i in indices])
+    return ids, np.bincount(ids, weights=dataset.weights, minlength=num_groups)
+
 
 def get_marginal(df, columns):
     """Return joint distribution of given columns.
@@ -10,12 +109,17 @@ def get_marginal(df, columns):
     :param df: DataFrame that contains all observations
     :param columns: list of features to get joint distribution from
 
-    :return dist: dict of outcome and corresponding probability
+    :return dist: dict of outcome and corresponding probability. Missing values are an outcome of their own, NaN.
     """
-    feature = list(df.columns)[0]
-    d = pd.DataFrame(df.groupby(columns)[feature].count() / len(df))
-    dist = d[feature].to_dict()
-    return dist
+    dataset = encode(_select(df, columns))
+    indices = dataset.column_indices(columns)
+    ids, counts = _marginal_counts(dataset, columns)
+    _, first_rows = np.unique(ids, return_index=True)
+    outcomes = [tuple(dataset.dictionaries[i][code] for i, code in zip(indices, row))
+                for row in dataset.codes[first_rows][:, indices]]
+    if len(columns) == 1:
+        outcomes = [outcome[0] for outcome in outcomes]
+    return dict(zip(outcomes, (counts / dataset.total).tolist()))
 
 
 def entropy(df, rvs):
@@ -24,11 +128,47 @@ def entropy(df, rvs):
     :param df: Dataframe that contains all data
     :param rvs: list of feature names
 
-    :return H: entropy of rvs
+    :return H: entropy of rvs, with missing values as an outcome of their own
     """
-    dist = get_marginal(df, rvs)
-    ps = np.array(list(dist.values()))
-    H = -sum(ps * np.log2(ps))
+    if isinstance(df, pd.DataFrame):
+        # the encoded dataset of a DataFrame would be thrown away, so skip the cache and the deduplication
+        return _frame_entropy(df, rvs)
+    dataset = encode(df)
+    return entropy_cache.entropy(dataset, rvs, lambda: _entropy(dataset, rvs))
+
+
+def _frame_entropy(df, rvs):
+    with stage('entropy', columns=list(rvs)) as computing:
+        columns = [encode_column(df[column]) for column in dict.fromkeys(rvs)]
+        codes = [column_codes for column_codes, _ in columns]
+        cardinalities = [max(len(dictionary), 1) for _, dictionary in columns]
+        if np.prod(cardinalities, dtype=float) <= 4 * max(len(df), 1):
+            # few possible outcomes: count them directly, without sorting
+            counts = np.bincount(np.ravel_multi_index(codes, cardinalities), minlength=int(np.prod(cardinalities)))
+        else:
+            ids, num_groups = group_ids(np.column_stack(codes), cardinalities)
+            counts = np.bincount(ids, minlength=num_groups)
+        computing.annotate(outcomes=len(counts))
+        return _entropy_from_counts(counts, len(df))
+
+
+def _select(df, columns):
+    # only encode the columns that are needed; encoded datasets are used as they are, to share the cache
+    if isinstance(df, pd.DataFrame):
+        return df[list(dict.fromkeys(columns))]
+    return df
+
+
+def _entropy(dataset, rvs):
+    with stage('entropy', columns=list(rvs)) as computing:
+        _, counts = _marginal_counts(dataset, rvs)
+        computing.annotate(outcomes=len(counts))
+        return _entropy_from_counts(counts, dataset.total)
+
+
+def _entropy_from_counts(counts, total):
+    ps = counts[counts > 0] / total
+    H = -np.sum(ps * np.log2(ps))
     return H
 
 
@@ -41,6 +181,7 @@ def mutual_information(df, rvs_X, rvs_Y):
 
     :return I: mutual information
     """
+    df = encode(_select(df, rvs_X + rvs_Y))
     H_X = entropy(df, rvs_X)
     H_Y = entropy(df, rvs_Y)
     H_XY = entropy(df, rvs_X + rvs_Y)
@@ -48,6 +189,64 @@ def mutual_information(df, rvs_X, rvs_Y):
     return(MI)
 
 
+@traced
+def mutual_information_matrix(df, executor=None, block_size=256):
+    """Compute the mutual information between all pairs of features in the dataset.
+
+    Every pairwise contingency table is counted with a single `np.bincount` on the combined codes of the two features,
+    and every marginal entropy is computed once.
+
+    :param df: Dataframe that contains all data
+    :param executor: optional `concurrent.futures` executor to spread blocks of feature pairs over. Wide tables benefit
+        from a thread or process pool.
+    :param block_size: number of feature pairs per task
+
+    :return mi_df: symmetric DataFrame with the mutual information I(X;Y) of every pair of features. The diagonal holds
+        the entropies H(X).
+    """
+    df = encode(df)
+    num_features = df.num_features
+    entropies = np.array([entropy(df, [name]) for name in df.columns])
+    pairs = list(itertools.combinations(range(num_features), 2))
+    blocks = [pairs[start:start + block_size] for start in range(0, len(pairs), block_size)]
+    tasks = [_pair_block(df, block) for block in blocks]
+    joint_entropies = functools.partial(_joint_entropies, df.weights, df.total)
+    mi = np.diag(entropies)
+    with stage('joint_entropies', pairs=len(pairs), blocks=len(blocks)):
+        if executor is None:
+            results = [joint_entropies(*task) for task in tasks]
+        else:
+            results = executor.map(joint_entropies, *zip(*tasks)) if tasks else []
+        for block, block_entropies in zip(blocks, results):
+            for (i, j), H_XY in zip(block, block_entropies):
+                mi[i, j] = mi[j, i] = entropies[i] + entropies[j] - H_XY
+    return pd.DataFrame(mi, index=df.columns, columns=df.columns)
+
+
+def _pair_block(dataset, pairs):
+    # only ship the columns a block needs to the worker
+    indices = sorted(set(itertools.chain.from_iterable(pairs)))
+    position = {index: i for i, index in enumerate(indices)}
+    cardinalities = dataset.cardinalities
+    return (dataset.codes[:, indices],
+            [cardinalities[i] for i in indices],
+            [(position[i], position[j]) for i, j in pairs])
+
+
+def _joint_entropies(weights, total, codes, cardinalities, pairs):
+    joint_entropies = []
+    for i, j in pairs:
+        num_cells = cardinalities[i] * cardinalities[j]
+        cells = codes[:, i].astype(np.int64) * cardinalities[j] + codes[:, j]
+        if num_cells > max(4 * len(cells), 1 << 20):
+            # the contingency table would be mostly empty
+            _, cells = np.unique(cells, return_inverse=True)
+            num_cells = 0
+        counts = np.bincount(cells.reshape(-1), weights=weights, minlength=num_cells)
+        joint_entropies.append(_entropy_from_counts(counts, total))
+    return joint_entropies
+
+
 def pairwise_mutual_information(df):
     """Compute the mutual information between all pairs of features in the dataset.
 
@@ -59,26 +258,33 @@ def pairwise_mutual_information(df):
     :return y: list of names of second feature
     :return mi_xy: list of mutual information between every pair of feature names
     """
+    return _pairwise_view(mutual_information_matrix(df))
+
+
+def _pairwise_view(mi_df):
     x = []
     y = []
     mi_xy = []
-    for feature_1, feature_2 in itertools.combinations(df.columns, 2):
+    for (i, feature_1), (j, feature_2) in itertools.combinations(enumerate(mi_df.columns), 2):
         x.append(feature_1)
         y.append(feature_2)
-        mi_xy.append(mutual_information(df, [feature_1], [feature_2]))
+        mi_xy.append(mi_df.iat[i, j])
     return x, y, mi_xy
 
 
-def create_entropy_mi_table(df, round_digits=2):
+@traced
+def create_entropy_mi_table(df, round_digits=2, executor=None):
     """Create a dataframe containing the individual features' entropies and the pairwise mutual information.
 
     :param df: Dataframe that contains all data
     :round_digits: integer that specifies the number of decimal to disply
+    :param executor: optional `concurrent.futures` executor, see `mutual_information_matrix`
 
     :return emi_df: DataFrame that contains all pairs of mutual information
     """
-    x, y, mi = pairwise_mutual_information(df)
-    entropies = {name: entropy(df, [name]) for name in df}
+    mi_df = mutual_information_matrix(df, executor=executor)
+    x, y, mi = _pairwise_view(mi_df)
+    entropies = dict(zip(mi_df.columns, np.diag(mi_df.values)))
     hx = [entropies[i] for i in x]
     hy = [entropies[i] for i in y]
     emi_df = pd.DataFrame({'X': x, 'Y': y, 'H(X)': hx, 'H(Y)': hy, 'I(X;Y)': mi}).round(round_digits)
@@ -94,12 +300,14 @@ def conditional_entropy(df, rvs_X, rvs_Y):
 
     :return H_XgY: conditional entropy
     """
+    df = encode(_select(df, rvs_X + rvs_Y))
     MI_XY = mutual_information(df, rvs_X, rvs_Y)
     H_X = entropy(df, rvs_X)
     H_XgY = H_X - MI_XY
     return H_XgY
 
 
+@traced
 def create_conditional_entropy_table(df, round_digits=2):
     """Create a dataframe containing the individual features' entropies and the conditional entropy
     given the rest of all features.
@@ -109,9 +317,10 @@ def create_conditional_entropy_table(df, round_digits=2):
 
     :return cond_df: DataFrame that contains conditional entropy of every feature given the rest of features
     """
+    df = encode(df)
     x, y, hx, hy, co_en = [], [], [], [], []
     for feature in df.columns:
-        f_ys = list(df.columns.drop(feature))
+        f_ys = [column for column in df.columns if column != feature]
         x.append(feature)
         y.append(f_ys)
         hx.append(entropy(df, [feature]))
@@ -125,6 +334,7 @@ def _set_diff(rv, rvs):
     return list(set(rvs) - set(rv))
 
 
+@traced
 def dual_total_correlation(df, rvs):
     """Compute dual total correlation of given rvs.
 
@@ -135,13 +345,14 @@ def dual_total_correlation(df, rvs):
 
     :return tc: total correlation
     """
-
+    df = encode(df)
     sum_cond_entropy = sum(conditional_entropy(df, [rv], _set_diff([rv], rvs)) for rv in rvs)
     joint_entropy = entropy(df, rvs)
     tc = joint_entropy - sum_cond_entropy
     return tc
 
 
+@traced
 def residual_entropy(df, rvs):
     """Compute dual total correlation of given rvs.
 
@@ -152,5 +363,6 @@ def residual_entropy(df, rvs):
 
     :return sum_cond_entropy: residual entropy
     """
+    df = encode(df)
     sum_cond_entropy = sum(conditional_entropy(df, [rv], _set_diff([rv], rvs)) for rv in rvs)
     return sum_cond_entropy
@@ -0,0 +1,107 @@
+"""A compact representation of CIG values.
+
+All rows of a bucket share the CIG value of the bucket, so a feature has only as many distinct CIG values as it has
+buckets. `FactoredCigs` stores, for every feature, the value of every bucket and the bucket of every distinct row of the
+dataset, plus the distinct row of every row. The indexes use the smallest sufficient unsigned integer type. RIGs and
+the PIF are computed per distinct row, weighted by the number of rows, without ever expanding the CIG values to a
+dense table.
+"""
+import numpy as np
+import pandas as pd
+
+
+def compact_index(index, size):
+    """Store an index into an array of `size` elements with the smallest sufficient unsigned integer type."""
+    return np.asarray(index).astype(np.min_scalar_type(max(size - 1, 0)), copy=False)
+
+
+class FactoredCigs:
+    """CIG values in factored form, see the module documentation.
+
+    Use `compute_cigs(..., factored=True)` to create one.
+
+    :param columns: the feature names
+    :param values: list with the CIG value of every bucket, for every feature
+    :param buckets: list with the bucket of every distinct row, for every feature
+    :param rows: the distinct row of every row, or None if every row is distinct
+    """
+
+    def __init__(self, columns, values, buckets, rows=None):
+        self.columns = columns
+        self.values = values
+        self.buckets = buckets
+        self.rows = rows
+
+    @classmethod
+    def from_distinct(cls, dataset, values, buckets=None, dtype=np.float64):
+        """Factor per distinct row CIG values of an encoded dataset.
+
+        :param dataset: an EncodedDataset
+        :param values: list with an array of CIG values for every feature, either per bucket or, without `buckets`,
+            per distinct row
+        :param buckets: optional list with the bucket of every distinct row, for every feature
+        :param dtype: the floating point type to store the values in
+        """
+        factored_values, factored_buckets = [], []
+        for i, feature_values in enumerate(values):
+            if buckets is None:
+                feature_values, feature_buckets = np.unique(feature_values, return_inverse=True)
+            else:
+                feature_buckets = buckets[i]
+            factored_values.append(np.asarray(feature_values, dtype=dtype))
+            factored_buckets.append(compact_index(feature_buckets.reshape(-1), len(feature_values)))
+        rows = None if dataset.inverse is None else compact_index(dataset.inverse, dataset.num_distinct)
+        return cls(dataset.columns, factored_values, factored_buckets, rows)
+
+    @property
+    def num_rows(self):
+        return len(self.buckets[0]) if self.rows is None else len(self.rows)
+
+    @property
+    def num_distinct(self):
+        return len(self.buckets[0])
+
+    @property
+    def nbytes(self):
+        """The memory used by the arrays, in bytes."""
+        arrays = self.values + self.buckets + ([] if self.rows is None else [self.rows])
+        return sum(array.nbytes for array in arrays)
+
+    def feature(self, i):
+        """Return the CIG value of every row for feature `i`."""
+        values = self.values[i][self.buckets[i]]
+        return values if self.rows is None else values[self.rows]
+
+    def to_frame(self):
+        """Expand the CIG values into a dense DataFrame, like the one `compute_cigs` returns."""
+        return pd.DataFrame(np.column_stack([self.feature(i) for i in range(len(self.columns))]), columns=self.columns)
+
+    def distinct_rigs(self):
+        """Return the RIG of every distinct row."""
+        rigs = np.zeros(self.num_distinct)
+        for values, buckets in zip(self.values, self.buckets):
+            rigs += values[buckets]
+        return rigs
+
+    def rigs(self):
+        """Return the RIG of every row."""
+        rigs = self.distinct_rigs()
+        return rigs if self.rows is None else rigs[self.rows]
+
+    def pif(self, percentile, counts=None):
+        """Compute the PIF, see `compute_pif`.
+
+        :param percentile: percentile, or sequence of percentiles, between 0 and 100
+        :param counts: optional number of entities every row stands for
+        :return: the PIF, or an array with one PIF per percentile
+        """
+        # imported here, pif_calculator imports this module
+        from piflib.pif_calculator import weighted_percentile
+
+        if self.rows is None:
+            multiplicities = np.ones(self.num_distinct) if counts is None else np.asarray(counts)
+        else:
+            multiplicities = np.bincount(self.rows, weights=counts, minlength=self.num_distinct)
+        rigs = self.distinct_rigs()
+        present = multiplicities > 0
+        return weighted_percentile(rigs[present], multiplicities[present], percentile)
@@ -0,0 +1,290 @@
+"""Incremental maintenance of CIGs, CSFs and the PIF of a dataset that changes by appending and deleting rows.
+
+A `PifIndex` keeps the distinct rows of the dataset with their multiplicities, and for every feature the leave-one-out
+bucket of every distinct row, the number of records in every bucket and the KL divergence of every bucket. Adding or
+removing rows only changes the counts of the buckets these rows fall into, so only the KL divergences of those buckets
+are recomputed. Features whose prior is derived from the data are the exception: their prior moves with every change,
+so all their buckets are recomputed, but the bucketing itself is still reused.
+
+Distinct rows and buckets are found through 64-bit hashes of their codes. Every hash match is verified against the
+codes of the matched row, and a collision triggers a rebuild of the hash tables with a new seed, so lookups are exact.
+"""
+import numpy as np
+import pandas as pd
+
+from piflib.buckets import BucketCounts, FeaturePrior, bucket_kls, bucket_prob_changes, prior_probabilities
+from piflib.encoding import DictionaryEncoder, deduplicate, first_occurrence_order, group_ids, hash_cells
+from piflib.pif_calculator import weighted_percentile
+
+
+class _HashCollision(Exception):
+    pass
+
+
+class _KeyIndex:
+    """Map 64-bit keys to ids: a sorted array for the bulk, plus a dictionary for recent additions."""
+
+    def __init__(self, keys, ids):
+        order = np.argsort(keys, kind='stable')
+        self._keys = keys[order]
+        self._ids = ids[order]
+        self._recent = {}
+        if len(keys) > 1 and (self._keys[1:] == self._keys[:-1]).any():
+            raise _HashCollision()
+
+    def lookup(self, keys):
+        """Return the id of every key, or -1 for unknown keys."""
+        positions = np.minimum(np.searchsorted(self._keys, keys), max(len(self._keys) - 1, 0))
+        if len(self._keys):
+            ids = np.where(self._keys[positions] == keys, self._ids[positions], -1)
+        else:
+            ids = np.full(len(keys), -1, dtype=np.intp)
+        if self._recent:
+            for i in np.flatnonzero(ids < 0):
+                ids[i] = self._recent.get(int(keys[i]), -1)
+        return ids
+
+    def add(self, keys, ids):
+        """Add new keys. Raises _HashCollision if a key is already present."""
+        if (self.lookup(keys) >= 0).any() or len(set(keys.tolist())) < len(keys):
+            raise _HashCollision()
+        self._recent.update(zip(keys.tolist(), ids.tolist()))
+        if len(self._recent) > max(1024, len(self._keys) >> 3):
+            keys = np.concatenate([self._keys, np.fromiter(self._recent.keys(), np.uint64, len(self._recent))])
+            ids = np.concatenate([self._ids, np.fromiter(self._recent.values(), np.intp, len(self._recent))])
+            self.__init__(keys, ids)
+
+
+class PifIndex:
+    """The CIGs, CSFs and PIF of a dataset, maintained under row insertions and deletions.
+
+    The results are the same as a full recomputation with `compute_cigs` and `compute_csfs` on the current data. For
+    data that only grows they are equal up to floating point rounding; after deletions they can differ in the last
+    bits, as floating point sums may be taken in a different order.
+
+    :param data: a Pandas DataFrame with the initial data. It defines the columns.
+    :param feature_priors: optional dictionary mapping the feature index to an assumed prior. Features without a
+        given prior use the distribution of the current data.
+    :param feature_accuracies: optional dictionary mapping the feature index to the accuracy of the feature
+    :param counts: optional name of a column with the multiplicity of every row, for frequency tables. It applies to
+        all DataFrames passed to this index.
+    """
+
+    def __init__(self, data, feature_priors={}, feature_accuracies={}, counts=None):
+        self.counts = counts
+        columns = data.columns if counts is None else data.columns.drop(counts)
+        self.encoder = DictionaryEncoder(columns)
+        num_features = len(columns)
+        self.feature_priors = dict(feature_priors)
+        self.feature_accuracies = {i: feature_accuracies.get(i, 1) for i in range(num_features)}
+        self.codes = np.empty((0, num_features), dtype=np.intp)
+        self.weights = np.empty(0)
+        self._row_buckets = [np.empty(0, dtype=np.intp) for _ in range(num_features)]
+        self._bucket_rows = [np.empty(0, dtype=np.intp) for _ in range(num_features)]
+        self._bucket_totals = [np.empty(0) for _ in range(num_features)]
+        self._bucket_kls = [np.empty(0) for _ in range(num_features)]
+        self._value_counts = [np.empty(0) for _ in range(num_features)]
+        self._priors = [None] * num_features
+        self._dirty_buckets = [set() for _ in range(num_features)]
+        self._seed = 0
+        self._build_indexes()
+        self.add_rows(data)
+
+    @property
+    def columns(self):
+        return self.encoder.columns
+
+    @property
+    def num_features(self):
+        return len(self.columns)
+
+    def add_rows(self, data):
+        """Add the rows of a DataFrame to the dataset."""
+        batch = self._encode(data, grow=True)
+        rows = self._retry(self._find_rows, batch.codes)
+        new = rows < 0
+        if new.any():
+            new_rows = np.arange(len(self.weights), len(self.weights) + new.sum())
+            self._retry(self._insert_rows, batch.codes[new], new_rows)
+            rows[new] = new_rows
+        self._change_counts(rows, batch.weights)
+
+    def remove_rows(self, data):
+        """Remove the rows of a DataFrame from the dataset. Every row has to be present."""
+        batch = self._encode(data, grow=False)
+        rows = self._retry(self._find_rows, batch.codes)
+        if (rows < 0).any() or (self.weights[rows] < batch.weights).any():
+            raise ValueError('cannot remove rows that are not in the index')
+        self._change_counts(rows, -batch.weights)
+
+    def cigs(self, data=None):
+        """Return the current CIG values.
+
+        :param data: optional DataFrame with rows of the dataset. If not given, the CIGs of every distinct row are
+            returned, in the order of `table()`.
+        :return: a Pandas DataFrame with the CIG values of the rows
+        """
+        self._refresh()
+        rows, index = self._query_rows(data)
+        values = [self._bucket_kls[i][self._row_buckets[i][rows]] for i in range(self.num_features)]
+        return pd.DataFrame(np.column_stack(values), columns=self.columns, index=index)
+
+    def csfs(self, data=None):
+        """Return the current CSF values.
+
+        :param data: optional DataFrame with rows of the dataset. If not given, the CSFs of every distinct row are
+            returned, in the order of `table()`.
+        :return: a Pandas DataFrame with the CSF values of the rows
+        """
+        rows, index = self._query_rows(data)
+        values = []
+        for i in range(self.num_features):
+            counts = BucketCounts(self._row_buckets[i][rows], self.codes[rows, i], self.weights[rows],
+                                  self._bucket_totals[i], None)
+            values.append(bucket_prob_changes(counts, self._prior(i), self.feature_accuracies[i]))
+        return pd.DataFrame(np.column_stack(values), columns=self.columns, index=index)
+
+    def table(self):
+        """Return the distinct rows of the dataset and their counts.
+
+        :return: a Pandas DataFrame with the distinct rows, and a Series with the number of records per row
+        """
+        rows = np.flatnonzero(self.weights > 0)
+        frame = pd.DataFrame({column: np.asarray(self.encoder.dictionaries[i], dtype=object)[self.codes[rows, i]]
+                              for i, column in enumerate(self.columns)})
+        return frame, pd.Series(self.weights[rows])
+
+    def pif(self, percentile):
+        """Return the current PIF, see `piflib.pif_calculator.compute_pif`."""
+        rigs = self.cigs().sum(axis=1).values
+        return weighted_percentile(rigs, self.weights[self.weights > 0], percentile)
+
+    def _encode(self, data, grow):
+        weights = None
+        if self.counts is not None:
+            weights = np.asarray(data[self.counts], dtype=float)
+            data = data.drop(columns=self.counts)
+        codes = self.encoder.encode(data, grow=grow)
+        return deduplicate(codes, self.encoder.dictionaries, self.columns, weights)
+
+    def _query_rows(self, data):
+        if data is None:
+            return np.flatnonzero(self.weights > 0), None
+        if self.counts is not None and self.counts in data.columns:
+            data = data.drop(columns=self.counts)
+        rows = self._retry(self._find_rows, self.encoder.encode(data, grow=False))
+        if (rows < 0).any() or (self.weights[rows] == 0).any():
+            raise ValueError('rows are not in the index')
+        return rows, data.index
+
+    def _change_counts(self, rows, deltas):
+        self.weights[rows] += deltas
+        for i in range(self.num_features):
+            buckets = self._row_buckets[i][rows]
+            np.add.at(self._bucket_totals[i], buckets, deltas)
+            self._dirty_buckets[i].update(buckets.tolist())
+            value_counts = self._value_counts[i]
+            if len(value_counts) < len(self.encoder.dictionaries[i]):
+                value_counts = np.concatenate([value_counts, np.zeros(len(self.encoder.dictionaries[i]) - len(value_counts))])
+            np.add.at(value_counts, self.codes[rows, i], deltas)
+            self._value_counts[i] = value_counts
+            if i not in self.feature_priors:
+                self._priors[i] = None
+
+    def _prior(self, i):
+        prior = self._priors[i]
+        cardinality = len(self.encoder.dictionaries[i])
+        if prior is not None and len(prior.probabilities) == cardinality:
+            return prior
+        if i in self.feature_priors:
+            given = self.feature_priors[i]
+            prior = FeaturePrior(prior_probabilities(self.encoder.dictionaries[i], given),
+                                 sum(prob for prob in given.values() if prob > 0))
+        else:
+            # the same probabilities as `complete_feature_priors` computes on the current data
+            probabilities = self._value_counts[i] / self.weights.sum()
+            prior = FeaturePrior(probabilities, sum(prob for prob in probabilities.tolist() if prob > 0))
+            # every bucket has to be compared against the moved prior
+            self._dirty_buckets[i] = set(range(len(self._bucket_totals[i])))
+        self._priors[i] = prior
+        return prior
+
+    def _refresh(self):
+        for i in range(self.num_features):
+            prior = self._prior(i)
+            if not self._dirty_buckets[i]:
+                continue
+            dirty = np.fromiter(self._dirty_buckets[i], dtype=np.intp, count=len(self._dirty_buckets[i]))
+            self._bucket_kls[i][dirty] = 0
+            rows = np.flatnonzero(np.isin(self._row_buckets[i], dirty) & (self.weights > 0))
+            # rows are in order of insertion, which is the order of first occurrence of a full recomputation
+            rows = rows[np.argsort(self._row_buckets[i][rows], kind='stable')]
+            buckets, pair_bucket = np.unique(self._row_buckets[i][rows], return_inverse=True)
+            counts = BucketCounts(pair_bucket.reshape(-1), self.codes[rows, i], self.weights[rows],
+                                  self._bucket_totals[i][buckets], None)
+            self._bucket_kls[i][buckets] = bucket_kls(counts, prior, self.feature_accuracies[i])
+            self._dirty_buckets[i] = set()
+
+    def _retry(self, step, *args):
+        while True:
+            try:
+                return step(*args)
+            except _HashCollision:
+                self._seed += 1
+                self._build_indexes()
+
+    def _build_indexes(self):
+        while True:
+            try:
+                self._row_index = _KeyIndex(self._row_keys(self.codes), np.arange(len(self.codes)))
+                self._bucket_indexes = [
+                    _KeyIndex(self._bucket_keys(self.codes[self._bucket_rows[i]], i), np.arange(len(self._bucket_rows[i])))
+                    for i in range(self.num_features)]
+                return
+            except _HashCollision:
+                self._seed += 1
+
+    def _hash_terms(self, codes):
+        return hash_cells(codes, self._seed)
+
+    def _row_keys(self, codes):
+        return self._hash_terms(codes).sum(axis=1, dtype=np.uint64)
+
+    def _bucket_keys(self, codes, i):
+        # the hash of a row without feature i, as in `piflib.encoding.leave_one_out_keys`
+        terms = self._hash_terms(codes)
+        return terms.sum(axis=1, dtype=np.uint64) - terms[:, i]
+
+    def _find_rows(self, codes):
+        rows = self._row_index.lookup(self._row_keys(codes))
+        found = rows >= 0
+        if not (self.codes[rows[found]] == codes[found]).all():
+            raise _HashCollision()
+        return rows
+
+    def _insert_rows(self, codes, rows):
+        # find the buckets of the new rows, and check for collisions, before changing any state
+        assignments = []
+        for i in range(self.num_features):
+            others = [j for j in range(self.num_features) if j != i]
+            keys = self._bucket_keys(codes, i)
+            buckets = self._bucket_indexes[i].lookup(keys)
+            found = buckets >= 0
+            existing = self._bucket_rows[i][buckets[found]]
+            if not (self.codes[existing][:, others] == codes[found][:, others]).all():
+                raise _HashCollision()
+            cardinalities = self.encoder.cardinalities
+            group, num_groups = group_ids(codes[~found][:, others], [cardinalities[j] for j in others])
+            group, first = first_occurrence_order(group, num_groups)
+            new_buckets = np.arange(len(self._bucket_totals[i]), len(self._bucket_totals[i]) + num_groups)
+            self._bucket_indexes[i].add(keys[~found][first], new_buckets)
+            buckets[~found] = new_buckets[group]
+            assignments.append((buckets, rows[~found][first], num_groups))
+        self._row_index.add(self._row_keys(codes), rows)
+        self.codes = np.concatenate([self.codes, codes])
+        self.weights = np.concatenate([self.weights, np.zeros(len(rows))])
+        for i, (buckets, first_rows, num_groups) in enumerate(assignments):
+            self._row_buckets[i] = np.concatenate([self._row_buckets[i], buckets])
+            self._bucket_rows[i] = np.concatenate([self._bucket_rows[i], first_rows])
+            self._bucket_totals[i] = np.concatenate([self._bucket_totals[i], np.zeros(num_groups)])
+            self._bucket_kls[i] = np.concatenate([self._bucket_kls[i], np.zeros(num_groups)])
@@ -0,0 +1,179 @@
+"""Record where the calculators spend their time.
+
+The calculators report the stages of their pipeline (encoding, priors, bucketing, kernels, building the result) to the
+active `Trace`, together with statistics like the number of buckets and the domain size of every feature. Without an
+active trace, reporting a stage costs a single context variable lookup.
+
+    with Trace(memory=True) as trace:
+        piflib.compute_cigs(df)
+    print(trace.summary())
+    trace.dump('trace.json')
+
+Stages that run in worker processes (with `n_jobs` > 1) are not recorded, only the stages around them.
+"""
+import contextvars
+import functools
+import json
+import time
+import tracemalloc
+
+_active_trace = contextvars.ContextVar('piflib_trace', default=None)
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def annotate(self, **attributes):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name, **attributes):
+    """Return a context manager that records a stage in the active trace, if any.
+
+    :param name: the name of the stage
+    :param attributes: JSON serializable details of the stage, e.g. the feature index
+    :return: a context manager. Its `annotate(**attributes)` method adds details that are only known inside the stage.
+    """
+    trace = _active_trace.get()
+    if trace is None:
+        return _NULL_STAGE
+    return _Stage(trace, name, attributes)
+
+
+def traced(function):
+    """Decorator that records every call of a function as a stage named after the function."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _active_trace.get() is None:
+            return function(*args, **kwargs)
+        with stage(function.__name__):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def enabled():
+    """Whether a trace is active, to skip computing statistics that are only needed for the trace."""
+    return _active_trace.get() is not None
+
+
+class _Stage:
+    def __init__(self, trace, name, attributes):
+        self.trace = trace
+        self.event = {'name': name, 'attributes': attributes}
+
+    def annotate(self, **attributes):
+        self.event['attributes'].update(attributes)
+
+    def __enter__(self):
+        self.trace._enter(self)
+        self.event['start'] = time.perf_counter() - self.trace.origin
+        return self
+
+    def __exit__(self, *exc_info):
+        self.event['duration'] = time.perf_counter() - self.trace.origin - self.event['start']
+        self.trace._exit(self)
+
+
+class Trace:
+    """Collect the stages that the calculators report while the trace is active.
+
+    Use it as a context manager. Traces can be nested; only the innermost one records.
+
+    :param memory: whether to record the peak of the memory allocated by Python (with `tracemalloc`) in every stage.
+        This slows the calculations down considerably.
+    :param callback: optional function that is called with every recorded event, when its stage ends
+    """
+
+    def __init__(self, memory=False, callback=None):
+        self.memory = memory
+        self.callback = callback
+        self.events = []
+        self.origin = None
+        self._stack = []
+        self._token = None
+        self._started_tracemalloc = False
+
+    def __enter__(self):
+        self.origin = time.perf_counter()
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._token = _active_trace.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _active_trace.reset(self._token)
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def _enter(self, stage):
+        stage.event['depth'] = len(self._stack)
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                # the peak of the enclosing stage so far, before the counter is reset for this stage
+                parent = self._stack[-1]
+                parent.peak = max(parent.peak, peak)
+            stage.base = current
+            stage.peak = current
+            if hasattr(tracemalloc, 'reset_peak'):
+                # before Python 3.9 the peaks are those of the whole trace so far
+                tracemalloc.reset_peak()
+        self._stack.append(stage)
+
+    def _exit(self, stage):
+        self._stack.pop()
+        if self.memory:
+            _, peak = tracemalloc.get_traced_memory()
+            stage.peak = max(stage.peak, peak)
+            stage.event['memory_peak'] = stage.peak - stage.base
+            if self._stack:
+                parent = self._stack[-1]
+                parent.peak = max(parent.peak, stage.peak)
+        self.events.append(stage.event)
+        if self.callback is not None:
+            self.callback(stage.event)
+
+    def summary(self):
+        """Aggregate the events by stage name.
+
+        :return: DataFrame with the number of calls and the total and maximum duration of every stage, and the maximum
+            memory peak if recorded, sorted by total duration
+        """
+        import pandas as pd
+
+        events = pd.DataFrame(self.events, columns=['name', 'duration', 'memory_peak'])
+        summary = events.groupby('name').agg(calls=('duration', 'size'), total=('duration', 'sum'),
+                                             max=('duration', 'max'), memory_peak=('memory_peak', 'max'))
+        if not self.memory:
+            summary = summary.drop(columns='memory_peak')
+        return summary.sort_values('total', ascending=False)
+
+    def to_chrome_trace(self):
+        """Return the events in the Trace Event Format of Chrome and Perfetto, as a JSON serializable dictionary."""
+        trace_events = []
+        for event in sorted(self.events, key=lambda event: event['start']):
+            args = dict(event['attributes'])
+            if 'memory_peak' in event:
+                args['memory_peak'] = event['memory_peak']
+            trace_events.append({'name': event['name'], 'ph': 'X', 'pid': 0, 'tid': 0,
+                                 'ts': event['start'] * 1e6, 'dur': event['duration'] * 1e6, 'args': args})
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def dump(self, path):
+        """Write the events to a JSON file, see `to_chrome_trace`."""
+        with open(path, 'w') as f:
+            json.dump(self.to_chrome_trace(), f, default=_to_builtin)
+
+
+def _to_builtin(value):
+    # NumPy scalars and arrays in the attributes
+    return value.tolist() if hasattr(value, 'tolist') else str(value)
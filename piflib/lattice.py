@@ -0,0 +1,186 @@
+"""Projections of an encoded dataset onto subsets of its features, derived from each other.
+
+With r unknown features, the CIG of an unknown feature j is computed from the buckets of the rows that agree on all
+other known features. These are the counts of the projection of the dataset onto all features except the other
+unknown ones. The C(k, r) combinations of unknown features need many such projections, but a projection onto a subset of
+features can be computed from the counts of any projection onto a superset, which usually has far fewer distinct rows
+than the dataset. `ProjectionLattice` caches projections and derives every new one from the smallest cached superset.
+
+The distinct rows of the projection onto the known features plus j are exactly the (bucket, value) pairs of feature j,
+so the bucket counts follow from the projection without another pass over the rows. Projections keep their distinct
+rows in order of first occurrence, so the bucket distributions are summed in the same order as on the full data, and
+the results are equal up to floating point rounding.
+"""
+import collections
+
+import numpy as np
+
+from piflib.buckets import BucketCounts, bucket_kls
+from piflib.encoding import first_occurrence_order, group_ids
+from piflib.instrumentation import stage
+
+
+class Projection:
+    """The distinct rows of a dataset projected onto a subset of its features, with their multiplicities.
+
+    It has the attributes the bucket kernels need (see `piflib.buckets.bucket_feature`).
+
+    :param features: the indices of the projected features in the dataset, sorted
+    :param codes: 2-D integer array of the distinct projected rows, one column per feature in `features`
+    :param cardinalities: upper bound (exclusive) of the codes in each column
+    :param weights: the multiplicity of every distinct projected row
+    :param rows: the projected row of every distinct row of the dataset, or None for the dataset itself
+    :param first_rows: the first distinct row of the dataset of every projected row, or None for the dataset itself
+    """
+
+    def __init__(self, features, codes, cardinalities, weights, rows=None, first_rows=None):
+        self.features = features
+        self.codes = codes
+        self.cardinalities = cardinalities
+        self.weights = weights
+        self.rows = rows
+        self.first_rows = first_rows
+
+    @property
+    def num_features(self):
+        return len(self.features)
+
+    @property
+    def num_distinct(self):
+        return self.codes.shape[0]
+
+    def aggregate(self, features):
+        """Project onto a subset of the features of this projection."""
+        positions = [self.features.index(i) for i in features]
+        cardinalities = [self.cardinalities[position] for position in positions]
+        codes = self.codes[:, positions]
+        ids, num_groups = group_ids(codes, cardinalities)
+        ids, first_rows = first_occurrence_order(ids, num_groups)
+        weights = np.bincount(ids, weights=self.weights, minlength=num_groups)
+        rows = ids if self.rows is None else ids[self.rows]
+        dataset_first_rows = first_rows if self.first_rows is None else self.first_rows[first_rows]
+        return Projection(list(features), codes[first_rows], cardinalities, weights, rows, dataset_first_rows)
+
+
+class ProjectionLattice:
+    """A cache of projections of an encoded dataset.
+
+    The lattice exposes `codes`, `weights`, `cardinalities` and `num_features` of the dataset, so it can be passed
+    wherever a dataset is expected, e.g. to `piflib.parallel.map_features`.
+
+    :param dataset: an EncodedDataset, or any object with `codes`, `cardinalities`, `weights` and `num_features`
+    :param max_cells: the maximum number of code matrix cells of the cached projections, the dataset itself not
+        included. Least recently used projections are evicted first. Defaults to twice the size of the code matrix.
+    """
+
+    def __init__(self, dataset, max_cells=None):
+        self.codes = dataset.codes
+        self.weights = dataset.weights
+        self.cardinalities = dataset.cardinalities
+        self.num_features = dataset.num_features
+        self.max_cells = 2 * dataset.codes.size if max_cells is None else max_cells
+        self._root = Projection(list(range(self.num_features)), self.codes, self.cardinalities, self.weights)
+        self._projections = collections.OrderedDict()
+        self._num_cells = 0
+
+    def projection(self, features, cache=True):
+        """Return the projection of the dataset onto `features`.
+
+        :param features: iterable of feature indices
+        :param cache: whether to keep the projection for later calls
+        """
+        key = frozenset(features)
+        if len(key) == self.num_features:
+            return self._root
+        projection = self._projections.get(key)
+        if projection is not None:
+            self._projections.move_to_end(key)
+            return projection
+        parents = [parent for parent_key, parent in self._projections.items() if parent_key > key]
+        parent = min(parents, key=lambda parent: parent.codes.size, default=self._root)
+        with stage('projection', features=sorted(key)) as projecting:
+            projection = parent.aggregate(sorted(key))
+            projecting.annotate(parent_rows=parent.num_distinct, distinct_rows=projection.num_distinct)
+        if not cache:
+            return projection
+        self._projections[key] = projection
+        self._num_cells += projection.codes.size
+        while self._num_cells > self.max_cells and self._projections:
+            _, evicted = self._projections.popitem(last=False)
+            self._num_cells -= evicted.codes.size
+        return projection
+
+    def feature_kls(self, feature_is, priors, accuracies):
+        """Find the KL divergences of the unknown features in `feature_is` for every distinct row of the dataset.
+
+        The result is the same as that of `piflib.buckets.feature_kls`.
+
+        :param feature_is: indices of the 'unknown' features
+        :param priors: dictionary mapping feature index to FeaturePrior
+        :param accuracies: dictionary mapping feature index to accuracy
+        :return: list with an array of KL divergences per distinct row for every feature in `feature_is`
+        """
+        known = [i for i in range(self.num_features) if i not in feature_is]
+        # the buckets are only needed for this combination, the projections with one more feature are shared with others
+        buckets = self.projection(known, cache=False)
+        results = []
+        for j in feature_is:
+            # the distinct rows of this projection are the (bucket, value) pairs of feature j
+            pairs = self.projection(known + [j])
+            kls, _ = self._bucket_kls(buckets, pairs, j, priors[j], accuracies[j])
+            results.append(kls if buckets.rows is None else kls[buckets.rows])
+        return results
+
+    def projected_rigs(self, features, priors, accuracies):
+        """Compute the RIGs of the dataset with only the features in `features`, i.e. with all others suppressed.
+
+        The CIGs are those `compute_cigs` gives for the projection of the dataset onto `features`, with the same priors
+        and accuracies. They only depend on the projected row, so they are computed per distinct row of the projection.
+        The buckets of the features are projections with one feature less, which are cached for other calls.
+
+        :param features: the indices of the remaining features
+        :param priors: dictionary mapping feature index to FeaturePrior
+        :param accuracies: dictionary mapping feature index to accuracy
+        :return: tuple of the Projection onto `features` and an array with the RIG of every one of its distinct rows
+        """
+        features = sorted(features)
+        pairs = self.projection(features)
+        rigs = np.zeros(pairs.num_distinct)
+        for j in features:
+            buckets = self.projection([i for i in features if i != j])
+            kls, bucket_ids = self._bucket_kls(buckets, pairs, j, priors[j], accuracies[j])
+            rigs += kls[bucket_ids]
+        return pairs, rigs
+
+    @staticmethod
+    def _bucket_kls(buckets, pairs, j, prior, accuracy):
+        # the KL divergence of every bucket, and the bucket of every distinct row of `pairs`, whose features are those
+        # of `buckets` plus j
+        bucket_ids = ProjectionLattice._bucket_ids(buckets, pairs)
+        # a stable sort by bucket, but an unstable sort of unique keys is several times faster
+        order = np.argsort(bucket_ids.astype(np.int64) * len(bucket_ids) + np.arange(len(bucket_ids)))
+        pair_bucket = bucket_ids[order]
+        pair_counts = pairs.weights[order]
+        bucket_totals = np.bincount(pair_bucket, weights=pair_counts, minlength=buckets.num_distinct)
+        counts = BucketCounts(pair_bucket, pairs.codes[order, pairs.features.index(j)], pair_counts, bucket_totals, None)
+        with stage('bucket_kls', features=[j], buckets=buckets.num_distinct, pairs=pairs.num_distinct):
+            return bucket_kls(counts, prior, accuracy), bucket_ids
+
+    @staticmethod
+    def _bucket_ids(buckets, pairs):
+        if buckets.rows is None:
+            return np.arange(pairs.num_distinct) if pairs.first_rows is None else pairs.first_rows
+        return buckets.rows if pairs.first_rows is None else buckets.rows[pairs.first_rows]
+
+
+def lattice_kls(dataset, feature_is, priors, accuracies):
+    """`ProjectionLattice.feature_kls` as a task for `piflib.parallel.map_features`.
+
+    :param dataset: a ProjectionLattice, or a shared dataset in a worker process, which then keeps a lattice of its own
+        for all tasks of the worker
+    """
+    if not isinstance(dataset, ProjectionLattice):
+        if 'lattice' not in dataset.state:
+            dataset.state['lattice'] = ProjectionLattice(dataset)
+        dataset = dataset.state['lattice']
+    return dataset.feature_kls(feature_is, priors, accuracies)
@@ -0,0 +1,185 @@
+"""Compute CIGs, wCIGs and CSFs of a table that is split into row partitions, as a map-reduce.
+
+The calculators only need the counts of the distinct rows of a dataset: the priors of the features are their marginals,
+and the leave-one-out buckets of every feature are re-aggregations of them. The counts of a partition are a
+`piflib.streaming.DistinctRows` object, which can be pickled and merged with the counts of other partitions in any order
+and grouping. The computation therefore runs in four steps:
+
+1. map: count the distinct rows of every partition (`count_partition`),
+2. reduce: merge the counts (`merge_counts`),
+3. compute the values of every distinct row of the whole table, with `piflib.pif_calculator.compute_metrics`,
+4. broadcast these values (a `RowScores` object) back to the partitions, which look up the value of every row
+   (`score_partition`).
+
+`compute_metrics_partitioned` runs all steps on a `concurrent.futures` executor; any object with an `Executor.map`
+compatible `map` method will do. The map and broadcast steps can also be run on other frameworks with the functions
+above, as long as the partitions are read in the same way in both.
+"""
+import concurrent.futures
+import contextlib
+import functools
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from piflib.factored import FactoredCigs
+from piflib.instrumentation import stage, traced
+from piflib.parallel import resolve_n_jobs
+from piflib.pif_calculator import compute_metrics
+from piflib.streaming import ChunkWriter, DistinctRows, count_distinct_rows, iterate_chunks
+
+
+def count_partition(partition, counts=None, chunksize=100000):
+    """Count the distinct rows of a partition.
+
+    :param partition: a DataFrame, a path to a CSV or Parquet file, or anything else `piflib.streaming.iterate_chunks`
+        accepts
+    :param counts: optional name of a column with the multiplicity of every row, for partitions of a frequency table
+    :param chunksize: the number of rows per chunk when reading from a file
+    :return: a DistinctRows object
+    """
+    return count_distinct_rows(lambda: _partition_chunks(partition, chunksize), counts)
+
+
+def merge_counts(states):
+    """Merge the counts of several partitions.
+
+    The merge is associative, so partial merges can be merged again. The codes of the result depend on the order of
+    the states, the counts of every distinct row do not.
+
+    :param states: iterable of DistinctRows objects
+    :return: a new DistinctRows object
+    """
+    merged = None
+    for state in states:
+        if merged is None:
+            merged = DistinctRows(state.counts)
+        merged.merge(state)
+    if merged is None:
+        raise ValueError('no partitions to merge')
+    return merged
+
+
+class RowScores:
+    """The values of the metrics for every distinct row of a partitioned table.
+
+    The values are kept in factored form, see `piflib.factored.FactoredCigs`, which keeps the object that is sent to
+    every partition small.
+
+    :param distinct: the merged DistinctRows of all partitions
+    :param values: dictionary mapping the name of every metric to a FactoredCigs object with its values for every
+        distinct row of `distinct.table()`
+    """
+
+    def __init__(self, distinct, values):
+        self.distinct = distinct
+        self.values = values
+
+    @classmethod
+    def compute(cls, distinct, metrics=('cig',), feature_priors={}, feature_accuracies={}):
+        """Compute the metrics of the distinct rows, see `piflib.pif_calculator.compute_metrics`."""
+        table = distinct.table()
+        frames = compute_metrics(table, metrics, feature_priors, feature_accuracies)
+        return cls(distinct, {metric: FactoredCigs.from_distinct(table, list(frame.values.T))
+                              for metric, frame in frames.items()})
+
+    def score(self, chunk):
+        """Look up the values of the rows of a DataFrame chunk.
+
+        :return: dictionary mapping every metric to a DataFrame with the index of the chunk
+        """
+        rows = self.distinct.lookup(chunk)
+        return {metric: pd.DataFrame(np.column_stack([factored.values[i][factored.buckets[i][rows]]
+                                                      for i in range(len(factored.columns))]),
+                                     columns=self.distinct.columns, index=chunk.index)
+                for metric, factored in self.values.items()}
+
+
+def score_partition(partition, scores, chunksize=100000, output=None):
+    """Look up the values of the rows of a partition.
+
+    :param partition: see `count_partition`
+    :param scores: a RowScores object
+    :param chunksize: the number of rows per chunk when reading from a file
+    :param output: optional dictionary mapping every metric to a file to write its values to, see
+        `piflib.streaming.write_chunks`
+    :return: dictionary mapping every metric to a DataFrame with its values, or to the number of rows written to
+        `output`
+    """
+    chunks = _partition_chunks(partition, chunksize)
+    if output is None:
+        results = [scores.score(chunk) for chunk in chunks]
+        return {metric: pd.concat([result[metric] for result in results]) for metric in scores.values}
+    with contextlib.ExitStack() as stack:
+        writers = {metric: stack.enter_context(ChunkWriter(path)) for metric, path in output.items()}
+        for chunk in chunks:
+            for metric, values in scores.score(chunk).items():
+                if metric in writers:
+                    writers[metric].write(values)
+    return {metric: writer.num_rows for metric, writer in writers.items()}
+
+
+@traced
+def compute_metrics_partitioned(partitions, metrics=('cig',), feature_priors={}, feature_accuracies={}, counts=None,
+                                executor=None, n_jobs=-1, chunksize=100000, output=None):
+    """Compute several cell level metrics of a table that is split into row partitions.
+
+    The results are the same as those of `piflib.pif_calculator.compute_metrics` on the concatenated partitions.
+
+    :param partitions: list of partitions, see `count_partition`. With a process pool they have to be picklable, e.g.
+        DataFrames or paths.
+    :param metrics: the metrics to compute, any of 'cig', 'wcig' and 'csf'
+    :param feature_priors: optional dictionary mapping the feature index to an assumed prior
+    :param feature_accuracies: optional dictionary mapping the feature index to the accuracy of the feature
+    :param counts: optional name of a column with the multiplicity of every row, for partitions of a frequency table
+    :param executor: optional `concurrent.futures` executor to run the map and broadcast steps on. The counts of all
+        partitions are merged in this process.
+    :param n_jobs: without an `executor`, the number of worker processes of a local pool. 1 runs everything in this
+        process, -1 uses all cores.
+    :param chunksize: the number of rows per chunk when reading from a file
+    :param output: optional format string with the fields `partition` (the position of the partition) and `metric`,
+        e.g. 'scores/{partition}.{metric}.parquet'. The workers then write the values to these files instead of
+        returning them.
+    :return: dictionary mapping every metric to a list with a DataFrame of values for every partition, or, with
+        `output`, with the number of rows written for every partition
+    """
+    partitions = list(partitions)
+    outputs = None
+    if output is not None:
+        outputs = [{metric: output.format(partition=position, metric=metric) for metric in metrics}
+                   for position in range(len(partitions))]
+    with _mapper(executor, n_jobs) as mapper:
+        with stage('map', partitions=len(partitions)):
+            states = list(mapper(functools.partial(count_partition, counts=counts, chunksize=chunksize), partitions))
+        with stage('reduce', partitions=len(partitions)) as reducing:
+            merged = merge_counts(states)
+            reducing.annotate(distinct_rows=merged.table().num_distinct)
+        scores = RowScores.compute(merged, metrics, feature_priors, feature_accuracies)
+        with stage('broadcast', partitions=len(partitions)):
+            results = list(mapper(functools.partial(_score, scores=scores, chunksize=chunksize), partitions,
+                                  itertools.repeat(None) if outputs is None else outputs))
+    return {metric: [result[metric] for result in results] for metric in metrics}
+
+
+@contextlib.contextmanager
+def _mapper(executor, n_jobs):
+    if executor is not None:
+        yield executor.map
+        return
+    n_jobs = resolve_n_jobs(n_jobs)
+    if n_jobs == 1:
+        yield map
+        return
+    with concurrent.futures.ProcessPoolExecutor(n_jobs) as pool:
+        yield pool.map
+
+
+def _partition_chunks(partition, chunksize):
+    if isinstance(partition, pd.DataFrame):
+        return [partition]
+    return iterate_chunks(partition, chunksize)
+
+
+def _score(partition, output, scores, chunksize):
+    return score_partition(partition, scores, chunksize, output)
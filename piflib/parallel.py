@@ -0,0 +1,128 @@
+"""Spread per-feature work of the calculators over worker processes.
+
+Given the priors, the buckets of every feature (or combination of features) are independent of each other. The code
+matrix and weights of the encoded dataset are placed in shared memory once, so that the tasks only carry the feature
+indices and the small prior arrays. Results are returned in task order, so they do not depend on the number of
+workers.
+"""
+import concurrent.futures
+import itertools
+import os
+
+import numpy as np
+
+
+class SharedDataset:
+    """The code matrix and weights of an encoded dataset, copied into shared memory.
+
+    Use it as a context manager; the shared memory is released on exit. `handle` is a small picklable description that
+    workers pass to `attach`.
+
+    :param dataset: an EncodedDataset
+    """
+
+    def __init__(self, dataset):
+        self._blocks = []
+        self.handle = (self._share(dataset.codes), self._share(dataset.weights), dataset.cardinalities)
+
+    def _share(self, array):
+        block = _shared_memory().SharedMemory(create=True, size=max(array.nbytes, 1))
+        self._blocks.append(block)
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        return block.name, array.shape, array.dtype.str
+
+    def close(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _shared_memory():
+    # multiprocessing.shared_memory is new in Python 3.8; serial calls must not need it
+    try:
+        from multiprocessing import shared_memory
+    except ImportError:
+        raise RuntimeError('n_jobs > 1 needs Python 3.8 or later') from None
+    return shared_memory
+
+
+class _SharedView:
+    """What the bucket kernels need of a dataset, backed by shared memory.
+
+    Tasks can keep data that they derive from the dataset in the `state` dictionary, to reuse it in later tasks on the
+    same dataset.
+    """
+
+    def __init__(self, handle):
+        codes, weights, self.cardinalities = handle
+        self.state = {}
+        self._blocks = []
+        self.codes = self._attach(*codes)
+        self.weights = self._attach(*weights)
+        self.num_features = self.codes.shape[1]
+
+    def _attach(self, name, shape, dtype):
+        block = _shared_memory().SharedMemory(name=name)
+        self._blocks.append(block)
+        return np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+    def close(self):
+        self.codes = self.weights = None
+        self.state = {}
+        for block in self._blocks:
+            block.close()
+
+
+# the dataset a worker process is currently attached to
+_attached = {}
+
+
+def attach(handle):
+    """Return a view on a shared dataset, reusing the attachment of previous tasks of the same dataset."""
+    view = _attached.get(handle[0][0])
+    if view is None:
+        for previous in _attached.values():
+            previous.close()
+        _attached.clear()
+        view = _attached[handle[0][0]] = _SharedView(handle)
+    return view
+
+
+def _run(function, handle, task, *args):
+    return function(attach(handle), task, *args)
+
+
+def resolve_n_jobs(n_jobs):
+    """Translate `n_jobs` into a number of processes. None means 1, negative numbers count back from all cores."""
+    if n_jobs is None:
+        return 1
+    if n_jobs < 0:
+        return max((os.cpu_count() or 1) + 1 + n_jobs, 1)
+    return n_jobs
+
+
+def map_features(function, dataset, tasks, *args, n_jobs=None):
+    """Apply `function(dataset, task, *args)` to every task, possibly in worker processes.
+
+    :param function: a module level function taking a dataset (see `piflib.buckets.bucket_feature`), a task and `args`
+    :param dataset: an EncodedDataset
+    :param tasks: iterable of tasks, e.g. tuples of feature indices
+    :param args: further arguments, passed to every call
+    :param n_jobs: number of worker processes. None or 1 runs everything in this process, -1 uses all cores.
+    :return: generator of the results, in the order of `tasks`
+    """
+    n_jobs = resolve_n_jobs(n_jobs)
+    if n_jobs == 1:
+        for task in tasks:
+            yield function(dataset, task, *args)
+        return
+    with SharedDataset(dataset) as shared, concurrent.futures.ProcessPoolExecutor(n_jobs) as executor:
+        repeated = [itertools.repeat(arg) for arg in args]
+        yield from executor.map(_run, itertools.repeat(function), itertools.repeat(shared.handle), tasks, *repeated)
@@ -1,128 +1,234 @@
 
 import collections
 import math
-import operator
-import random
 import itertools
 
 
 import pandas as pd
 import numpy as np
 
+from piflib.buckets import feature_bucket_kls, feature_metrics, feature_prob_changes, prepare_priors
 from piflib.data_util import calculate_distribution, complete_feature_priors
-from piflib.entropy import create_conditional_entropy_table
+from piflib.encoding import encode
+from piflib.entropy import entropy
+from piflib.factored import FactoredCigs
+from piflib.instrumentation import stage, traced
+from piflib.lattice import ProjectionLattice, lattice_kls
+from piflib.parallel import map_features
+from piflib.posterior import compute_posteriors
 
 
+@traced
 def compute_cigs(dataframe,
                  feature_priors={},
                  feature_accuracies={},
-                 samples=None):
+                 samples=None,
+                 n_jobs=None,
+                 unknown_features=1,
+                 seed=None,
+                 balanced=False,
+                 factored=False,
+                 dtype=np.float64):
     """Compute the cell information gain (CIG) for all cells in the dataset.
 
     Find the risk (as KL divergence from prior) for all attributes.
 
-    :param dataframe: a Pandas DataFrame object containing tabular data
+    :param dataframe: a Pandas DataFrame object containing tabular data, or an encoded dataset (see
+        `piflib.encoding.encode`), e.g. of a frequency table
     :param feature_priors: feature_priors are optional. It is a dictionary mapping the
         feature index to an assumed prior. If not provided, the prior for
         the feature is calculated from the global distribution.
     :param feature_accuracies: `feature_accuracies` maps the feature index to the accuracy of the
         feature. If not provided for a feature, it defaults to 1.
+    :param samples: optional number of combinations of unknown features to sample. By default, the CIGs are averaged
+        over all combinations.
+    :param n_jobs: number of worker processes to spread the features over. None or 1 computes everything in this
+        process, -1 uses all cores. The results do not depend on the number of workers.
+    :param unknown_features: the number of features the attacker does not know. The CIG of a cell is the average over
+        the combinations of unknown features that include its feature. With the default of 1, the attacker knows all
+        other features of a row.
+    :param seed: seed or `np.random.Generator` for sampling the combinations, see `sample_is`
+    :param balanced: whether the sampled combinations should include every feature about equally often
+    :param factored: whether to return the CIG values as a `piflib.factored.FactoredCigs`, which stores every distinct
+        CIG value only once and computes RIGs and the PIF without expanding them
+    :param dtype: the floating point type of the returned CIG values, e.g. `np.float32` to halve their memory
     :return: a Pandas DataFrame containing the CIG values. The CIG values are at the same index as their corresponding
-        cell values in the input dataframe.
+        cell values in the input dataframe. With `factored`, a FactoredCigs instead.
     """
-    unknown_features = 1
-    dataset = dataframe.values
-    num_features = len(dataset[0])
-    assert all(len(row) == num_features for row in dataset)
+    dataset = encode(dataframe)
+    num_features = dataset.num_features
+    if not 1 <= unknown_features <= num_features:
+        raise ValueError('unknown_features has to be between 1 and the number of features')
 
-    feature_priors = complete_feature_priors(dataframe, feature_priors)
+    feature_priors = complete_feature_priors(dataset, feature_priors)
 
     feature_accuracies = feature_accuracies.copy()
     for i in range(num_features):
         if i not in feature_accuracies:
             feature_accuracies[i] = 1
 
-    feature_counts = [0] * num_features
-    feature_kls = [[0] * len(dataset) for _ in range(num_features)]
-    for is_ in sample_is(num_features, unknown_features, samples):
-        feature_kls_this = find_kls_for_features(
-            dataset,
-            is_,
-            feature_priors,
-            feature_accuracies)
-        for i, feature_kl in zip(is_, feature_kls_this):
-            feature_kl_previous = feature_kls[i]
-            feature_kls[i] = tuple(map(
-                operator.add, feature_kl, feature_kl_previous))
-
-        for i in is_:
-            feature_counts[i] += 1
-
-    for i, denom in enumerate(feature_counts):
-        feature_kls[i] = tuple(map(
-            operator.truediv,
-            feature_kls[i],
-            itertools.repeat(denom)))
-
-    return pd.DataFrame(list(zip(*feature_kls)), columns=dataframe.columns)
-
-
-def compute_weighted_cigs(dataframe, feature_priors={}, feature_accuracies={}):
+    priors = prepare_priors(dataset, feature_priors)
+    # in lexicographic order, consecutive combinations share unknown features and thereby cached projections
+    combinations = sorted(sample_is(num_features, unknown_features, samples, seed, balanced))
+    if unknown_features == 1:
+        # every feature is unknown in exactly one combination, and every bucket has a single CIG value
+        all_bucket_kls = map_features(feature_bucket_kls, dataset, combinations, priors, feature_accuracies,
+                                      n_jobs=n_jobs)
+        bucket_values, bucket_ids = [None] * num_features, [None] * num_features
+        with stage('combinations', combinations=len(combinations), n_jobs=n_jobs):
+            for (i,), ((values, ids),) in zip(combinations, all_bucket_kls):
+                bucket_values[i], bucket_ids[i] = values, ids
+        if factored:
+            return FactoredCigs.from_distinct(dataset, bucket_values, bucket_ids, dtype)
+        feature_kls = [values[ids] for values, ids in zip(bucket_values, bucket_ids)]
+    else:
+        feature_counts = [0] * num_features
+        feature_kls = [np.zeros(dataset.num_distinct) for _ in range(num_features)]
+        all_feature_kls = map_features(lattice_kls, ProjectionLattice(dataset), combinations, priors,
+                                       feature_accuracies, n_jobs=n_jobs)
+        with stage('combinations', combinations=len(combinations), n_jobs=n_jobs):
+            for is_, feature_kls_this in zip(combinations, all_feature_kls):
+                for i, feature_kl in zip(is_, feature_kls_this):
+                    feature_kls[i] = feature_kls[i] + feature_kl
+
+                for i in is_:
+                    feature_counts[i] += 1
+
+        for i, denom in enumerate(feature_counts):
+            feature_kls[i] = feature_kls[i] / denom
+        if factored:
+            return FactoredCigs.from_distinct(dataset, feature_kls, dtype=dtype)
+
+    with stage('frame'):
+        feature_kls = [dataset.expand(feature_kl) for feature_kl in feature_kls]
+        return pd.DataFrame(np.column_stack(feature_kls).astype(dtype, copy=False), columns=dataset.columns)
+
+
+@traced
+def compute_weighted_cigs(dataframe, feature_priors={}, feature_accuracies={}, n_jobs=None):
     """Compute the Weighted Cell Information Gain (wCIG) for all cells in the dataset.
 
     Find the risk (as KL divergence from prior) for all attributes.
 
-    :param dataframe: a Pandas DataFrame object containing tabular data
+    The CIGs of a feature are weighted with H(X|rest) / H(X), both rounded to 2 digits. The conditional entropy
+    H(X|rest) is computed from the same leave-one-out buckets as the CIGs.
+
+    :param dataframe: a Pandas DataFrame object containing tabular data, or an encoded dataset
     :param feature_priors: feature_priors are optional. It is a dictionary mapping the
         feature index to an assumed prior. If not provided, the prior for
         the feature is calculated from the global distribution.
     :param feature_accuracies: `feature_accuracies` maps the feature index to the accuracy of the
         feature. If not provided for a feature, it defaults to 1.
+    :param n_jobs: number of worker processes to spread the features over, see `compute_cigs`.
     :return: a Pandas DataFrame containing the wCIG values. The wCIG values are at the same index as their
         corresponding cell values in the input dataframe.
         """
-    cigs = compute_cigs(dataframe, feature_priors=feature_priors, feature_accuracies=feature_accuracies)
-    cond_entropy = create_conditional_entropy_table(dataframe)
-    weights = cond_entropy['H(X|Y)'].values / cond_entropy['H(X)']
-    weights = np.nan_to_num(weights)
-    return (cigs * weights).round(2)
+    return compute_metrics(dataframe, ['wcig'], feature_priors, feature_accuracies, n_jobs)['wcig']
 
 
-def compute_csfs(df, feature_priors={}, feature_accuracies={}):
+@traced
+def compute_csfs(df, feature_priors={}, feature_accuracies={}, n_jobs=None):
     """Compute the Cell Surprise Factor (CSF) for all cells in the dataset.
 
     The CSF id defined as the change in probability for a cell value between the prior and the posterior distribution.
 
-    :param dataframe: a Pandas DataFrame object containing tabular data
+    :param dataframe: a Pandas DataFrame object containing tabular data, or an encoded dataset
     :param feature_priors: feature_priors are optional. It is a dictionary mapping the
         feature index to an assumed prior. If not provided, the prior for
         the feature is calculated from the global distribution.
     :param feature_accuracies: `feature_accuracies` maps the feature index to the accuracy of the
         feature. If not provided for a feature, it defaults to 1.
+    :param n_jobs: number of worker processes to spread the features over, see `compute_cigs`.
     :return: a Pandas DataFrame containing the CSF values. The CSF values are at the same index as their
         corresponding cell values in the input dataframe.
     """
-    dataset = df.values
-    num_features = len(dataset[0])
+    dataset = encode(df)
+    num_features = dataset.num_features
     # compute priors
-    feature_priors = complete_feature_priors(df, feature_priors)
+    feature_priors = complete_feature_priors(dataset, feature_priors)
     feature_accuracies = feature_accuracies.copy()
     for i in range(num_features):
         if i not in feature_accuracies:
             feature_accuracies[i] = 1
-    feature_csfs = [[0] * len(dataset) for _ in range(num_features)]
-    for is_ in sample_is(num_features, 1, None):
-        feature_csfs[is_[0]] = apply_to_posterior_and_prior(
-            dataset,
-            is_,
-            feature_priors,
-            feature_accuracies,
-            calculate_prob_change)
+    priors = prepare_priors(dataset, feature_priors)
+    feature_csfs = [None] * num_features
+    combinations = list(sample_is(num_features, 1, None))
+    all_feature_csfs = map_features(feature_prob_changes, dataset, combinations, priors, feature_accuracies,
+                                    n_jobs=n_jobs)
+    with stage('combinations', combinations=len(combinations), n_jobs=n_jobs):
+        for is_, (feature_csf,) in zip(combinations, all_feature_csfs):
+            feature_csfs[is_[0]] = dataset.expand(feature_csf)
 
-    return pd.DataFrame(list(zip(*feature_csfs)), columns=df.columns)
+    with stage('frame'):
+        return pd.DataFrame(np.column_stack(feature_csfs), columns=dataset.columns)
 
 
-def compute_pif(cigs, percentile):
+METRICS = ('cig', 'wcig', 'csf')
+
+
+@traced
+def compute_metrics(dataframe, metrics=METRICS, feature_priors={}, feature_accuracies={}, n_jobs=None):
+    """Compute several cell level metrics in a single pass over the data.
+
+    The priors and the leave-one-out buckets of every feature are built once, and the KL divergences, probability
+    changes and conditional entropies H(X|rest) are all derived from the same bucket distributions. The results are the
+    same as those of `compute_cigs`, `compute_weighted_cigs` and `compute_csfs`.
+
+    :param dataframe: a Pandas DataFrame object containing tabular data, or an encoded dataset
+    :param metrics: the metrics to compute, any of 'cig', 'wcig' and 'csf'
+    :param feature_priors: feature_priors are optional. It is a dictionary mapping the
+        feature index to an assumed prior. If not provided, the prior for
+        the feature is calculated from the global distribution.
+    :param feature_accuracies: `feature_accuracies` maps the feature index to the accuracy of the
+        feature. If not provided for a feature, it defaults to 1.
+    :param n_jobs: number of worker processes to spread the features over, see `compute_cigs`.
+    :return: dictionary mapping the name of every requested metric to a Pandas DataFrame with its values, at the same
+        index as the corresponding cell values in the input dataframe.
+    """
+    unknown_metrics = set(metrics) - set(METRICS)
+    if unknown_metrics:
+        raise ValueError('unknown metrics: {}'.format(', '.join(sorted(unknown_metrics))))
+    dataset = encode(dataframe)
+    num_features = dataset.num_features
+    feature_priors = complete_feature_priors(dataset, feature_priors)
+    feature_accuracies = {i: feature_accuracies.get(i, 1) for i in range(num_features)}
+    priors = prepare_priors(dataset, feature_priors)
+
+    statistics = set()
+    if 'cig' in metrics or 'wcig' in metrics:
+        statistics.add('kl')
+    if 'wcig' in metrics:
+        statistics.add('conditional_entropy')
+    if 'csf' in metrics:
+        statistics.add('prob_change')
+    combinations = list(sample_is(num_features, 1, None))
+    results = map_features(feature_metrics, dataset, combinations, priors, feature_accuracies, sorted(statistics),
+                           n_jobs=n_jobs)
+    with stage('combinations', combinations=len(combinations), n_jobs=n_jobs):
+        results = [result for result, in results]
+
+    def to_frame(columns):
+        return pd.DataFrame(np.column_stack([dataset.expand(column) for column in columns]), columns=dataset.columns)
+
+    frames = {}
+    if 'cig' in metrics or 'wcig' in metrics:
+        cigs = to_frame([result['kl'] for result in results])
+        if 'cig' in metrics:
+            frames['cig'] = cigs
+    if 'wcig' in metrics:
+        # rounded like the values of `piflib.entropy.create_conditional_entropy_table`
+        conditional_entropies = np.round([result['conditional_entropy'] for result in results], 2)
+        entropies = np.round([entropy(dataset, [column]) for column in dataset.columns], 2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weights = np.nan_to_num(conditional_entropies / entropies)
+        frames['wcig'] = (cigs * weights).round(2)
+    if 'csf' in metrics:
+        frames['csf'] = to_frame([result['prob_change'] for result in results])
+    return {metric: frames[metric] for metric in metrics}
+
+
+@traced
+def compute_pif(cigs, percentile, counts=None):
     """ compute the PIF.
 
     The PIF is defined as the n-th percentile of the individual RIG values. Or in other words, the RIG of n percent of
@@ -136,29 +242,61 @@ def compute_pif(cigs, percentile):
     (some of) the highest values. If ignoring the risk of some entities in the dataset fits within your risk framework,
     then specifying a percentile value of less than 100 will make the PIF value less susceptible to RIG outliers.
 
-    :param cigs: The CIG values of the dataset (see the compute_cigs function in this module)
-    :param percentile: Which percentile of RIG values should be included in the PIF.
-    :returns: the PIF_percentile value of the given CIGs
+    Several percentiles can be computed at once, by passing a sequence of percentiles.
+
+    :param cigs: The CIG values of the dataset (see the compute_cigs function in this module), as a DataFrame or in
+        factored form
+    :param percentile: Which percentile of RIG values should be included in the PIF, or a sequence of percentiles.
+    :param counts: optional number of entities each row of `cigs` stands for, e.g. the count column of a frequency
+        table. The result is the same as for the CIGs of the expanded table.
+    :returns: the PIF_percentile value of the given CIGs, or an array with one value per percentile
     """
+    if isinstance(cigs, FactoredCigs):
+        return cigs.pif(percentile, counts)
     rigs = cigs.sum(axis=1)
+    if counts is not None:
+        return weighted_percentile(np.asarray(rigs), np.asarray(counts), percentile)
     pif = np.percentile(rigs, percentile)
     return pif
 
 
+def weighted_percentile(values, counts, percentile):
+    """Compute the percentile of `values`, where every value occurs `counts` times.
+
+    The result is the same as that of `np.percentile` (with linear interpolation) on the expanded array, without
+    expanding it.
+
+    :param values: 1-D array of values
+    :param counts: 1-D array of positive integer multiplicities
+    :param percentile: percentile, or array of percentiles, between 0 and 100
+    :return: the percentile(s)
+    """
+    order = np.argsort(values, kind='stable')
+    values = values[order]
+    cumulative = np.cumsum(counts[order])
+    # associated like in numpy, (n - 1) * (percentile / 100), for identical rounding
+    positions = (cumulative[-1] - 1) * (np.asarray(percentile, dtype=float) / 100)
+    lower = np.floor(positions)
+    t = positions - lower
+    a = values[np.searchsorted(cumulative, lower, side='right')]
+    b = values[np.searchsorted(cumulative, np.minimum(lower + 1, cumulative[-1] - 1), side='right')]
+    # the same interpolation as numpy uses
+    diff_b_a = b - a
+    return np.where(t >= 0.5, b - diff_b_a * (1 - t), a + diff_b_a * t)[()]
+
+
 def compute_posterior_distributions(feature, df):
-    known_features = tuple(col_name for col_name in df.columns if col_name != feature)
-    bucket = collections.defaultdict(list)
-    bucket_map = []
-    for idx, row in df.iterrows():
-        key = tuple(row[known_feature] for known_feature in known_features)
-        bucket[key].append(row[feature])
-        bucket_map.append(key)
-    bucket_distributions = {key: calculate_distribution(el_bucket) for key, el_bucket in bucket.items()}
-    feature_vals = df[feature].unique()
-    dists = {}
-    for key, distribution in bucket_distributions.items():
-        dists[str(key)] = [distribution.get(feature_val, 0) for feature_val in feature_vals]
-    return dists, feature_vals
+    """Compute the posterior distribution of a feature in every bucket of a dataset.
+
+    See `piflib.posterior.compute_posteriors` for filtering, sorting and paging the buckets.
+
+    :param feature: the name of the feature
+    :param df: a Pandas DataFrame object containing tabular data
+    :return: tuple of a dictionary mapping the string form of the values of the other features in every bucket to the
+        probabilities of the feature values in the bucket, and the feature values
+    """
+    posteriors = compute_posteriors(df, feature)
+    return posteriors.to_dict(), posteriors.values
 
 
 def binom(n, r):
@@ -166,52 +304,89 @@ def binom(n, r):
     return math.factorial(n) // math.factorial(n - r) // math.factorial(r)
 
 
-def sample_is(n, r, samples):
+def sample_is(n, r, samples, seed=None, balanced=False):
+    """Generate combinations of `r` out of `n` feature indices.
+
+    Without `samples`, all combinations are generated in lexicographic order. Otherwise `samples` distinct combinations
+    are drawn at random, such that every feature occurs in at least one of them. Memory use is proportional to
+    `samples`; the combinations are never all materialised, unless there are fewer than 2 * `samples` of them.
+
+    :param n: the number of features
+    :param r: the number of features per combination
+    :param samples: optional number of combinations to draw
+    :param seed: seed or `np.random.Generator` for the random draws, for reproducible samples
+    :param balanced: whether every feature should occur about equally often. Each combination then takes the features
+        that occurred least often so far that do not form a combination drawn before, with random tie breaking.
+    :return: generator of sorted tuples of feature indices
+    """
     if samples is None:
         yield from itertools.combinations(range(n), r)
+        return
+    total_combinations = binom(n, r)
+    if samples > total_combinations:
+        raise ValueError('more samples than combinations')
+    if samples * r < n:
+        raise ValueError('too few samples to include every feature in a combination')
+    rng = np.random.default_rng(seed)
+    if balanced:
+        yield from _balanced_combinations(n, r, samples, rng)
+        return
+    # cover every feature: split a random permutation into groups of r, and fill the last group up
+    produced = set()
+    permutation = rng.permutation(n).tolist()
+    for start in range(0, n, r):
+        comb = permutation[start:start + r]
+        if len(comb) < r:
+            rest = permutation[:start]
+            comb += [rest[k] for k in rng.choice(len(rest), r - len(comb), replace=False)]
+        comb = tuple(sorted(comb))
+        produced.add(comb)
+        yield comb
+    needed = samples - len(produced)
+    if samples * 2 <= total_combinations:
+        # rejection sampling, at most every second draw is rejected
+        while needed:
+            comb = tuple(sorted(rng.choice(n, r, replace=False).tolist()))
+            if comb not in produced:
+                produced.add(comb)
+                needed -= 1
+                yield comb
     else:
-        total_combinations = binom(n, r)
-        if samples > total_combinations:
-            raise ValueError('more samples than combinations')
-        if samples >= total_combinations >> 1:
-            all_combinations = list(itertools.combinations(range(n), r))
-            random.shuffle(all_combinations)
-
-            num_produced = 0
-            feature_produced = [False] * n
-            for i, comb in enumerate(all_combinations):
-                if num_produced >= samples:
-                    break
-                if all(map(feature_produced.__getitem__, comb)):
-                    continue
-                for j in comb:
-                    feature_produced[j] = True
-                num_produced += 1
-                all_combinations[i] = None
+        # selection sampling: pass over all combinations and select each one with the remaining probability
+        remaining = total_combinations - len(produced)
+        for comb in itertools.combinations(range(n), r):
+            if not needed:
+                break
+            if comb in produced:
+                continue
+            if rng.random() * remaining < needed:
+                needed -= 1
                 yield comb
+            remaining -= 1
 
-            for comb in all_combinations:
-                if num_produced >= samples:
-                    break
-                if comb is not None:
-                    yield comb
-        else:
-            already_produced = set()
-            feature_produced = [False] * n
-            while len(already_produced) < samples:
-                comb = random.sample(range(n), r)
-                comb = tuple(sorted(comb))
-                if (comb not in already_produced
-                        and (all(already_produced)
-                             or not all(map(already_produced.__getitem__,
-                                            comb)))):
-                    already_produced.add(comb)
-                    for i in comb:
-                        feature_produced[i] = True
-                    yield comb
+
+def _balanced_combinations(n, r, samples, rng):
+    occurrences = np.zeros(n, dtype=np.int64)
+    produced = set()
+    for _ in range(samples):
+        # the least used features, ties broken at random
+        order = np.lexsort((rng.random(n), occurrences)).tolist()
+        # if their combination was already drawn, the next ones in lexicographic order replace the most used features
+        for comb in itertools.combinations(order, r):
+            comb = tuple(sorted(comb))
+            if comb not in produced:
+                break
+        produced.add(comb)
+        occurrences[list(comb)] += 1
+        yield comb
 
 
 def apply_to_posterior_and_prior(dataset, feature_idx, prior_distributions, accuracies, fun):
+    """Apply `fun` to the posterior and the prior of the bucket of every row.
+
+    This is a slow, row by row reference implementation. The calculators use the vectorized kernels in
+    `piflib.buckets` instead, and the tests check those against this function and `find_kls_for_features`.
+    """
     num_features = len(dataset[0])
     assert all(len(row) == num_features for row in dataset)
     feature_idx = feature_idx[0]
@@ -236,6 +411,8 @@ def find_kls_for_features(dataset, feature_is, feature_distributions, accuracies
 
     We find the true distribution of the features taking into account
     the accuracy. We then compute the KL divergence.
+
+    This is a slow, row by row reference implementation of `piflib.buckets.feature_kls`, kept for testing.
     """
     num_features = len(dataset[0])
     assert all(len(row) == num_features for row in dataset)
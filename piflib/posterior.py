@@ -0,0 +1,148 @@
+"""Query the posterior distributions of a feature.
+
+The posterior distribution of a feature in a bucket, the rows that agree on all other features, is the distribution of
+the values of the feature in that bucket. Its KL divergence from the prior is the CIG of the cells of the bucket.
+`compute_posteriors` returns the posteriors of the buckets as a bucket x value probability matrix, computed from the
+bucket counts of `piflib.buckets` instead of a Python list per bucket. The buckets can be filtered by size, sorted by
+size or CIG, and paged through, so that only the buckets that are shown have to be materialized:
+
+    largest = compute_posteriors(df, 'postcode', sort_by='size', limit=20)
+    riskiest = compute_posteriors(df, 'postcode', min_size=5, sort_by='cig', offset=20, limit=20)
+"""
+import numpy as np
+import pandas as pd
+
+from piflib.buckets import FeaturePrior, bucket_feature, bucket_kls, prior_probabilities
+from piflib.encoding import encode, first_occurrence_order
+from piflib.instrumentation import stage, traced
+
+SORT_KEYS = (None, 'size', 'cig')
+
+
+class PosteriorDistributions:
+    """The posterior distributions of a feature in a selection of buckets.
+
+    :param feature: the name of the feature
+    :param values: the values of the feature, in the order of the columns of `probabilities`
+    :param keys: DataFrame with the values of the other features in every selected bucket, indexed by bucket id. Bucket
+        ids number the buckets in the order of their first row.
+    :param probabilities: the probability of every value in every selected bucket, a 2-D NumPy array or, for sparse
+        results, a `scipy.sparse.csr_matrix`
+    :param sizes: the number of rows of every selected bucket
+    :param cigs: the CIG of the cells of every selected bucket, i.e. the KL divergence of its posterior from the prior
+    :param total: the number of buckets that pass the filters, before paging
+    """
+
+    def __init__(self, feature, values, keys, probabilities, sizes, cigs, total):
+        self.feature = feature
+        self.values = values
+        self.keys = keys
+        self.probabilities = probabilities
+        self.sizes = sizes
+        self.cigs = cigs
+        self.total = total
+
+    def __len__(self):
+        return len(self.keys)
+
+    def to_frame(self):
+        """Return the probabilities as a DataFrame, with the bucket keys as index and the values as columns."""
+        probabilities = self.probabilities
+        if not isinstance(probabilities, np.ndarray):
+            probabilities = probabilities.toarray()
+        index = pd.MultiIndex.from_frame(self.keys) if self.keys.shape[1] else self.keys.index
+        return pd.DataFrame(probabilities, index=index, columns=self.values)
+
+    def to_dict(self):
+        """Return the probabilities as a dictionary mapping the string form of every bucket key to a list of
+        probabilities, the format of `piflib.pif_calculator.compute_posterior_distributions`."""
+        probabilities = self.probabilities
+        if not isinstance(probabilities, np.ndarray):
+            probabilities = probabilities.toarray()
+        keys = self.keys.itertuples(index=False, name=None)
+        return {str(key): row for key, row in zip(keys, probabilities.tolist())}
+
+
+@traced
+def compute_posteriors(dataframe, feature, min_size=None, max_size=None, sort_by=None, offset=0, limit=None,
+                       sparse=False, feature_priors={}, feature_accuracies={}):
+    """Compute the posterior distributions of a feature in the buckets of a dataset.
+
+    :param dataframe: a Pandas DataFrame object containing tabular data, or an encoded dataset
+    :param feature: the name of the feature
+    :param min_size: optional smallest number of rows of a bucket to include
+    :param max_size: optional largest number of rows of a bucket to include
+    :param sort_by: None to keep the buckets in the order of their first row, 'size' for the largest buckets first,
+        or 'cig' for the buckets with the highest CIG first. Ties keep the order of the first rows.
+    :param offset: the number of buckets to skip, after filtering and sorting
+    :param limit: optional maximum number of buckets to return
+    :param sparse: whether to return the probabilities as a `scipy.sparse.csr_matrix`, for features with many values.
+        Requires SciPy.
+    :param feature_priors: dictionary with prior distributions for features, see `compute_cigs`. Only used for the CIGs.
+    :param feature_accuracies: dictionary with accuracies of features, see `compute_cigs`. Only used for the CIGs.
+    :return: PosteriorDistributions
+    """
+    if sort_by not in SORT_KEYS:
+        raise ValueError('sort_by must be one of {}'.format(', '.join(repr(key) for key in SORT_KEYS)))
+    dataset = encode(dataframe)
+    i, = dataset.column_indices([feature])
+    dictionary = dataset.dictionaries[i]
+
+    bucket_ids, num_buckets, (counts,) = bucket_feature(dataset, [i])
+    prior = feature_priors.get(i)
+    if prior is None:
+        value_counts = np.bincount(dataset.codes[:, i], weights=dataset.weights, minlength=len(dictionary))
+        prior = dict(zip(dictionary, (value_counts / dataset.total).tolist()))
+    prior = FeaturePrior(prior_probabilities(dictionary, prior), sum(prob for prob in prior.values() if prob > 0))
+    cigs = bucket_kls(counts, prior, feature_accuracies.get(i, 1))
+
+    with stage('posterior_selection', buckets=num_buckets) as selecting:
+        # number the buckets in the order of their first row
+        ranks, first_rows = first_occurrence_order(bucket_ids, num_buckets)
+        bucket_ranks = np.empty(num_buckets, dtype=np.intp)
+        bucket_ranks[bucket_ids] = ranks
+        selected = bucket_ids[first_rows]
+        sizes = counts.bucket_totals[selected]
+        keep = np.ones(num_buckets, dtype=bool)
+        if min_size is not None:
+            keep &= sizes >= min_size
+        if max_size is not None:
+            keep &= sizes <= max_size
+        selected = selected[keep]
+        if sort_by is not None:
+            scores = counts.bucket_totals if sort_by == 'size' else cigs
+            selected = selected[np.argsort(-scores[selected], kind='stable')]
+        total = len(selected)
+        selected = selected[offset:None if limit is None else offset + limit]
+        selecting.annotate(selected=len(selected), total=total)
+
+    # the position of every selected bucket in the result, -1 for the others
+    positions = np.full(num_buckets, -1, dtype=np.intp)
+    positions[selected] = np.arange(len(selected))
+    pair_positions = positions[counts.pair_bucket]
+    in_selection = pair_positions >= 0
+    rows = pair_positions[in_selection]
+    columns = counts.pair_value[in_selection]
+    data = counts.pair_counts[in_selection] / counts.bucket_totals[counts.pair_bucket[in_selection]]
+    shape = (len(selected), len(dictionary))
+    if sparse:
+        import scipy.sparse
+
+        probabilities = scipy.sparse.csr_matrix((data, (rows, columns)), shape=shape)
+    else:
+        probabilities = np.zeros(shape)
+        probabilities[rows, columns] = data
+
+    known = [j for j in range(dataset.num_features) if j != i]
+    representatives = first_rows[bucket_ranks[selected]]
+    keys = pd.DataFrame({dataset.columns[j]: _take(dataset.dictionaries[j], dataset.codes[representatives, j])
+                         for j in known}, index=pd.Index(bucket_ranks[selected], name='bucket'))
+    values = _take(dictionary, np.arange(len(dictionary)))
+    return PosteriorDistributions(feature, values, keys, probabilities, counts.bucket_totals[selected], cigs[selected],
+                                  total)
+
+
+def _take(dictionary, codes):
+    # the values of a dictionary at the given codes, as an array that keeps the type of the values
+    values = pd.Series(list(dictionary), dtype=object).infer_objects().to_numpy()
+    return values[codes]
@@ -0,0 +1,272 @@
+"""Score new records against a reference dataset that has already been released.
+
+Before more records are released, their CIGs and CSFs are needed as if they were part of the released data. A
+`ReferenceIndex` holds what the calculators need of the reference dataset: the value counts of every feature, for the
+priors, and for every feature the value counts in every leave-one-out bucket, keyed by a hash of the values of the
+other features (see `piflib.encoding.leave_one_out_keys`). A batch of candidate records is scored by looking up the
+buckets of its rows, in time proportional to the size of the batch and of the buckets it falls into, not to the size of
+the reference:
+
+    index = ReferenceIndex.build(released)
+    index.save('released.index')
+    ...
+    index = ReferenceIndex.load('released.index')
+    values = index.score(candidates, ['cig', 'csf'], mode='added')
+
+There are two modes:
+
+- 'added' scores the candidates as if the batch was added to the reference. The results are the same as those of
+  `compute_cigs` and `compute_csfs` on the concatenation of the reference and the batch, for the rows of the batch.
+- 'reference' scores every candidate on its own against the reference. The posterior of a cell is the distribution of
+  the feature among the reference rows that agree with the candidate on all other features, and the prior is that of
+  the reference. If no reference row agrees, the posterior is the prior, and the CIG and CSF are 0.
+"""
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from piflib.buckets import BucketCounts, FeaturePrior, bucket_feature, bucket_kls, bucket_prob_changes
+from piflib.encoding import DictionaryEncoder, encode, group_ids, leave_one_out_keys
+from piflib.factored import compact_index
+from piflib.instrumentation import stage, traced
+
+MODES = ('added', 'reference')
+METRICS = ('cig', 'csf')
+
+
+class ReferenceIndex:
+    """The priors and leave-one-out bucket counts of a reference dataset, see the module documentation.
+
+    Use `build` or `load` to create one.
+
+    :param columns: the feature names
+    :param dictionaries: the distinct values of every feature, ordered by code
+    :param value_counts: the number of rows with every value, for every feature
+    :param total: the number of rows
+    :param codes: the code matrix of the distinct rows
+    :param buckets: for every feature, a tuple of the sorted keys of its buckets, a distinct row of every bucket, the
+        offsets of the pairs of every bucket, and the value code and count of every pair
+    """
+
+    def __init__(self, columns, dictionaries, value_counts, total, codes, buckets):
+        self.columns = columns
+        self.dictionaries = dictionaries
+        self.value_counts = value_counts
+        self.total = total
+        self.codes = codes
+        self.buckets = buckets
+        self._encoder = None
+
+    @classmethod
+    @traced
+    def build(cls, reference, counts=None):
+        """Index a reference dataset.
+
+        :param reference: a Pandas DataFrame object containing tabular data, or an encoded dataset, see
+            `piflib.encoding.encode`
+        :param counts: optional name of a column with the multiplicity of every row, for frequency tables
+        :return: a ReferenceIndex
+        """
+        dataset = encode(reference, counts)
+        keys = leave_one_out_keys(dataset.codes)
+        buckets = []
+        for i in range(dataset.num_features):
+            bucket_ids, num_buckets, (feature_counts,) = bucket_feature(dataset, [i])
+            with stage('reference_indexing', features=[i], buckets=num_buckets):
+                representatives = np.empty(num_buckets, dtype=np.intp)
+                representatives[bucket_ids[::-1]] = np.arange(dataset.num_distinct)[::-1]
+                # order the buckets by key, and the pairs by bucket in that order
+                order = np.argsort(keys[representatives, i])
+                rank = np.empty(num_buckets, dtype=np.intp)
+                rank[order] = np.arange(num_buckets)
+                pair_order = np.argsort(rank[feature_counts.pair_bucket], kind='stable')
+                offsets = np.zeros(num_buckets + 1, dtype=np.intp)
+                np.cumsum(np.bincount(feature_counts.pair_bucket, minlength=num_buckets)[order], out=offsets[1:])
+                buckets.append((keys[representatives[order], i],
+                                compact_index(representatives[order], dataset.num_distinct), offsets,
+                                compact_index(feature_counts.pair_value[pair_order], dataset.cardinalities[i]),
+                                feature_counts.pair_counts[pair_order]))
+        value_counts = [np.bincount(dataset.codes[:, i], weights=dataset.weights, minlength=cardinality)
+                        for i, cardinality in enumerate(dataset.cardinalities)]
+        codes = compact_index(dataset.codes, max(dataset.cardinalities, default=0))
+        return cls(dataset.columns, [list(dictionary) for dictionary in dataset.dictionaries], value_counts,
+                   float(dataset.total), codes, buckets)
+
+    def save(self, path):
+        """Write the index to a file, with pickle. Only load indexes from trusted sources."""
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        """Read an index written by `save`."""
+        with open(path, 'rb') as f:
+            index = pickle.load(f)
+        if not isinstance(index, cls):
+            raise ValueError('{} does not contain a ReferenceIndex'.format(path))
+        return index
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_encoder'] = None
+        return state
+
+    @property
+    def num_features(self):
+        return len(self.columns)
+
+    @traced
+    def score(self, candidates, metrics=('cig',), mode='added', feature_priors={}, feature_accuracies={}, counts=None):
+        """Compute the CIGs and CSFs of a batch of candidate records.
+
+        :param candidates: a Pandas DataFrame with the columns of the reference
+        :param metrics: the metrics to compute, any of 'cig' and 'csf'
+        :param mode: 'added' or 'reference', see the module documentation
+        :param feature_priors: optional dictionary mapping the feature index to an assumed prior
+        :param feature_accuracies: optional dictionary mapping the feature index to the accuracy of the feature
+        :param counts: optional name of a column with the multiplicity of every candidate
+        :return: dictionary mapping every metric to a DataFrame with its values, with the index of `candidates`
+        """
+        if mode not in MODES:
+            raise ValueError('mode must be one of {}'.format(', '.join(repr(mode) for mode in MODES)))
+        unknown_metrics = sorted(set(metrics) - set(METRICS))
+        if unknown_metrics:
+            raise ValueError('unknown metrics: {}'.format(', '.join(unknown_metrics)))
+        weights = np.ones(len(candidates))
+        if counts is not None:
+            weights = candidates[counts].to_numpy(dtype=float)
+            candidates = candidates.drop(columns=[counts])
+        codes, new_values = self._encode(candidates)
+        keys = leave_one_out_keys(codes)
+        results = {metric: np.zeros(codes.shape) for metric in metrics}
+        for i in range(self.num_features):
+            with stage('reference_scoring', features=[i], mode=mode) as scoring:
+                if mode == 'added':
+                    bucket_counts, rows, row_buckets, row_pairs = self._added_buckets(codes, keys[:, i], weights, i)
+                else:
+                    bucket_counts, rows, row_buckets, row_pairs = self._reference_buckets(codes, keys[:, i], i)
+                scoring.annotate(buckets=len(bucket_counts.bucket_totals), pairs=len(bucket_counts.pair_bucket))
+                # number the values of the pairs and the candidates from 0, so that the priors stay small
+                occurring, local_values = np.unique(np.concatenate([bucket_counts.pair_value, codes[:, i]]),
+                                                    return_inverse=True)
+                local_values = local_values.reshape(-1)
+                num_pairs = len(bucket_counts.pair_value)
+                bucket_counts = bucket_counts._replace(pair_value=local_values[:num_pairs])
+                prior = self._prior(i, occurring, new_values[i], feature_priors.get(i), mode, codes[:, i], weights)
+                accuracy = feature_accuracies.get(i, 1)
+                if 'cig' in metrics:
+                    results['cig'][rows, i] = bucket_kls(bucket_counts, prior, accuracy)[row_buckets]
+                if 'csf' in metrics:
+                    # in 'reference' mode the value of a candidate need not occur in its bucket, then the posterior
+                    # of the value is q * (1 - accuracy)
+                    changes = bucket_prob_changes(bucket_counts, prior, accuracy)
+                    unobserved = accuracy * prior.probabilities[local_values[num_pairs:][rows]]
+                    results['csf'][rows, i] = np.where(row_pairs >= 0, changes[row_pairs], unobserved)
+        return {metric: pd.DataFrame(values, columns=self.columns, index=candidates.index)
+                for metric, values in results.items()}
+
+    def _encode(self, candidates):
+        # the codes of the candidates, and the values that do not occur in the reference. These get codes after
+        # those of the reference, in order of their first occurrence.
+        if self._encoder is None:
+            self._encoder = DictionaryEncoder(self.columns)
+            self._encoder.dictionaries = self.dictionaries
+        codes = self._encoder.encode(candidates, grow=False, unknown=-1)
+        new_values = []
+        for i, dictionary in enumerate(self.dictionaries):
+            unknown = codes[:, i] < 0
+            extra = DictionaryEncoder(self.columns[i:i + 1])
+            if unknown.any():
+                codes[unknown, i] = len(dictionary) + extra.encode(candidates.iloc[unknown, i:i + 1])[:, 0]
+            new_values.append(extra.dictionaries[0])
+        return codes, new_values
+
+    def _lookup(self, keys, codes, i):
+        # the position of the reference bucket of every row among the buckets of feature i, -1 for rows without one
+        bucket_keys, representatives = self.buckets[i][:2]
+        if not len(bucket_keys):
+            return np.full(len(keys), -1, dtype=np.intp)
+        known = [j for j in range(self.num_features) if j != i]
+        positions = np.minimum(np.searchsorted(bucket_keys, keys), len(bucket_keys) - 1)
+        candidates = bucket_keys[positions] == keys
+        while True:
+            # compare the values, in case different buckets have the same key; these are next to each other
+            matches = candidates & (self.codes[representatives[positions]][:, known] == codes[:, known]).all(axis=1)
+            retry = np.flatnonzero(candidates & ~matches)
+            if not len(retry):
+                return np.where(matches, positions, -1)
+            positions[retry] += 1
+            candidates[retry] = positions[retry] < len(bucket_keys)
+            positions[retry] = np.minimum(positions[retry], len(bucket_keys) - 1)
+            candidates[retry] &= bucket_keys[positions[retry]] == keys[retry]
+
+    def _gather(self, positions, i):
+        # the pairs of the buckets at the given positions, with the bucket numbered by its place in `positions`
+        offsets, pair_values, pair_counts = self.buckets[i][2:]
+        lengths = offsets[positions + 1] - offsets[positions]
+        starts = offsets[positions] - (np.cumsum(lengths) - lengths)
+        pairs = np.repeat(starts, lengths) + np.arange(lengths.sum())
+        return np.repeat(np.arange(len(positions)), lengths), pair_values[pairs].astype(np.intp), pair_counts[pairs]
+
+    def _reference_buckets(self, codes, keys, i):
+        # the reference buckets of the candidates, the candidates that have one, their bucket, and the pair of their
+        # value in the bucket, -1 if the value does not occur in it
+        positions = self._lookup(keys, codes, i)
+        rows = np.flatnonzero(positions >= 0)
+        found, row_buckets = np.unique(positions[rows], return_inverse=True)
+        row_buckets = row_buckets.reshape(-1)
+        pair_bucket, pair_value, pair_counts = self._gather(found, i)
+        bucket_counts = BucketCounts(pair_bucket, pair_value, pair_counts,
+                                     np.bincount(pair_bucket, weights=pair_counts, minlength=len(found)), None)
+        # look up the pairs of the candidates by their (bucket, value) key
+        num_values = int(max(pair_value.max(initial=0), codes[:, i].max(initial=0))) + 1
+        pair_keys = pair_bucket.astype(np.int64) * num_values + pair_value
+        order = np.argsort(pair_keys)
+        row_keys = row_buckets.astype(np.int64) * num_values + codes[rows, i]
+        places = np.minimum(np.searchsorted(pair_keys[order], row_keys), max(len(order) - 1, 0))
+        row_pairs = np.full(len(rows), -1, dtype=np.intp)
+        if len(order):
+            matched = pair_keys[order[places]] == row_keys
+            row_pairs[matched] = order[places[matched]]
+        return bucket_counts, rows, row_buckets, row_pairs
+
+    def _added_buckets(self, codes, keys, weights, i):
+        # the buckets of the candidates in the reference plus the batch, all candidates, their bucket and their pair
+        known = [j for j in range(self.num_features) if j != i]
+        groups, num_groups = group_ids(codes[:, known], [codes[:, j].max(initial=0) + 1 for j in known])
+        first_rows = np.empty(num_groups, dtype=np.intp)
+        first_rows[groups[::-1]] = np.arange(len(groups))[::-1]
+        positions = self._lookup(keys[first_rows], codes[first_rows], i)
+        in_reference = np.flatnonzero(positions >= 0)
+        reference_bucket, reference_value, reference_counts = self._gather(positions[in_reference], i)
+        num_values = int(max(reference_value.max(initial=0), codes[:, i].max(initial=0))) + 1
+        pair_keys = np.concatenate([in_reference[reference_bucket].astype(np.int64) * num_values + reference_value,
+                                    groups.astype(np.int64) * num_values + codes[:, i]])
+        pair_keys, inverse = np.unique(pair_keys, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        pair_counts = np.bincount(inverse, weights=np.concatenate([reference_counts, weights]),
+                                  minlength=len(pair_keys))
+        pair_bucket, pair_value = np.divmod(pair_keys, num_values)
+        bucket_counts = BucketCounts(pair_bucket, pair_value, pair_counts,
+                                     np.bincount(pair_bucket, weights=pair_counts, minlength=num_groups), None)
+        return bucket_counts, np.arange(len(codes)), groups, inverse[len(reference_counts):]
+
+    def _prior(self, i, occurring, new_values, feature_prior, mode, codes, weights):
+        # the prior of the values with the codes in `occurring`, a sorted array
+        dictionary = self.dictionaries[i]
+        if feature_prior is not None:
+            # in 'reference' mode new values only occur in the candidates, like values outside the data of a prior
+            probabilities = [feature_prior[dictionary[code]] if code < len(dictionary)
+                             else feature_prior[new_values[code - len(dictionary)]] if mode == 'added'
+                             else feature_prior.get(new_values[code - len(dictionary)], 0.0) for code in occurring]
+            return FeaturePrior(np.array(probabilities, dtype=float),
+                                sum(prob for prob in feature_prior.values() if prob > 0))
+        in_reference = occurring < len(dictionary)
+        value_counts = np.zeros(len(occurring))
+        value_counts[in_reference] = self.value_counts[i][occurring[in_reference]]
+        total = self.total
+        if mode == 'added':
+            value_counts += np.bincount(np.searchsorted(occurring, codes), weights=weights, minlength=len(occurring))
+            total += weights.sum()
+        return FeaturePrior(value_counts / total, 1.0)
@@ -0,0 +1,236 @@
+"""Aggregate the row information gain (RIG) of CIG values that arrive in chunks or partitions.
+
+`compute_pif` needs the RIG of every row of the dataset. For streamed or partitioned CIG output, `RigSummary` keeps a
+mergeable quantile sketch of the RIGs instead, together with the riskiest rows and cells, so that the summaries of
+partitions can be combined without concatenating their RIGs.
+
+The sketch is a KLL sketch: a stack of compactors, where an item at level h stands for 2^h records. A full compactor
+sorts its items and promotes every other one to the next level. As long as no compaction has happened, the percentiles
+are exact and the same as those of `compute_pif`. After that, the rank error of a percentile is of the order of
+1 / `size` of the number of records, independently of the number of records.
+"""
+import numpy as np
+import pandas as pd
+
+from piflib.pif_calculator import weighted_percentile
+
+
+class QuantileSketch:
+    """Mergeable sketch of the distribution of a stream of numbers.
+
+    :param size: the capacity of the largest compactor. The memory use is about 3 * `size` numbers, the rank error is
+        of the order of 1 / `size`.
+    :param seed: seed or `np.random.Generator` for the random offsets of the compactions
+    """
+
+    def __init__(self, size=200, seed=None):
+        self.size = size
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self._levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values, counts=None):
+        """Add values to the sketch.
+
+        :param values: 1-D array of values
+        :param counts: optional positive integer multiplicity of every value
+        """
+        values = np.asarray(values, dtype=float)
+        if not len(values):
+            return self
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        if counts is None:
+            self.count += len(values)
+            self._levels[0] = np.concatenate([self._levels[0], values])
+        else:
+            counts = np.asarray(counts, dtype=np.int64)
+            self.count += int(counts.sum())
+            # a value that occurs c times is an item at level h for every bit h of c
+            for h in range(int(counts.max()).bit_length()):
+                if h == len(self._levels):
+                    self._levels.append(np.empty(0))
+                self._levels[h] = np.concatenate([self._levels[h], values[(counts >> h) & 1 == 1]])
+        self._compress()
+        return self
+
+    def merge(self, other):
+        """Add the values of another sketch."""
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        for h, items in enumerate(other._levels):
+            if h == len(self._levels):
+                self._levels.append(np.empty(0))
+            self._levels[h] = np.concatenate([self._levels[h], items])
+        self._compress()
+        return self
+
+    def percentile(self, percentile):
+        """Estimate the percentile(s) of the values, with the interpolation of `np.percentile`.
+
+        :param percentile: percentile, or array of percentiles, between 0 and 100
+        :return: the percentile(s)
+        """
+        if not self.count:
+            raise ValueError('the sketch is empty')
+        items = np.concatenate(self._levels)
+        weights = np.concatenate([np.full(len(items), 1 << h, dtype=np.int64) for h, items in enumerate(self._levels)])
+        result = weighted_percentile(items, weights, percentile)
+        # the extremes may have been compacted away, but are known exactly
+        percentile = np.asarray(percentile, dtype=float)
+        return np.where(percentile == 0, self.min, np.where(percentile == 100, self.max, result))[()]
+
+    def _capacity(self, h):
+        return max(int(np.ceil(self.size * (2 / 3) ** (len(self._levels) - 1 - h))), 2)
+
+    def _compress(self):
+        h = 0
+        while h < len(self._levels):
+            items = self._levels[h]
+            if len(items) <= self._capacity(h):
+                h += 1
+                continue
+            if h + 1 == len(self._levels):
+                self._levels.append(np.empty(0))
+            items = np.sort(items)
+            # an odd item out stays at this level
+            keep = len(items) % 2
+            self._levels[h + 1] = np.concatenate([self._levels[h + 1], items[keep + self._rng.integers(2)::2]])
+            self._levels[h] = items[:keep]
+            # the capacities of the lower levels shrink as the stack grows
+            h = 0
+
+
+class RigSummary:
+    """Percentiles of the RIG, and the riskiest rows and cells, of CIG values that arrive in chunks.
+
+    Summaries of different chunks or partitions can be merged. The riskiest rows and cells are exact, the percentiles
+    are estimated with a `QuantileSketch`.
+
+    :param percentiles: the percentiles of the RIG to report, see `compute_pif`
+    :param top_k: the number of riskiest rows and cells to keep
+    :param sketch_size: the size of the quantile sketch, see `QuantileSketch`
+    :param seed: seed or `np.random.Generator` for the quantile sketch
+    """
+
+    def __init__(self, percentiles=(50, 90, 95, 99, 100), top_k=1000, sketch_size=200, seed=None):
+        self.percentiles = list(percentiles)
+        self.top_k = top_k
+        self.sketch = QuantileSketch(sketch_size, seed)
+        self.columns = None
+        self._rows = None
+        self._cells = None
+
+    def update(self, cigs, counts=None):
+        """Add a chunk of CIG values.
+
+        :param cigs: DataFrame with the CIG values of some rows, e.g. from `piflib.streaming.compute_cigs_chunked`
+        :param counts: optional number of records every row stands for, see `compute_pif`
+        """
+        if self.columns is None:
+            self.columns = cigs.columns
+        elif not cigs.columns.equals(self.columns):
+            raise ValueError('cannot summarize CIGs with different columns')
+        values = cigs.to_numpy(dtype=float)
+        rigs = values.sum(axis=1)
+        self.sketch.update(rigs, counts)
+        rows = pd.DataFrame(values, columns=self.columns, index=cigs.index)
+        rows['RIG'] = rigs
+        self._rows = _largest(self._rows, rows, 'RIG', self.top_k)
+        self._cells = _largest(self._cells, _candidate_cells(values, cigs.index, self.columns, self.top_k), 'CIG',
+                               self.top_k)
+        return self
+
+    def merge(self, other):
+        """Add the rows of another summary."""
+        if other.columns is None:
+            return self
+        if self.columns is None:
+            self.columns = other.columns
+        elif not other.columns.equals(self.columns):
+            raise ValueError('cannot merge summaries of CIGs with different columns')
+        self.sketch.merge(other.sketch)
+        self._rows = _largest(self._rows, other._rows, 'RIG', self.top_k)
+        self._cells = _largest(self._cells, other._cells, 'CIG', self.top_k)
+        return self
+
+    def pif(self):
+        """Return the PIF for every percentile, as a Pandas Series indexed by percentile."""
+        return pd.Series(self.sketch.percentile(self.percentiles), index=self.percentiles)
+
+    def top_rows(self):
+        """Return the riskiest rows: their CIG values and their RIG, sorted by decreasing RIG."""
+        return self._rows
+
+    def top_cells(self):
+        """Return the riskiest cells: their row label, their column and their CIG, sorted by decreasing CIG."""
+        return self._cells
+
+
+def top_rows(cigs, k):
+    """Find the k rows with the highest RIG.
+
+    :param cigs: the CIG values of the dataset (see `compute_cigs`)
+    :param k: the number of rows
+    :return: DataFrame with the CIG values and the RIG of the rows, sorted by decreasing RIG. Ties keep the order of
+        `cigs`.
+    """
+    rows = cigs.copy()
+    rows['RIG'] = cigs.sum(axis=1)
+    return _largest(None, rows, 'RIG', k)
+
+
+def top_cells(cigs, k):
+    """Find the k cells with the highest CIG.
+
+    :param cigs: the CIG values of the dataset (see `compute_cigs`)
+    :param k: the number of cells
+    :return: DataFrame with the row label, the column and the CIG of the cells, sorted by decreasing CIG. Ties keep the
+        row-major order of `cigs`.
+    """
+    return _largest(None, _candidate_cells(cigs.to_numpy(dtype=float), cigs.index, cigs.columns, k), 'CIG', k)
+
+
+def _candidate_cells(values, index, columns, k):
+    # the k cells with the largest values of a CIG matrix, in row-major order, as a long-format DataFrame. Only these
+    # cells are materialized, never the whole matrix.
+    flat = values.reshape(-1)
+    if len(flat) <= k:
+        positions = np.arange(len(flat))
+    elif k == 0:
+        positions = np.empty(0, dtype=np.intp)
+    else:
+        threshold = flat[np.argpartition(flat, len(flat) - k)[len(flat) - k:]].min()
+        above = np.flatnonzero(flat > threshold)
+        # ties at the threshold keep their row-major order, as in `_largest`
+        positions = np.sort(np.concatenate([above, _first_nonzero(flat == threshold, k - len(above))]))
+    row_positions, column_positions = np.divmod(positions, len(columns))
+    return pd.DataFrame({'row': index.to_numpy()[row_positions], 'column': columns.to_numpy()[column_positions],
+                         'CIG': flat[positions]}, index=positions)
+
+
+def _first_nonzero(mask, n, block=65536):
+    # the positions of the first n True entries of a boolean array, scanning it in blocks
+    positions = []
+    for start in range(0, len(mask), block):
+        if n <= 0:
+            break
+        found = np.flatnonzero(mask[start:start + block])[:n] + start
+        positions.append(found)
+        n -= len(found)
+    return np.concatenate(positions) if positions else np.empty(0, dtype=np.intp)
+
+
+def _largest(current, new, column, k):
+    # the k rows with the largest values in `column`, of the current ones followed by the new ones
+    frame = new if current is None else pd.concat([current, new])
+    values = frame[column].to_numpy()
+    if len(values) > k:
+        # only sort the candidates
+        threshold = np.partition(values, len(values) - k)[len(values) - k] if k else np.inf
+        frame = frame[values >= threshold]
+        values = frame[column].to_numpy()
+    return frame.iloc[np.argsort(-values, kind='stable')[:k]]
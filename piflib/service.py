@@ -0,0 +1,446 @@
+"""A local service that runs PIF computations as jobs on a bounded pool of worker processes.
+
+Teams that share a host submit their datasets to one service instead of running the calculators side by side:
+
+    python -m piflib.service --port 8765 --workers 4
+    python -m piflib.service --unix-socket /tmp/piflib.sock
+
+The API speaks JSON over HTTP:
+
+    POST /jobs          submit a job, see `PifService.submit`
+    GET /jobs           list the jobs, without their results
+    GET /jobs/<id>      the status, progress and, when done, the result of a job
+    DELETE /jobs/<id>   cancel a job
+
+A job is identified by a hash of its data, function and parameters, so submitting the same job twice returns the
+existing job, and its result once it is done. The results of the most recently used finished jobs are kept.
+
+Progress is the fraction of the (combination, unknown feature) pairs whose values have been computed, as reported by
+the instrumentation of the calculators (see `piflib.instrumentation`). Running jobs are cancelled at the end of the
+next stage of the calculation.
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+FUNCTIONS = ('compute_cigs', 'compute_csfs', 'compute_pif')
+# the parameters a job of every function can set, passed to the calculators; 'percentile' is used by compute_pif itself
+PARAMETERS = {
+    'compute_cigs': ('feature_accuracies', 'unknown_features', 'samples', 'seed'),
+    'compute_csfs': ('feature_accuracies',),
+    'compute_pif': ('feature_accuracies', 'unknown_features', 'samples', 'seed', 'percentile'),
+}
+# the stages that compute the values of one or more unknown features, which measure the progress of a job
+_KERNEL_STAGES = ('bucket_kls', 'bucket_prob_changes')
+
+_REASONS = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            503: 'Service Unavailable'}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class ServiceError(Exception):
+    """An invalid request, answered with an HTTP error status."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Job:
+    """A submitted computation and its state.
+
+    :param job_id: the hash of the data, function and parameters
+    :param function: one of `FUNCTIONS`
+    :param params: the parameters of the function
+    """
+
+    def __init__(self, job_id, function, params):
+        self.id = job_id
+        self.function = function
+        self.params = params
+        self.status = 'queued'
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.future = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def active(self):
+        return self.status in ('queued', 'running')
+
+    def to_dict(self, result=True):
+        job = {'id': self.id, 'function': self.function, 'params': self.params, 'status': self.status,
+               'progress': self.progress, 'submitted': self.submitted, 'started': self.started,
+               'finished': self.finished}
+        if self.error is not None:
+            job['error'] = self.error
+        if result and self.result is not None:
+            job['result'] = self.result
+        return job
+
+
+class PifService:
+    """Run jobs on a bounded process pool and serve them over HTTP.
+
+    :param workers: the number of worker processes. Defaults to the number of CPUs.
+    :param max_queued: the number of jobs that can wait for a worker. Further submissions are rejected.
+    :param cache_size: the number of finished jobs whose results are kept, least recently used first out
+    """
+
+    def __init__(self, workers=None, max_queued=100, cache_size=32):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queued = max_queued
+        self.cache_size = cache_size
+        self.jobs = collections.OrderedDict()
+        self._pending = collections.deque()
+        self._running = 0
+        self._loop = None
+        self._pool = None
+        self._manager = None
+        self._servers = []
+
+    async def __aenter__(self):
+        self._loop = asyncio.get_running_loop()
+        # spawned workers do not inherit the threads of the service
+        context = multiprocessing.get_context('spawn')
+        self._manager = context.Manager()
+        self._messages = self._manager.Queue()
+        self._cancelled = self._manager.dict()
+        self._pool = concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=context)
+        self._listener = threading.Thread(target=self._listen, daemon=True)
+        self._listener.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """Stop serving, cancel the queued jobs and shut the workers down."""
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers = []
+        for job in list(self.jobs.values()):
+            if job.active:
+                self.cancel(job.id)
+        await self._loop.run_in_executor(None, self._pool.shutdown)
+        self._messages.put(None)
+        await self._loop.run_in_executor(None, self._listener.join)
+        self._manager.shutdown()
+
+    async def serve(self, host='127.0.0.1', port=0, path=None):
+        """Start serving the HTTP API on a TCP port, or on a Unix socket if `path` is given.
+
+        :return: the asyncio server. With `port` 0, `server.sockets[0].getsockname()` gives the port.
+        """
+        if path is not None:
+            server = await asyncio.start_unix_server(self._handle, path)
+        else:
+            server = await asyncio.start_server(self._handle, host, port)
+        self._servers.append(server)
+        return server
+
+    async def submit(self, request):
+        """Submit a job.
+
+        :param request: dictionary with the 'function' (one of `FUNCTIONS`), the data as either 'csv' (the text of a
+            CSV file) or 'path' (of a CSV or Parquet file on the host of the service), and optional 'params', a
+            dictionary with any of the `PARAMETERS` of the function. Feature indices are given as strings, as JSON
+            requires.
+        :return: the Job. An identical job that was submitted before is returned instead of a new one, unless it
+            failed or was cancelled.
+        """
+        if not isinstance(request, dict):
+            raise ServiceError(400, 'the request has to be a JSON object')
+        function = request.get('function')
+        if not isinstance(function, str) or function not in FUNCTIONS:
+            raise ServiceError(400, 'function has to be one of {}'.format(', '.join(FUNCTIONS)))
+        params = request.get('params') or {}
+        if not isinstance(params, dict):
+            raise ServiceError(400, 'params has to be a JSON object')
+        unknown = set(params) - set(PARAMETERS[function])
+        if unknown:
+            raise ServiceError(400, 'unknown parameters for {}: {}'.format(function, ', '.join(sorted(unknown))))
+        if function == 'compute_pif' and 'percentile' not in params:
+            raise ServiceError(400, 'compute_pif needs a percentile')
+        _check_params(params)
+        if ('csv' in request) == ('path' in request):
+            raise ServiceError(400, "the data has to be given as either 'csv' or 'path'")
+        if not isinstance(request.get('csv', request.get('path')), str):
+            raise ServiceError(400, "'csv' and 'path' have to be strings")
+        if 'csv' in request:
+            data, file_format = request['csv'].encode(), 'csv'
+        else:
+            path = request['path']
+            file_format = 'parquet' if path.endswith(('.parquet', '.pq')) else 'csv'
+            try:
+                data = await self._loop.run_in_executor(None, _read_bytes, path)
+            except OSError as e:
+                raise ServiceError(400, 'cannot read {}: {}'.format(path, e.strerror))
+
+        job_id = job_key(data, function, params)
+        job = self.jobs.get(job_id)
+        if job is not None and job.status not in ('failed', 'cancelled'):
+            self.jobs.move_to_end(job_id)
+            return job
+        if sum(job.active for job in self.jobs.values()) >= self.workers + self.max_queued:
+            raise ServiceError(503, 'too many jobs, try again later')
+        job = self.jobs[job_id] = Job(job_id, function, params)
+        self.jobs.move_to_end(job_id)
+        self._cancelled.pop(job_id, None)
+        self._pending.append((job, data, file_format))
+        self._dispatch()
+        return job
+
+    def _dispatch(self):
+        # the pool would accept more tasks than it has workers, but tasks that it accepted cannot be cancelled any more
+        while self._running < self.workers and self._pending:
+            job, data, file_format = self._pending.popleft()
+            if job.status == 'cancelled':
+                continue
+            self._running += 1
+            job.future = self._pool.submit(_run_job, job.id, job.function, data, file_format, job.params,
+                                           self._messages, self._cancelled)
+            job.future.add_done_callback(lambda future, job=job: self._loop.call_soon_threadsafe(self._finish, job,
+                                                                                                 future))
+
+    def get(self, job_id):
+        """Return a job and mark it as recently used, or None if there is no such job."""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            self.jobs.move_to_end(job_id)
+        return job
+
+    def cancel(self, job_id):
+        """Cancel a job. A queued job is cancelled at once, a running one at the end of its current stage.
+
+        :return: the job, or None if there is no such job
+        """
+        job = self.jobs.get(job_id)
+        if job is None or not job.active:
+            return job
+        if job.future is None:
+            # still waiting for a worker
+            job.status = 'cancelled'
+            job.finished = time.time()
+            self._evict()
+        else:
+            self._cancelled[job_id] = True
+        return job
+
+    def _finish(self, job, future):
+        self._running -= 1
+        self._dispatch()
+        job.finished = time.time()
+        if isinstance(future.exception(), JobCancelled):
+            job.status = 'cancelled'
+        elif future.exception() is not None:
+            job.status = 'failed'
+            job.error = '{}: {}'.format(type(future.exception()).__name__, future.exception())
+        else:
+            job.status = 'done'
+            job.progress = 1.0
+            job.result = future.result()
+        self._cancelled.pop(job.id, None)
+        self._evict()
+
+    def _evict(self):
+        finished = [job_id for job_id, job in self.jobs.items() if not job.active]
+        for job_id in finished[:max(len(finished) - self.cache_size, 0)]:
+            del self.jobs[job_id]
+
+    def _listen(self):
+        # forward the messages of the workers to the event loop
+        while True:
+            message = self._messages.get()
+            if message is None:
+                return
+            self._loop.call_soon_threadsafe(self._update, *message)
+
+    def _update(self, job_id, status, progress):
+        job = self.jobs.get(job_id)
+        if job is None or not job.active:
+            return
+        if status == 'running' and job.started is None:
+            job.started = time.time()
+        job.status = status
+        job.progress = progress
+
+    async def _handle(self, reader, writer):
+        try:
+            try:
+                method, target, body = await _read_request(reader)
+                status, payload = await self._route(method, target, body)
+            except ServiceError as e:
+                status, payload = e.status, {'error': str(e)}
+            except (ValueError, UnicodeDecodeError, asyncio.IncompleteReadError) as e:
+                status, payload = 400, {'error': 'invalid request: {}'.format(e)}
+            data = json.dumps(payload).encode()
+            head = 'HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: close\r\n\r\n'
+            writer.write(head.format(status, _REASONS[status], len(data)).encode('latin-1') + data)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _route(self, method, target, body):
+        parts = [part for part in target.split('?')[0].split('/') if part]
+        if not parts or parts[0] != 'jobs' or len(parts) > 2:
+            raise ServiceError(404, 'no such resource')
+        if len(parts) == 1:
+            if method == 'GET':
+                return 200, [job.to_dict(result=False) for job in self.jobs.values()]
+            if method == 'POST':
+                request = json.loads(body.decode() or '{}')
+                if not isinstance(request, dict):
+                    raise ServiceError(400, 'expected a JSON object')
+                return 202, (await self.submit(request)).to_dict()
+        else:
+            if method in ('GET', 'DELETE'):
+                job = self.get(parts[1]) if method == 'GET' else self.cancel(parts[1])
+                if job is None:
+                    raise ServiceError(404, 'no such job')
+                return 200, job.to_dict()
+        raise ServiceError(405, 'method {} not allowed'.format(method))
+
+
+def job_key(data, function, params):
+    """Hash the data, function and parameters of a job into its id.
+
+    Feature indices may be given as integers or as strings, as after a JSON round trip; both give the same id.
+    """
+    if 'feature_accuracies' in params:
+        params = dict(params, feature_accuracies={str(int(i)): accuracy
+                                                  for i, accuracy in params['feature_accuracies'].items()})
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps([function, params], sort_keys=True).encode())
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def _check_params(params):
+    # the types and ranges of the parameters, so that invalid jobs are rejected before they reach a worker
+    def is_number(value):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    def is_integer(value):
+        return isinstance(value, int) and not isinstance(value, bool)
+
+    accuracies = params.get('feature_accuracies', {})
+    if not isinstance(accuracies, dict):
+        raise ServiceError(400, 'feature_accuracies has to be a JSON object')
+    for i, accuracy in accuracies.items():
+        if not (is_integer(i) or isinstance(i, str) and i.isdigit()):
+            raise ServiceError(400, 'feature_accuracies has to be keyed by feature index, got {!r}'.format(i))
+        if not is_number(accuracy) or not 0 <= accuracy <= 1:
+            raise ServiceError(400, 'feature accuracies have to be numbers between 0 and 1')
+    if len({int(i) for i in accuracies}) < len(accuracies):
+        raise ServiceError(400, 'feature_accuracies gives the accuracy of a feature more than once')
+    if 'unknown_features' in params and not (is_integer(params['unknown_features']) and params['unknown_features'] >= 1):
+        raise ServiceError(400, 'unknown_features has to be a positive integer')
+    if params.get('samples') is not None and not (is_integer(params['samples']) and params['samples'] >= 1):
+        raise ServiceError(400, 'samples has to be a positive integer')
+    if params.get('seed') is not None and not is_integer(params['seed']):
+        raise ServiceError(400, 'seed has to be an integer')
+    if 'percentile' in params:
+        percentiles = params['percentile'] if isinstance(params['percentile'], list) else [params['percentile']]
+        if not percentiles or not all(is_number(percentile) and 0 <= percentile <= 100 for percentile in percentiles):
+            raise ServiceError(400, 'percentile has to be a number, or a list of numbers, between 0 and 100')
+
+
+def _read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+async def _read_request(reader):
+    request_line = (await reader.readline()).decode('latin-1')
+    method, target, _ = request_line.split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return method, target, body
+
+
+def _run_job(job_id, function, data, file_format, params, messages, cancelled):
+    # runs in a worker process
+    import numpy as np
+    import pandas as pd
+
+    from piflib import pif_calculator
+    from piflib.instrumentation import Trace
+
+    messages.put((job_id, 'running', 0.0))
+    if file_format == 'parquet':
+        frame = pd.read_parquet(io.BytesIO(data))
+    else:
+        frame = pd.read_csv(io.BytesIO(data))
+    kwargs = {name: value for name, value in params.items() if name != 'percentile'}
+    if 'feature_accuracies' in kwargs:
+        kwargs['feature_accuracies'] = {int(i): accuracy for i, accuracy in kwargs['feature_accuracies'].items()}
+    # every combination of unknown features computes the values of each of its features in one kernel stage
+    unknown_features = kwargs.get('unknown_features', 1)
+    num_features = frame.shape[1]
+    combinations = kwargs.get('samples') or (pif_calculator.binom(num_features, unknown_features)
+                                             if unknown_features <= num_features else 1)
+    total = max(combinations * unknown_features, 1)
+    done = 0
+
+    def report(event):
+        nonlocal done
+        if job_id in cancelled:
+            raise JobCancelled()
+        if event['name'] in _KERNEL_STAGES:
+            done += len(event['attributes']['features'])
+            messages.put((job_id, 'running', min(done / total, 1.0)))
+
+    with Trace(callback=report):
+        if function == 'compute_pif':
+            cigs = pif_calculator.compute_cigs(frame, **kwargs)
+            return {'pif': np.asarray(pif_calculator.compute_pif(cigs, params['percentile'])).tolist()}
+        values = getattr(pif_calculator, function)(frame, **kwargs)
+    return {'columns': [str(column) for column in values.columns], 'data': values.values.tolist()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve PIF computations as jobs on a pool of worker processes.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix-socket', help='serve on this Unix socket instead of a TCP port')
+    parser.add_argument('--workers', type=int, help='number of worker processes, defaults to the number of CPUs')
+    parser.add_argument('--max-queued', type=int, default=100, help='number of jobs that can wait for a worker')
+    parser.add_argument('--cache-size', type=int, default=32, help='number of finished jobs to keep')
+    args = parser.parse_args(argv)
+
+    async def run():
+        async with PifService(args.workers, args.max_queued, args.cache_size) as service:
+            server = await service.serve(args.host, args.port, args.unix_socket)
+            print('serving on {}'.format(args.unix_socket or server.sockets[0].getsockname()), flush=True)
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
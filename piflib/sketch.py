@@ -0,0 +1,346 @@
+"""Approximate CIGs of very large datasets in bounded memory.
+
+The exact calculators hold the distinct rows of a dataset, and the CIG of a cell is the KL divergence of the
+distribution of the feature within the leave-one-out bucket of the row from the prior of the feature. When almost every
+bucket holds a single row, the exact computation needs memory proportional to the number of rows. A `CigSketch`
+replaces the bucket counts with count-min sketches of fixed size:
+
+- every row is hashed to a 64-bit key for the leave-one-out bucket of every feature,
+- one sketch counts the rows of every bucket, another the rows of every (bucket, value) pair,
+- buckets whose estimated size reaches a threshold are 'heavy'. Their pairs are counted exactly in a second pass, and
+  their CIGs are exact.
+
+A sketch never underestimates a count, and with probability 1 - exp(-depth) it overestimates it by at most
+`error` = e / width * the number of rows. For the rows of the other buckets the sketch only tells how often the value
+of the row occurs in its bucket, not how the rest of the bucket is distributed. The estimate of the CIG assumes the rest
+follows the prior, which is exact for buckets whose rows all have the same value, e.g. those with a single row. The
+lower and upper bounds are the smallest and largest KL divergences of all bucket distributions that agree with the
+sketch within `error`. They hold for a cell with probability `confidence`.
+
+The PIF of the estimates and its bounds are computed from histograms of the RIGs, so they need no memory per row
+either:
+
+    sketch = sketch_cigs('huge.parquet', memory=2 ** 28)
+    pif = sketch.pif('huge.parquet', 95)
+    if pif.lower > target:
+        ...  # no need to run the exact calculation
+
+The priors of the features are exact, so the memory also grows with the number of distinct values of every feature.
+"""
+import collections
+import math
+
+import numpy as np
+import pandas as pd
+
+from piflib.buckets import BucketCounts, FeaturePrior, bucket_kls, prior_probabilities
+from piflib.encoding import DictionaryEncoder, leave_one_out_keys, mix64
+from piflib.instrumentation import stage, traced
+from piflib.streaming import iterate_chunks
+
+ApproximateCigs = collections.namedtuple('ApproximateCigs', ['estimate', 'lower', 'upper'])
+ApproximateCigs.__doc__ = """Approximate CIG values of a chunk, with bounds, each a DataFrame with the index of the chunk."""
+
+PifEstimate = collections.namedtuple('PifEstimate', ['estimate', 'lower', 'upper'])
+PifEstimate.__doc__ = """The PIF of the estimated CIGs, with bounds."""
+
+_HISTOGRAM_BINS = 2 ** 16
+
+
+def _plogq(p, q):
+    # p * log2(p / q), with 0 * log2(0) = 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(p > 0, p * np.log2(np.where(p > 0, p, 1) / q), 0.0)
+
+
+class CigSketch:
+    """Count-min sketches of the bucket and pair counts of every feature, see the module documentation.
+
+    Use `sketch_cigs` to build one.
+
+    :param memory: the number of bytes of all sketches together
+    :param depth: the number of hash functions of every sketch
+    :param counts: optional name of a column with the multiplicity of every row
+    :param seed: the seed of the hash functions
+    """
+
+    def __init__(self, memory=2 ** 26, depth=4, counts=None, seed=0):
+        self.memory = memory
+        self.depth = depth
+        self.counts = counts
+        self.seed = seed
+        self.width = None
+        self.total = 0.0
+        self.encoder = None
+        self.heavy_threshold = None
+        self._value_counts = None
+        self._bucket_sketch = None
+        self._pair_sketch = None
+        self._heavy = None
+
+    @property
+    def columns(self):
+        return None if self.encoder is None else self.encoder.columns
+
+    @property
+    def error(self):
+        """The overestimate of a count that is exceeded with a probability of at most exp(-depth)."""
+        return math.e / self.width * self.total
+
+    @property
+    def confidence(self):
+        """The probability that the bounds of a cell hold."""
+        return max(1 - 2 * math.exp(-self.depth), 0)
+
+    def update(self, chunk):
+        """Add the rows of a DataFrame chunk to the sketches (first pass)."""
+        codes, weights, keys = self._hash(chunk, grow=True)
+        num_features = codes.shape[1]
+        if self.width is None:
+            self.width = max(self.memory // (16 * num_features * self.depth), 1)
+            self._bucket_sketch = np.zeros((num_features, self.depth * self.width))
+            self._pair_sketch = np.zeros((num_features, self.depth * self.width))
+            self._value_counts = [np.zeros(0) for _ in range(num_features)]
+        repeated = np.tile(weights, self.depth)
+        for i in range(num_features):
+            np.add.at(self._bucket_sketch[i], self._cells(keys[:, i], 0).reshape(-1), repeated)
+            np.add.at(self._pair_sketch[i], self._cells(self._pair_keys(keys[:, i], codes[:, i]), 1).reshape(-1),
+                      repeated)
+            counts = np.bincount(codes[:, i], weights=weights, minlength=len(self.encoder.dictionaries[i]))
+            counts[:len(self._value_counts[i])] += self._value_counts[i]
+            self._value_counts[i] = counts
+        self.total += weights.sum()
+        return self
+
+    def prepare(self, feature_priors={}, feature_accuracies={}, heavy_threshold=None):
+        """Set the priors and accuracies after the first pass.
+
+        :param feature_priors: optional dictionary mapping the feature index to an assumed prior
+        :param feature_accuracies: optional dictionary mapping the feature index to the accuracy of the feature
+        :param heavy_threshold: the estimated size from which on a bucket is counted exactly. Defaults to twice the
+            `error`, which makes at most about width / e buckets of every feature heavy.
+        """
+        if self.encoder is None:
+            raise ValueError('no rows were added')
+        self.priors = {}
+        for i, dictionary in enumerate(self.encoder.dictionaries):
+            prior = feature_priors.get(i)
+            if prior is None:
+                prior = dict(zip(dictionary, (self._value_counts[i] / self.total).tolist()))
+            self.priors[i] = FeaturePrior(prior_probabilities(dictionary, prior),
+                                          sum(prob for prob in prior.values() if prob > 0))
+        self.accuracies = {i: feature_accuracies.get(i, 1) for i in self.priors}
+        self.heavy_threshold = max(2 * self.error, 1) if heavy_threshold is None else heavy_threshold
+        self._heavy = [[] for _ in self.priors]
+
+    def collect_heavy(self, chunk):
+        """Count the pairs of the heavy buckets of a DataFrame chunk exactly (second pass)."""
+        codes, weights, keys = self._hash(chunk, grow=False)
+        for i, parts in enumerate(self._heavy):
+            heavy = self._estimate(self._bucket_sketch[i], self._cells(keys[:, i], 0)) >= self.heavy_threshold
+            if heavy.any():
+                parts.append((keys[heavy, i], codes[heavy, i], weights[heavy]))
+                if sum(len(part[0]) for part in parts[1:]) >= len(parts[0][0]):
+                    parts[:] = [_aggregate(*(np.concatenate(arrays) for arrays in zip(*parts)))]
+
+    def finish(self):
+        """Compute the exact CIGs of the heavy buckets after the second pass."""
+        for i, parts in enumerate(self._heavy):
+            if not parts:
+                self._heavy[i] = (np.zeros(0, dtype=np.uint64), np.zeros(0))
+                continue
+            keys, values, counts = _aggregate(*(np.concatenate(arrays) for arrays in zip(*parts)))
+            bucket_keys, pair_bucket = np.unique(keys, return_inverse=True)
+            bucket_counts = BucketCounts(pair_bucket.reshape(-1), values, counts,
+                                         np.bincount(pair_bucket.reshape(-1), weights=counts), None)
+            self._heavy[i] = (bucket_keys, bucket_kls(bucket_counts, self.priors[i], self.accuracies[i]))
+
+    @property
+    def num_heavy(self):
+        """The number of heavy buckets of every feature."""
+        return [len(bucket_keys) for bucket_keys, _ in self._heavy]
+
+    def score(self, chunk):
+        """Estimate the CIGs of the rows of a DataFrame chunk (third pass).
+
+        :return: ApproximateCigs with the estimates and their lower and upper bounds
+        """
+        codes, weights, keys = self._hash(chunk, grow=False)
+        error = self.error
+        estimate, lower, upper = (np.empty(codes.shape) for _ in range(3))
+        for i, prior in self.priors.items():
+            accuracy = self.accuracies[i]
+            probabilities = prior.probabilities
+            q = probabilities[codes[:, i]]
+            # the smallest prior of another value of the feature
+            order = np.argsort(probabilities)[:2]
+            q_other = np.full(len(q), probabilities[order[0]])
+            if len(order) > 1:
+                q_other[codes[:, i] == order[0]] = probabilities[order[1]]
+            else:
+                q_other[:] = np.nan
+
+            bucket_cells = self._cells(keys[:, i], 0)
+            pair_cells = self._cells(self._pair_keys(keys[:, i], codes[:, i]), 1)
+            bucket_totals = self._estimate(self._bucket_sketch[i], bucket_cells)
+            pair_counts = np.minimum(self._estimate(self._pair_sketch[i], pair_cells), bucket_totals)
+            # the estimate of the share of the value of the row in its bucket corrects the counts for the expected
+            # collisions, the bounds use the counts as they are
+            share = (np.maximum(self._unbiased_estimate(self._pair_sketch[i], pair_cells), weights)
+                     / np.maximum(self._unbiased_estimate(self._bucket_sketch[i], bucket_cells), weights))
+            share_low = np.maximum(weights, pair_counts - error) / bucket_totals
+            share_high = np.minimum(pair_counts / np.maximum(bucket_totals - error, pair_counts), 1)
+
+            share = np.clip(share, share_low, share_high)
+            estimate[:, i] = _kl_low(share, q, prior.mass, accuracy)
+            lower[:, i] = _kl_low(np.clip(q, share_low, share_high), q, prior.mass, accuracy)
+            upper[:, i] = np.maximum(_kl_high(share_low, q, q_other, prior.mass, accuracy),
+                                     _kl_high(share_high, q, q_other, prior.mass, accuracy))
+            upper[:, i] = np.where(np.isnan(upper[:, i]), estimate[:, i], upper[:, i])
+
+            bucket_keys, kls = self._heavy[i]
+            heavy = np.isin(keys[:, i], bucket_keys) if len(bucket_keys) else np.zeros(len(q), dtype=bool)
+            exact = kls[np.searchsorted(bucket_keys, keys[heavy, i])]
+            for values in estimate, lower, upper:
+                values[heavy, i] = exact
+
+        frames = (pd.DataFrame(values, columns=self.columns, index=chunk.index) for values in (estimate, lower, upper))
+        return ApproximateCigs(*frames)
+
+    def cigs(self, chunks):
+        """Estimate the CIGs of a dataset that is read in chunks, see `score`.
+
+        :param chunks: the chunks the sketch was built from, see `piflib.streaming.iterate_chunks`
+        :return: generator of ApproximateCigs, one per chunk
+        """
+        for chunk in iterate_chunks(chunks):
+            yield self.score(chunk)
+
+    def pif(self, chunks, percentile):
+        """Estimate the PIF of a dataset that is read in chunks.
+
+        The RIGs are collected in histograms, so the lower bound is rounded down and the upper bound rounded up to the
+        next bin edge, with bins of 1 / 65536 of the largest possible RIG.
+
+        :param chunks: the chunks the sketch was built from, see `piflib.streaming.iterate_chunks`
+        :param percentile: percentile, or sequence of percentiles, between 0 and 100
+        :return: PifEstimate, with floats or, for a sequence of percentiles, arrays
+        """
+        largest = sum(max(-math.log2(prior.probabilities.min()), 0) for prior in self.priors.values()) or 1.0
+        edges = np.linspace(0, largest, _HISTOGRAM_BINS + 1)
+        histograms = [np.zeros(_HISTOGRAM_BINS) for _ in range(3)]
+        with stage('pif_histograms', bins=_HISTOGRAM_BINS):
+            for chunk in iterate_chunks(chunks):
+                weights = self._weights(chunk)
+                for histogram, values in zip(histograms, self.score(chunk)):
+                    rigs = np.clip(values.values.sum(axis=1), 0, largest)
+                    bins = np.minimum((rigs / largest * _HISTOGRAM_BINS).astype(np.intp), _HISTOGRAM_BINS - 1)
+                    histogram += np.bincount(bins, weights=weights, minlength=_HISTOGRAM_BINS)
+        ranks = np.asarray(percentile, dtype=float) / 100 * (self.total - 1)
+        estimate_histogram, lower_histogram, upper_histogram = (np.cumsum(histogram) for histogram in histograms)
+        low_rank, high_rank = np.floor(ranks), np.ceil(ranks)
+
+        def find(histogram, rank):
+            return np.minimum(np.searchsorted(histogram, rank, side='right'), _HISTOGRAM_BINS - 1)
+
+        centres = (edges[:-1] + edges[1:]) / 2
+        low_centre = centres[find(estimate_histogram, low_rank)]
+        high_centre = centres[find(estimate_histogram, high_rank)]
+        result = PifEstimate(low_centre + (ranks - low_rank) * (high_centre - low_centre),
+                             edges[find(lower_histogram, low_rank)], edges[find(upper_histogram, high_rank) + 1])
+        if np.ndim(percentile) == 0:
+            return PifEstimate(*(float(value) for value in result))
+        return result
+
+    def _weights(self, chunk):
+        if self.counts is None:
+            return np.ones(len(chunk))
+        return np.asarray(chunk[self.counts], dtype=float)
+
+    def _hash(self, chunk, grow):
+        # the codes, the weights and the key of the leave-one-out bucket of every feature of every row
+        weights = self._weights(chunk)
+        if self.counts is not None:
+            chunk = chunk.drop(columns=self.counts)
+        if self.encoder is None:
+            self.encoder = DictionaryEncoder(chunk.columns)
+        codes = self.encoder.encode(chunk, grow=grow)
+        return codes, weights, leave_one_out_keys(codes, self.seed)
+
+    def _pair_keys(self, keys, codes):
+        return keys ^ mix64(codes.astype(np.uint64) + np.uint64(0x9e3779b97f4a7c15))
+
+    def _cells(self, keys, sketch):
+        # the cell of every key in every row of a sketch, as indices into the flattened sketch
+        salts = mix64(np.arange(self.depth, dtype=np.uint64) + np.uint64((self.seed * 2 + sketch + 1) << 32))
+        cells = (mix64(keys[None, :] ^ salts[:, None]) % np.uint64(self.width)).astype(np.intp)
+        return cells + (np.arange(self.depth) * self.width)[:, None]
+
+    def _estimate(self, sketch, cells):
+        return sketch[cells].min(axis=0)
+
+    def _unbiased_estimate(self, sketch, cells):
+        # count-mean-min: subtract the expected count of the other keys of every cell, take the median
+        counts = sketch[cells]
+        return np.median(counts - (self.total - counts) / max(self.width - 1, 1), axis=0)
+
+
+def _kl_low(share, q, mass, accuracy):
+    # the KL divergence of a bucket in which the value of the row has the given share and the other values follow the
+    # prior, the smallest one for that share
+    p = accuracy * share + (1 - accuracy) * q
+    rest = accuracy * (1 - share) + (1 - accuracy) * (mass - q)
+    return _plogq(p, q) + _plogq(rest, np.maximum(mass - q, np.finfo(float).tiny))
+
+
+def _kl_high(share, q, q_other, mass, accuracy):
+    # the KL divergence of a bucket in which the rest of the bucket has the value with the smallest prior, the largest
+    # one for that share
+    p = accuracy * share + (1 - accuracy) * q
+    p_other = accuracy * (1 - share) + (1 - accuracy) * q_other
+    kl = _plogq(p, q) + _plogq(p_other, q_other)
+    if accuracy < 1:
+        kl = kl + (1 - accuracy) * np.maximum(mass - q - q_other, 0) * math.log2(1 - accuracy)
+    return kl
+
+
+def _aggregate(keys, values, weights):
+    # sum the weights of identical (key, value) pairs, sorted by key and value
+    order = np.lexsort((values, keys))
+    keys, values, weights = keys[order], values[order], weights[order]
+    starts = np.flatnonzero(np.r_[True, (keys[1:] != keys[:-1]) | (values[1:] != values[:-1])])
+    return keys[starts], values[starts], np.add.reduceat(weights, starts)
+
+
+@traced
+def sketch_cigs(chunks, feature_priors={}, feature_accuracies={}, memory=2 ** 26, depth=4, heavy_threshold=None,
+                counts=None, seed=0):
+    """Build a CigSketch of a dataset that is read in chunks, to estimate its CIGs and PIF in bounded memory.
+
+    The chunks are read twice here, and once more by `CigSketch.cigs` and `CigSketch.pif`.
+
+    :param chunks: a path to a CSV or Parquet file, a function returning a fresh iterator of DataFrame chunks, or a
+        re-iterable collection of DataFrames
+    :param feature_priors: optional dictionary mapping the feature index to an assumed prior
+    :param feature_accuracies: optional dictionary mapping the feature index to the accuracy of the feature
+    :param memory: the number of bytes of the sketches. The exact counts of the heavy buckets and the priors come on
+        top.
+    :param depth: the number of hash functions of every sketch. Counts are within the `error` of the sketch with a
+        probability of 1 - exp(-depth).
+    :param heavy_threshold: the estimated size from which on a bucket is counted exactly, see `CigSketch.prepare`
+    :param counts: optional name of a column with the multiplicity of every row, for chunks of a frequency table
+    :param seed: the seed of the hash functions
+    :return: a CigSketch
+    """
+    sketch = CigSketch(memory, depth, counts, seed)
+    with stage('sketching', memory=memory, depth=depth) as sketching:
+        for chunk in iterate_chunks(chunks):
+            sketch.update(chunk)
+        sketch.prepare(feature_priors, feature_accuracies, heavy_threshold)
+        sketching.annotate(width=sketch.width, error=sketch.error)
+    with stage('heavy_buckets', threshold=sketch.heavy_threshold) as counting:
+        for chunk in iterate_chunks(chunks):
+            sketch.collect_heavy(chunk)
+        sketch.finish()
+        counting.annotate(buckets=sketch.num_heavy)
+    return sketch
@@ -0,0 +1,260 @@
+"""Compute CIGs and CSFs for datasets that do not fit into memory.
+
+The data is read twice, as an iterator of DataFrame chunks. The first pass counts the distinct rows of the dataset,
+which is all the calculators need: every leave-one-out bucket and every prior is a re-aggregation of these counts. The
+second pass looks up the distinct row of every record and emits the CIG or CSF values chunk by chunk. Peak memory is
+therefore bounded by the number of distinct rows, not by the number of records.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from piflib.encoding import DictionaryEncoder, EncodedDataset, deduplicate
+from piflib.pif_calculator import compute_cigs, compute_csfs
+
+
+class DistinctRows:
+    """Counts of the distinct rows of a dataset that is read in chunks.
+
+    Values are mapped to integer codes with dictionaries that grow as new values are seen. Counts from different
+    chunks, and from other `DistinctRows` objects, are merged lazily: new rows are buffered, and the buffer is collapsed
+    into the distinct table whenever it outgrows it.
+
+    :param counts: optional name of a column with the multiplicity of every row, for chunks of a frequency table
+    """
+
+    def __init__(self, counts=None):
+        self.counts = counts
+        self.encoder = None
+        self._table = None
+        self._pending_codes = []
+        self._pending_weights = []
+        self._num_pending = 0
+        self._index = None
+
+    @property
+    def columns(self):
+        return None if self.encoder is None else self.encoder.columns
+
+    def update(self, chunk):
+        """Add the rows of a DataFrame chunk."""
+        weights = None
+        if self.counts is not None:
+            weights = np.asarray(chunk[self.counts], dtype=float)
+            chunk = chunk.drop(columns=self.counts)
+        if self.encoder is None:
+            self.encoder = DictionaryEncoder(chunk.columns)
+        codes = self.encoder.encode(chunk)
+        self._add(deduplicate(codes, self.encoder.dictionaries, self.columns, weights))
+        return self
+
+    def merge(self, other):
+        """Add the counts of another `DistinctRows` object."""
+        table = other.table()
+        if table is None:
+            return self
+        if self.encoder is None:
+            self.encoder = DictionaryEncoder(other.columns)
+        elif list(other.columns) != list(self.columns):
+            raise ValueError('cannot merge counts of datasets with different columns')
+        recode = [self.encoder.encode_values(dictionary, i) for i, dictionary in enumerate(other.encoder.dictionaries)]
+        codes = np.column_stack([recode[i][table.codes[:, i]] for i in range(len(recode))])
+        self._add(EncodedDataset(codes, self.encoder.dictionaries, self.columns, table.weights))
+        return self
+
+    def table(self):
+        """Return the distinct rows and their multiplicities as an EncodedDataset, or None if no rows were added."""
+        if self._num_pending:
+            self._compact()
+        return self._table
+
+    def lookup(self, chunk):
+        """Find the distinct row of every row of a DataFrame chunk.
+
+        :param chunk: DataFrame with the same columns as the counted chunks
+        :return: array with the index of the distinct row in `table()` of every row of the chunk
+        """
+        if self.counts is not None and self.counts in chunk.columns:
+            chunk = chunk.drop(columns=self.counts)
+        table = self.table()
+        codes = self.encoder.encode(chunk, grow=False)
+        if self._index is None:
+            # kept until the table changes, so that looking up many chunks builds it once
+            self._index = pd.MultiIndex.from_arrays(list(table.codes.T))
+        rows = self._index.get_indexer(pd.MultiIndex.from_arrays(list(codes.T)))
+        if (rows < 0).any():
+            raise ValueError('chunk contains rows that were not counted')
+        return rows
+
+    def _add(self, table):
+        self._pending_codes.append(table.codes)
+        self._pending_weights.append(table.weights)
+        self._num_pending += table.num_distinct
+        if self._table is None or self._num_pending >= self._table.num_distinct:
+            self._compact()
+
+    def _compact(self):
+        if self._table is not None:
+            self._pending_codes.insert(0, self._table.codes)
+            self._pending_weights.insert(0, self._table.weights)
+        table = deduplicate(np.concatenate(self._pending_codes), self.encoder.dictionaries, self.columns,
+                            np.concatenate(self._pending_weights))
+        # later chunks grow the dictionaries, the table gets a snapshot
+        dictionaries = [list(dictionary) for dictionary in self.encoder.dictionaries]
+        self._table = EncodedDataset(table.codes, dictionaries, self.columns, table.weights)
+        self._pending_codes, self._pending_weights, self._num_pending = [], [], 0
+        self._index = None
+
+    def __getstate__(self):
+        # the lookup index is rebuilt on demand instead of being sent to other processes, and the codes are sent with
+        # the smallest sufficient integer type
+        table = self.table()
+        state = self.__dict__.copy()
+        state['_index'] = None
+        if table is not None:
+            dtype = np.min_scalar_type(max(max(table.cardinalities) - 1, 0))
+            state['_table'] = EncodedDataset(table.codes.astype(dtype), table.dictionaries, table.columns,
+                                             table.weights)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._table is not None:
+            self._table.codes = self._table.codes.astype(np.intp)
+
+
+def compute_cigs_chunked(chunks, feature_priors={}, feature_accuracies={}, samples=None, counts=None,
+                         unknown_features=1):
+    """Compute the cell information gain (CIG) of a dataset that is read in chunks.
+
+    The chunks are read twice, see the module documentation. The results are the same as those of
+    `piflib.pif_calculator.compute_cigs` on the concatenated chunks.
+
+    :param chunks: a path to a CSV or Parquet file, a function returning a fresh iterator of DataFrame chunks, or a
+        re-iterable collection of DataFrames
+    :param feature_priors: optional dictionary mapping the feature index to an assumed prior
+    :param feature_accuracies: optional dictionary mapping the feature index to the accuracy of the feature
+    :param samples: see `piflib.pif_calculator.compute_cigs`
+    :param counts: optional name of a column with the multiplicity of every row, for chunks of a frequency table
+    :param unknown_features: see `piflib.pif_calculator.compute_cigs`
+    :return: generator of DataFrames with the CIG values of every chunk, with the index of the chunk
+    """
+    return _stream(compute_cigs, chunks, counts, feature_priors=feature_priors, feature_accuracies=feature_accuracies,
+                   samples=samples, unknown_features=unknown_features)
+
+
+def compute_csfs_chunked(chunks, feature_priors={}, feature_accuracies={}, counts=None):
+    """Compute the cell surprise factor (CSF) of a dataset that is read in chunks.
+
+    :param chunks: a path to a CSV or Parquet file, a function returning a fresh iterator of DataFrame chunks, or a
+        re-iterable collection of DataFrames
+    :param feature_priors: optional dictionary mapping the feature index to an assumed prior
+    :param feature_accuracies: optional dictionary mapping the feature index to the accuracy of the feature
+    :param counts: optional name of a column with the multiplicity of every row, for chunks of a frequency table
+    :return: generator of DataFrames with the CSF values of every chunk, with the index of the chunk
+    """
+    return _stream(compute_csfs, chunks, counts, feature_priors=feature_priors, feature_accuracies=feature_accuracies)
+
+
+def count_distinct_rows(chunks, counts=None):
+    """Count the distinct rows of a dataset that is read in chunks.
+
+    :param chunks: see `compute_cigs_chunked`
+    :param counts: optional name of a column with the multiplicity of every row
+    :return: a DistinctRows object
+    """
+    distinct = DistinctRows(counts)
+    for chunk in iterate_chunks(chunks):
+        distinct.update(chunk)
+    return distinct
+
+
+def _stream(compute, chunks, counts, **kwargs):
+    distinct = count_distinct_rows(chunks, counts)
+    values = compute(distinct.table(), **kwargs).values
+    for chunk in iterate_chunks(chunks):
+        yield pd.DataFrame(values[distinct.lookup(chunk)], columns=distinct.columns, index=chunk.index)
+
+
+def iterate_chunks(chunks, chunksize=100000):
+    """Return a fresh iterator over the DataFrame chunks of a dataset.
+
+    :param chunks: a path to a CSV or Parquet file, a function returning an iterator of DataFrames, or a re-iterable
+        collection of DataFrames
+    :param chunksize: the number of rows per chunk when reading from a file
+    """
+    if isinstance(chunks, (str, os.PathLike)):
+        return read_chunks(chunks, chunksize)
+    if callable(chunks):
+        return iter(chunks())
+    if iter(chunks) is chunks:
+        raise ValueError('chunks are read twice, pass a file name, a function or a collection instead of an iterator')
+    return iter(chunks)
+
+
+def read_chunks(path, chunksize=100000):
+    """Read a CSV or Parquet file in chunks.
+
+    Parquet files are read batch by batch with pyarrow, which has to be installed.
+
+    :param path: the file to read. Files ending in '.parquet' or '.pq' are read as Parquet, all others as CSV.
+    :param chunksize: the maximum number of rows per chunk
+    :return: iterator of DataFrames
+    """
+    if str(path).endswith(('.parquet', '.pq')):
+        import pyarrow.parquet as pq
+        return (batch.to_pandas() for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize))
+    return iter(pd.read_csv(path, chunksize=chunksize))
+
+
+def write_chunks(frames, path):
+    """Write DataFrame chunks to a CSV or Parquet file, one chunk at a time.
+
+    :param frames: iterable of DataFrames with the same columns
+    :param path: the output file, see `ChunkWriter`
+    :return: the number of rows written
+    """
+    with ChunkWriter(path) as writer:
+        for frame in frames:
+            writer.write(frame)
+    return writer.num_rows
+
+
+class ChunkWriter:
+    """Write DataFrame chunks with the same columns to a CSV or Parquet file.
+
+    Use it as a context manager, or call `close` after the last chunk.
+
+    :param path: the output file. Files ending in '.parquet' or '.pq' are written as Parquet (requires pyarrow), all
+        others as CSV.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.num_rows = 0
+        self._parquet = str(path).endswith(('.parquet', '.pq'))
+        self._writer = None
+
+    def write(self, frame):
+        if self._parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table)
+        else:
+            frame.to_csv(self.path, mode='a' if self.num_rows else 'w', header=not self.num_rows, index=False)
+        self.num_rows += len(frame)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,100 @@
+"""Search for columns to suppress to bring the PIF of a dataset below a target.
+
+Suppressing a column changes the buckets of every other feature, so the naive search recomputes the CIGs of the whole
+dataset for every candidate column at every step. Here all candidates are evaluated on a `ProjectionLattice`: the CIGs
+of a dataset with the features F are computed from the projections onto F and onto F minus one feature, which are
+derived from the cached projections of the previous step. The work per candidate is proportional to the number of
+distinct rows of these projections, not to the size of the dataset.
+"""
+import pandas as pd
+
+from piflib.buckets import prepare_priors
+from piflib.data_util import complete_feature_priors
+from piflib.encoding import encode
+from piflib.instrumentation import stage, traced
+from piflib.lattice import ProjectionLattice
+from piflib.pif_calculator import weighted_percentile
+
+
+@traced
+def suggest_suppressions(dataframe, target_pif, percentile=95, candidates=None, feature_priors={},
+                         feature_accuracies={}, beam_width=1, max_suppressions=None, max_cells=None):
+    """Find a small set of columns whose suppression brings the PIF down to `target_pif`.
+
+    Starting from the full dataset, every step suppresses one more column, the one that gives the lowest PIF. With a
+    `beam_width` > 1, the best `beam_width` sets of columns of every step are kept and extended in the next step. The
+    search stops as soon as a set of columns reaches the target.
+
+    The PIF of a dataset with suppressed columns is the same as that of `compute_pif(compute_cigs(df.drop(columns=...)),
+    percentile)`, with the priors of the full dataset.
+
+    :param dataframe: a Pandas DataFrame object containing tabular data, or an encoded dataset
+    :param target_pif: the PIF to reach
+    :param percentile: which percentile of the RIG values is the PIF, see `compute_pif`
+    :param candidates: optional names of the columns that may be suppressed, e.g. the quasi-identifiers. Defaults to
+        all columns.
+    :param feature_priors: dictionary with prior distributions for features, see `compute_cigs`
+    :param feature_accuracies: dictionary with accuracies of features, see `compute_cigs`
+    :param beam_width: the number of sets of columns to keep in every step
+    :param max_suppressions: optional maximum number of columns to suppress
+    :param max_cells: the maximum size of the cached projections, see `piflib.lattice.ProjectionLattice`. A step of the
+        search reuses about k^2 / 2 projections of the previous step, for k remaining columns, so a larger cache saves
+        time on wide datasets.
+    :return: DataFrame with the column suppressed in every step and the PIF after that step, for the best set of
+        columns found. The first row, without a column, holds the PIF of the dataset as it is. If the target cannot be
+        reached, the search ends with the last step that lowered the PIF.
+    """
+    dataset = encode(dataframe)
+    num_features = dataset.num_features
+    candidates = range(num_features) if candidates is None else dataset.column_indices(candidates)
+    feature_priors = complete_feature_priors(dataset, feature_priors)
+    accuracies = {i: feature_accuracies.get(i, 1) for i in range(num_features)}
+    priors = prepare_priors(dataset, feature_priors)
+    lattice = ProjectionLattice(dataset, max_cells)
+    max_suppressions = len(candidates) if max_suppressions is None else max_suppressions
+
+    pifs = {}
+
+    def evaluate(suppressed):
+        if suppressed not in pifs:
+            kept = [i for i in range(num_features) if i not in suppressed]
+            projection, rigs = lattice.projected_rigs(kept, priors, accuracies)
+            pifs[suppressed] = weighted_percentile(rigs, projection.weights, percentile)
+        return pifs[suppressed]
+
+    # the set of suppressed columns each set was reached from, and the column added
+    parents = {frozenset(): (None, None)}
+    best = frozenset()
+    beam = [best]
+    with stage('suppression_search', candidates=len(candidates), beam_width=beam_width) as searching:
+        evaluate(best)
+        for _ in range(max_suppressions):
+            if pifs[best] <= target_pif:
+                break
+            extended = []
+            for suppressed in beam:
+                for i in candidates:
+                    if i in suppressed:
+                        continue
+                    successor = suppressed | {i}
+                    if successor not in parents:
+                        parents[successor] = (suppressed, i)
+                        extended.append(successor)
+            if not extended:
+                break
+            # ties are broken by the column indices, for a deterministic search
+            extended.sort(key=lambda suppressed: (evaluate(suppressed), sorted(suppressed)))
+            beam = extended[:beam_width]
+            if pifs[beam[0]] >= pifs[best] and pifs[beam[0]] > target_pif:
+                # no suppression helps any more
+                break
+            best = beam[0]
+        searching.annotate(evaluated=len(pifs), suppressed=len(best))
+
+    path = []
+    while best:
+        parent, i = parents[best]
+        path.append((dataset.columns[i], pifs[best]))
+        best = parent
+    path.append((None, pifs[frozenset()]))
+    return pd.DataFrame(path[::-1], columns=['column', 'pif'])
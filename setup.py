@@ -19,7 +19,14 @@ setuptools.setup(
     url='https://github.com/PIFtools/piflib',
     license='Apache',
     install_requires=requirements,
+    extras_require={
+        "parquet": ["pyarrow"],
+        "sparse": ["scipy"],
+    },
     packages=setuptools.find_packages(),
+    entry_points={
+        'console_scripts': ['piflib=piflib.cli:main'],
+    },
     project_urls={
         'Documentation': 'http://piflib.readthedocs.io/',
         'Source': 'https://github.com/PIFtools/piflib',
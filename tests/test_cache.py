@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import piflib.pif_calculator as pif
+from piflib.cache import CachedDataset, DatasetCache, content_hash
+from piflib.instrumentation import Trace
+
+rng = np.random.default_rng(0)
+df = pd.DataFrame(rng.integers(0, [3, 4, 5, 6], (500, 4)), columns=list('ABCD'))
+
+
+def _hits(trace):
+    return [event['attributes']['hit'] for event in trace.events if event['name'] == 'cache_lookup']
+
+
+def test_cache(tmp_path):
+    cache = DatasetCache(str(tmp_path))
+    accuracies = {1: 0.7}
+    with Trace() as cold:
+        dataset = cache.encode(df)
+        cigs = pif.compute_cigs(dataset, feature_accuracies=accuracies)
+    assert isinstance(dataset, CachedDataset)
+    assert _hits(cold) == [False] * 5
+    with Trace() as warm:
+        dataset = cache.encode(df.copy())
+        warm_cigs = pif.compute_cigs(dataset, feature_accuracies=accuracies)
+        csfs = pif.compute_csfs(dataset)
+        metrics = pif.compute_metrics(dataset)
+    assert _hits(warm) == [True] * 13
+    assert isinstance(dataset.codes, np.memmap)
+    assert cigs.equals(pif.compute_cigs(df, feature_accuracies=accuracies))
+    assert warm_cigs.equals(cigs)
+    assert csfs.equals(pif.compute_csfs(df))
+    assert metrics['wcig'].equals(pif.compute_weighted_cigs(df))
+    cache.clear()
+    assert cache.size() == 0
+
+
+def test_content_hash():
+    assert content_hash(df) == content_hash(df.copy())
+    changed = df.copy()
+    changed.iloc[3, 2] += 1
+    assert content_hash(changed) != content_hash(df)
+    assert content_hash(df.rename(columns={'A': 'Z'})) != content_hash(df)
+    assert content_hash(df, counts='D') != content_hash(df)
+    values = df.values
+    assert content_hash(values) == content_hash(values.copy())
+    assert content_hash(values[:-1]) != content_hash(values)
+    # mixed object columns are not told apart by their string form alone
+    assert content_hash(pd.DataFrame({'A': [1, '1']})) != content_hash(pd.DataFrame({'A': ['1', 1]}))
+    assert content_hash(pd.DataFrame({'A': [1, '2']})) != content_hash(pd.DataFrame({'A': ['1', '2']}))
+    mixed = pd.DataFrame({'A': [1, 'x', None, 1]})
+    assert content_hash(mixed) == content_hash(mixed.copy())
+
+
+def test_cache_eviction(tmp_path):
+    cache = DatasetCache(str(tmp_path))
+    pif.compute_cigs(cache.encode(df))
+    size = cache.size()
+    cache.max_bytes = 2 * size
+    frames = [df + i for i in range(1, 4)]
+    keys = []
+    for frame in frames:
+        keys.append(cache.encode(frame).key)
+        pif.compute_cigs(cache.encode(frame))
+        assert cache.size() <= 2 * size
+    # only the two most recently used datasets remain
+    assert {key for key, _, _ in cache._entries()} == set(keys[1:])
@@ -0,0 +1,60 @@
+import json
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+import piflib.pif_calculator as pif
+from piflib.cli import expand_inputs, main
+
+rng = np.random.default_rng(3)
+frames = [pd.DataFrame({'A': rng.integers(0, 4, 300), 'B': rng.choice(['x', 'y', 'z'], 300),
+                        'C': rng.integers(0, 3, 300)}) for _ in range(3)]
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    for k, frame in enumerate(frames):
+        frame.to_csv(tmp_path / 'data{}.csv'.format(k), index=False)
+    return tmp_path
+
+
+def test_expand_inputs(inputs):
+    assert expand_inputs([str(inputs / 'data*.csv'), str(inputs / 'data0.csv')]) == [
+        str(inputs / 'data{}.csv'.format(k)) for k in range(3)]
+    with pytest.raises(FileNotFoundError):
+        expand_inputs([str(inputs / '*.parquet')])
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_main(inputs, capsys, workers):
+    output_dir = inputs / 'out'
+    assert main([str(inputs / '*.csv'), '--metric', 'cig', '--metric', 'csf', '--output-dir', str(output_dir),
+                 '--accuracy', 'B=0.8', '--percentile', '95', '--chunksize', '64', '--workers', str(workers)]) == 0
+    printed = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert sorted(summary['input'] for summary in printed) == [str(inputs / 'data{}.csv'.format(k)) for k in range(3)]
+    for k, frame in enumerate(frames):
+        with open(output_dir / 'data{}.summary.json'.format(k)) as f:
+            summary = json.load(f)
+        cigs = pif.compute_cigs(frame, feature_accuracies={1: 0.8})
+        assert summary['rows'] == len(frame)
+        assert summary['pif']['95'] == pytest.approx(pif.compute_pif(cigs, 95))
+        assert len(summary['buckets']) == 3
+        assert np.allclose(pd.read_csv(output_dir / 'data{}.cig.csv'.format(k)).values, cigs.values)
+        assert np.allclose(pd.read_csv(output_dir / 'data{}.csf.csv'.format(k)).values,
+                           pif.compute_csfs(frame, feature_accuracies={1: 0.8}).values)
+
+
+def test_main_reports_failures(inputs, capsys):
+    (inputs / 'empty.csv').write_text('A,B\n')
+    assert main([str(inputs / 'empty.csv'), str(inputs / 'data0.csv')]) == 1
+    captured = capsys.readouterr()
+    assert 'empty.csv' in captured.err
+    assert len(captured.out.splitlines()) == 1
+
+
+def test_startup_imports():
+    # the command only imports the calculators when it processes a file
+    code = 'import sys, piflib.cli; print(sorted({"pandas", "numpy"} & set(sys.modules)))'
+    assert subprocess.check_output([sys.executable, '-c', code]).decode().strip() == '[]'
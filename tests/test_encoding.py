@@ -0,0 +1,125 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from piflib.encoding import encode, group_ids
+
+data = {'A': [1, 1, 2, 2],
+        'B': ['a', 'b', 'b', None],
+        'C': ['blue', 'green', 'red', 'cyan']}
+df_mix = pd.DataFrame(data)
+
+
+def test_encode():
+    dataset = encode(df_mix)
+    assert dataset.num_rows == 4
+    assert dataset.num_features == 3
+    assert dataset.cardinalities == [2, 3, 4]
+    assert list(dataset.columns) == ['A', 'B', 'C']
+    for i, column in enumerate(df_mix.columns):
+        decoded = [dataset.dictionaries[i][code] for code in dataset.codes[:, i]]
+        assert decoded[:3] == list(df_mix[column])[:3]
+    assert np.isnan(dataset.dictionaries[1][dataset.codes[3, 1]])
+    assert encode(dataset) is dataset
+
+
+def test_group_ids():
+    codes = np.array([[0, 1], [1, 0], [0, 1], [1, 1]])
+    ids, num_groups = group_ids(codes, [2, 2])
+    assert num_groups == 3
+    assert list(ids) == [0, 1, 0, 2]
+    ids, num_groups = group_ids(codes[:, :0], [])
+    assert num_groups == 1
+    assert list(ids) == [0, 0, 0, 0]
+
+
+def test_group_ids_wide():
+    # the mixed-radix key of 40 columns with cardinality 10**6 does not fit into 64 bits
+    rng = np.random.default_rng(0)
+    codes = rng.integers(0, 2, size=(100, 40))
+    codes[50:] = codes[:50]
+    ids, num_groups = group_ids(codes, [10 ** 6] * 40)
+    assert num_groups == len(np.unique(codes, axis=0))
+    for i in range(50):
+        assert ids[i] == ids[i + 50]
+
+
+def test_encode_deduplicates():
+    df = pd.DataFrame({'A': [2, 1, 2, 2], 'B': ['x', 'y', 'x', 'y']})
+    dataset = encode(df)
+    assert dataset.num_rows == 4
+    assert dataset.num_distinct == 3
+    assert list(dataset.weights) == [2, 1, 1]
+    assert list(dataset.inverse) == [0, 1, 0, 2]
+    assert list(dataset.expand(np.array([10, 20, 30]))) == [10, 20, 10, 30]
+
+
+def test_encode_frequency_table():
+    table = pd.DataFrame({'A': [2, 1, 2], 'B': ['x', 'y', 'y'], 'n': [5, 1, 3]})
+    dataset = encode(table, counts='n')
+    assert list(dataset.columns) == ['A', 'B']
+    assert dataset.num_rows == 3
+    assert list(dataset.weights) == [5, 1, 3]
+    assert dataset.total == 9
+
+
+def _assert_same_encoding(dataset, expected):
+    assert list(dataset.columns) == list(expected.columns)
+    assert (dataset.codes == expected.codes).all()
+    assert (dataset.inverse == expected.inverse).all()
+    assert (dataset.weights == expected.weights).all()
+    for dictionary, expected_dictionary in zip(dataset.dictionaries, expected.dictionaries):
+        assert [str(value) for value in dictionary] == [str(value) for value in expected_dictionary]
+
+
+def test_encode_arrays():
+    rng = np.random.default_rng(0)
+    values = rng.integers(0, [3, 5, 7], size=(200, 3)).astype(float)
+    values[::17, 1] = np.nan
+    expected = encode(pd.DataFrame(values))
+    _assert_same_encoding(encode(values), expected)
+    structured = np.rec.fromarrays(values.T, names=['A', 'B', 'C'])
+    _assert_same_encoding(encode(np.asarray(structured)), encode(pd.DataFrame(values, columns=['A', 'B', 'C'])))
+
+
+def test_encode_categoricals():
+    df = df_mix.astype({'B': 'category', 'C': pd.CategoricalDtype(['red', 'x', 'green', 'blue', 'cyan'])})
+    dataset = encode(df)
+    _assert_same_encoding(dataset, encode(df_mix))
+    # unused categories are dropped
+    assert dataset.cardinalities == [2, 3, 4]
+
+
+def test_encode_arrow():
+    pa = pytest.importorskip('pyarrow')
+    expected = encode(df_mix)
+    table = pa.Table.from_pandas(df_mix)
+    _assert_same_encoding(encode(table), expected)
+    _assert_same_encoding(encode(table.to_batches()[0]), expected)
+    # dictionary encoded columns, with a different dictionary per chunk
+    chunks = {name: pa.chunked_array([table.column(name).slice(0, 2).dictionary_encode(),
+                                      table.column(name).slice(2).dictionary_encode()])
+              for name in table.column_names}
+    dictionary_table = pa.table(chunks)
+    assert pa.types.is_dictionary(dictionary_table.schema.field('C').type)
+    _assert_same_encoding(encode(dictionary_table), expected)
+    counts = table.append_column('n', pa.array([5, 1, 3, 2]))
+    dataset = encode(counts, counts='n')
+    assert list(dataset.columns) == ['A', 'B', 'C']
+    assert list(dataset.weights) == [5, 1, 3, 2]
+
+
+def test_lazy_import():
+    code = 'import sys, piflib; assert "pandas" not in sys.modules; piflib.compute_cigs; assert "pandas" in sys.modules'
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, '-c', code], check=True, cwd=root)
+
+
+def test_lazy_submodule_import():
+    code = ('import pandas as pd, piflib; cigs = pd.DataFrame({"a": [0.5, 1.0]}); '
+            'assert piflib.pif_calculator.compute_pif(cigs, 100) == 1.0')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, '-c', code], check=True, cwd=root)
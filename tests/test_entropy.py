@@ -0,0 +1,113 @@
+import gc
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+from piflib.encoding import encode
+from piflib.entropy import (EntropyCache, entropy, entropy_cache, conditional_entropy, create_conditional_entropy_table,
+                            create_entropy_mi_table, get_marginal, mutual_information, mutual_information_matrix)
+
+data = {'A': [1, 1, 2, 2],
+        'B': ['a', 'a', 'b', 'b'],
+        'C': ['blue', 'green', 'red', 'cyan']}
+df_fully_dependent = pd.DataFrame(data)
+
+
+def test_entropy():
+    assert entropy(df_fully_dependent, ['A']) == 1
+    assert entropy(df_fully_dependent, ['A', 'B']) == 1
+    assert entropy(df_fully_dependent, ['C']) == 2
+    assert conditional_entropy(df_fully_dependent, ['A'], ['B']) == 0
+    assert conditional_entropy(df_fully_dependent, ['C'], ['A']) == 1
+
+
+def test_missing_values():
+    # None and NaN are one outcome of their own, rows with missing values are not dropped
+    df = pd.DataFrame({'A': [1, 1, None, np.nan], 'B': ['a', None, 'b', 'b'], 'C': [0, 1, 2, 3]})
+    filled = df.fillna('missing')
+    assert entropy(df, ['A']) == entropy(filled, ['A']) == 1
+    assert entropy(df, ['A', 'B']) == entropy(filled, ['A', 'B'])
+    assert mutual_information(df, ['A'], ['B']) == mutual_information(filled, ['A'], ['B'])
+    marginal = get_marginal(df, ['A'])
+    assert marginal[1] == 0.5 and sum(marginal.values()) == 1
+    assert any(value != value for value in marginal)
+
+
+def test_entropy_encodes_only_the_given_columns(monkeypatch):
+    import piflib.entropy
+    encoded = []
+
+    def encode_frame(df):
+        if isinstance(df, pd.DataFrame):
+            encoded.append(list(df.columns))
+        return encode(df)
+
+    monkeypatch.setattr(piflib.entropy, 'encode', encode_frame)
+    # the entropy of a DataFrame only factorizes the given columns, without encoding the frame
+    assert entropy(df_fully_dependent, ['B', 'A']) == entropy(encode(df_fully_dependent), ['B', 'A']) == 1
+    assert entropy(df_fully_dependent, ['C', 'C']) == 2
+    # more possible outcomes than rows
+    wide = pd.DataFrame(np.random.default_rng(0).integers(0, 1000, (500, 3)))
+    assert np.isclose(entropy(wide, [0, 1]), entropy(encode(wide), [0, 1]))
+    mutual_information(df_fully_dependent, ['A'], ['A', 'B'])
+    conditional_entropy(df_fully_dependent, ['C'], ['B'])
+    assert encoded == [['A', 'B'], ['C', 'B']]
+
+
+def test_entropy_cache():
+    dataset = encode(df_fully_dependent)
+    entropy_cache.clear()
+    conditional_entropy(dataset, ['A'], ['B'])
+    # H(A) is needed twice, H(B) and H(A, B) once
+    assert entropy_cache.info().misses == 3
+    assert entropy_cache.info().hits == 1
+    create_conditional_entropy_table(dataset)
+    info = entropy_cache.info()
+    # H(C), H(A, C), H(B, C) and H(A, B, C) are new, everything else is cached
+    assert info.misses == 3 + 4
+    assert info.currsize == 7
+    del dataset
+    gc.collect()
+    assert entropy_cache.info().currsize == 0
+
+
+def test_entropy_cache_eviction():
+    cache = EntropyCache(maxsize=2)
+    dataset = encode(df_fully_dependent)
+    assert cache.entropy(dataset, ['A'], lambda: 1) == 1
+    assert cache.entropy(dataset, ['B'], lambda: 2) == 2
+    assert cache.entropy(dataset, ['A'], lambda: pytest.fail('should be cached')) == 1
+    assert cache.entropy(dataset, ['C'], lambda: 3) == 3
+    # B was least recently used
+    assert cache.entropy(dataset, ['B'], lambda: 4) == 4
+    assert cache.info() == (1, 4, 2, 2)
+    cache.resize(1)
+    assert cache.info().currsize == 1
+
+
+def test_mutual_information_matrix():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'A': rng.integers(0, 5, 200), 'B': rng.integers(0, 3, 200)})
+    df['C'] = df['A'] * 3 + df['B']
+    mi_df = mutual_information_matrix(df)
+    assert list(mi_df.columns) == list(mi_df.index) == ['A', 'B', 'C']
+    assert np.allclose(mi_df.values, mi_df.values.T)
+    for x in df.columns:
+        assert np.isclose(mi_df.loc[x, x], entropy(df, [x]))
+        for y in df.columns:
+            if x != y:
+                assert np.isclose(mi_df.loc[x, y], mutual_information(df, [x], [y]))
+    # C determines A
+    assert np.isclose(mi_df.loc['A', 'C'], mi_df.loc['A', 'A'])
+    with ThreadPoolExecutor(2) as executor:
+        assert (mutual_information_matrix(df, executor=executor, block_size=1) == mi_df).all().all()
+
+
+def test_create_entropy_mi_table():
+    emi_df = create_entropy_mi_table(df_fully_dependent)
+    assert list(emi_df['X']) == ['A', 'A', 'B']
+    assert list(emi_df['Y']) == ['B', 'C', 'C']
+    assert list(emi_df['H(X)']) == [1, 1, 1]
+    assert list(emi_df['H(Y)']) == [1, 2, 2]
+    assert list(emi_df['I(X;Y)']) == [1, 1, 1]
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import piflib.pif_calculator as pif
+from piflib.encoding import encode
+from piflib.factored import FactoredCigs
+
+rng = np.random.default_rng(0)
+df = pd.DataFrame(rng.integers(0, [3, 4, 5, 2], (1000, 4)), columns=list('ABCD'))
+percentiles = [0, 50, 90, 95, 99, 100]
+
+
+def test_factored_cigs():
+    for kwargs in ({}, {'feature_accuracies': {1: 0.6}}, {'unknown_features': 2}):
+        cigs = pif.compute_cigs(df, **kwargs)
+        factored = pif.compute_cigs(df, factored=True, **kwargs)
+        assert isinstance(factored, FactoredCigs)
+        assert factored.num_rows == len(df)
+        assert factored.to_frame().equals(cigs)
+        assert (factored.rigs() == cigs.sum(axis=1).values).all()
+        assert (factored.pif(percentiles) == pif.compute_pif(cigs, percentiles)).all()
+        assert pif.compute_pif(factored, 95) == pif.compute_pif(cigs, 95)
+        assert factored.nbytes < cigs.values.nbytes / 4
+        assert all(buckets.dtype == np.uint8 for buckets in factored.buckets)
+
+
+def test_factored_cigs_float32():
+    cigs = pif.compute_cigs(df, dtype=np.float32)
+    assert cigs.dtypes.eq(np.float32).all()
+    factored = pif.compute_cigs(df, factored=True, dtype=np.float32)
+    assert factored.values[0].dtype == np.float32
+    assert factored.to_frame().equals(cigs)
+    assert np.isclose(factored.pif(90), pif.compute_pif(pif.compute_cigs(df), 90))
+
+
+def test_factored_cigs_frequency_table():
+    table = df.groupby(list(df.columns)).size().reset_index(name='count')
+    dataset = encode(table, counts='count')
+    factored = pif.compute_cigs(dataset, factored=True)
+    assert factored.num_rows == len(table)
+    cigs = pif.compute_cigs(dataset)
+    assert factored.to_frame().equals(cigs)
+    expected = pif.compute_pif(cigs, percentiles, counts=table['count'])
+    assert (factored.pif(percentiles, counts=table['count']) == expected).all()
+    # the same as for the rows of the frequency table, up to the order of summation
+    assert np.allclose(expected, pif.compute_pif(pif.compute_cigs(df), percentiles), rtol=0, atol=1e-12)
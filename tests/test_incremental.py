@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+import piflib.incremental
+import piflib.pif_calculator as pif
+from piflib.incremental import PifIndex
+
+rng = np.random.default_rng(0)
+
+
+def make_data(num_rows):
+    return pd.DataFrame({'A': rng.integers(0, 4, num_rows),
+                         'B': rng.choice(['x', 'y', 'z'], num_rows),
+                         'C': rng.integers(0, 6, num_rows)})
+
+
+df_initial = make_data(300)
+df_added = make_data(50)
+
+
+@pytest.mark.parametrize('kwargs', [{},
+                                    {'feature_accuracies': {0: 0.5}},
+                                    {'feature_priors': {2: {i: 1 / 8 for i in range(8)}},
+                                     'feature_accuracies': {2: 0.7}}])
+def test_pif_index(kwargs):
+    index = PifIndex(df_initial, **kwargs)
+    index.add_rows(df_added)
+    df = pd.concat([df_initial, df_added], ignore_index=True)
+    # appending gives exactly the same results as a full recomputation
+    assert (index.cigs(df).values == pif.compute_cigs(df, **kwargs).values).all()
+    assert (index.csfs(df).values == pif.compute_csfs(df, **kwargs).values).all()
+    index.remove_rows(df_initial.iloc[:100])
+    df = df.iloc[100:]
+    assert np.allclose(index.cigs(df).values, pif.compute_cigs(df, **kwargs).values, rtol=0, atol=1e-12)
+    assert np.allclose(index.csfs(df).values, pif.compute_csfs(df, **kwargs).values, rtol=0, atol=1e-12)
+    assert np.isclose(index.pif(90), pif.compute_pif(pif.compute_cigs(df, **kwargs), 90))
+    table, counts = index.table()
+    assert counts.sum() == len(df)
+    assert len(table) == len(df.drop_duplicates())
+
+
+def test_pif_index_invalid_removal():
+    index = PifIndex(df_initial)
+    with pytest.raises(ValueError):
+        index.remove_rows(pd.DataFrame({'A': [9], 'B': ['x'], 'C': [0]}))
+    row = df_initial.iloc[:1]
+    with pytest.raises(ValueError):
+        index.remove_rows(pd.concat([row] * (len(df_initial.merge(row)) + 1)))
+
+
+def test_pif_index_hash_collisions(monkeypatch):
+    # with 8-bit hash terms collisions are frequent, which must not change the results
+    hash_cells = piflib.incremental.hash_cells
+    monkeypatch.setattr(piflib.incremental, 'hash_cells', lambda codes, seed: hash_cells(codes, seed) & np.uint64(0xff))
+    index = PifIndex(df_initial.iloc[:40])
+    index.add_rows(df_added)
+    df = pd.concat([df_initial.iloc[:40], df_added], ignore_index=True)
+    assert (index.cigs(df).values == pif.compute_cigs(df).values).all()
+
+
+def test_pif_index_forced_collision(monkeypatch):
+    # with the first seed every row and bucket has the same key, so the index has to rehash
+    hash_cells = piflib.incremental.hash_cells
+    monkeypatch.setattr(piflib.incremental, 'hash_cells',
+                        lambda codes, seed: hash_cells(codes, seed) * np.uint64(seed != 0))
+    index = PifIndex(df_initial)
+    index.add_rows(df_added)
+    df = pd.concat([df_initial, df_added], ignore_index=True)
+    assert (index.cigs(df).values == pif.compute_cigs(df).values).all()
+    index.remove_rows(df_initial.iloc[:100])
+    df = df.iloc[100:]
+    assert np.allclose(index.cigs(df).values, pif.compute_cigs(df).values, rtol=0, atol=1e-12)
@@ -0,0 +1,57 @@
+import json
+
+import numpy as np
+import pandas as pd
+import piflib.pif_calculator as pif
+from piflib.entropy import create_conditional_entropy_table
+from piflib.instrumentation import Trace, enabled, stage
+
+rng = np.random.default_rng(0)
+df = pd.DataFrame(rng.integers(0, [3, 4, 5], (300, 3)), columns=list('ABC'))
+
+
+def test_trace_stages(tmp_path):
+    events = []
+    assert not enabled()
+    with Trace(callback=events.append) as trace:
+        assert enabled()
+        cigs = pif.compute_cigs(df, feature_accuracies={1: 0.5})
+    assert not enabled()
+    assert (cigs.values == pif.compute_cigs(df, feature_accuracies={1: 0.5}).values).all()
+    assert events == trace.events
+    names = [event['name'] for event in trace.events]
+    for name in ('compute_cigs', 'encode', 'complete_feature_priors', 'prepare_priors', 'bucketing', 'bucket_kls',
+                 'combinations', 'frame'):
+        assert name in names
+    assert names[-1] == 'compute_cigs' and trace.events[-1]['depth'] == 0
+    bucketing = [event for event in trace.events if event['name'] == 'bucketing']
+    assert [event['attributes']['features'] for event in bucketing] == [[0], [1], [2]]
+    assert [event['attributes']['domain_sizes'] for event in bucketing] == [[3], [4], [5]]
+    assert all(event['duration'] >= 0 for event in trace.events)
+    summary = trace.summary()
+    assert summary.loc['bucketing', 'calls'] == 3
+    path = tmp_path / 'trace.json'
+    trace.dump(path)
+    with open(path) as f:
+        trace_events = json.load(f)['traceEvents']
+    assert len(trace_events) == len(trace.events)
+    assert all(event['ph'] == 'X' for event in trace_events)
+
+
+def test_trace_memory():
+    with Trace(memory=True) as trace:
+        create_conditional_entropy_table(df)
+        with stage('allocate'):
+            np.ones(1 << 20)
+    peaks = {event['name']: event['memory_peak'] for event in trace.events}
+    assert peaks['allocate'] >= 8 << 20
+    assert 'entropy' in peaks
+    assert 'memory_peak' in trace.summary().columns
+
+
+def test_stage_without_trace():
+    with stage('nothing', feature=1) as nothing:
+        nothing.annotate(buckets=2)
+    with Trace() as trace:
+        pass
+    assert trace.events == []
@@ -0,0 +1,59 @@
+import concurrent.futures
+
+import numpy as np
+import pandas as pd
+import pytest
+import piflib.pif_calculator as pif
+from piflib.mapreduce import compute_metrics_partitioned, count_partition, merge_counts
+
+rng = np.random.default_rng(5)
+df = pd.DataFrame({'A': rng.integers(0, 5, 600),
+                   'B': rng.choice(['x', 'y', None], 600),
+                   'C': rng.integers(0, 4, 600)})
+partitions = [df.iloc[start:start + 150] for start in range(0, len(df), 150)]
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_compute_metrics_partitioned(n_jobs):
+    results = compute_metrics_partitioned(partitions, ['cig', 'wcig', 'csf'], feature_accuracies={1: 0.7},
+                                          n_jobs=n_jobs)
+    expected = pif.compute_metrics(df, ['cig', 'wcig', 'csf'], feature_accuracies={1: 0.7})
+    for metric, frames in results.items():
+        values = pd.concat(frames)
+        assert values.index.equals(df.index)
+        assert np.allclose(values.values, expected[metric].values)
+
+
+def test_executor_and_files(tmp_path):
+    paths = []
+    for position, partition in enumerate(partitions):
+        paths.append(str(tmp_path / 'part{}.csv'.format(position)))
+        partition.to_csv(paths[-1], index=False)
+    output = str(tmp_path / 'scores-{partition}.{metric}.csv')
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        written = compute_metrics_partitioned(paths, ['csf'], executor=executor, chunksize=40, output=output)
+    assert written == {'csf': [len(partition) for partition in partitions]}
+    csfs = pd.concat([pd.read_csv(output.format(partition=position, metric='csf')) for position in range(4)])
+    assert np.allclose(csfs.values, pif.compute_csfs(df).values)
+
+
+def test_merge_is_associative():
+    states = [count_partition(partition) for partition in partitions]
+    nested = merge_counts([merge_counts(states[:1]), merge_counts([merge_counts(states[1:3]), states[3]])])
+    flat = merge_counts(states[::-1])
+    for merged in nested, flat:
+        table = merged.table()
+        assert table.total == len(df)
+        rows = merged.lookup(df)
+        counts = pd.Series(table.weights[rows]).groupby(rows).first()
+        assert (counts.values == pd.Series(rows).value_counts().sort_index().values).all()
+    with pytest.raises(ValueError):
+        merge_counts([])
+
+
+def test_frequency_table_partitions():
+    table = df.fillna('-').groupby(list(df.columns)).size().reset_index(name='n')
+    cigs = compute_metrics_partitioned([table.iloc[:10], table.iloc[10:]], counts='n', n_jobs=1)['cig']
+    expected = pif.compute_cigs(df.fillna('-'))
+    rows = df.fillna('-').merge(table.reset_index(), on=list(df.columns))['index']
+    assert np.allclose(pd.concat(cigs).values[rows], expected.values)
@@ -1,5 +1,15 @@
+import itertools
+import sys
+
+import numpy as np
 import pandas as pd
+import pytest
 import piflib.pif_calculator as pif
+from piflib.buckets import feature_kls, prepare_priors
+from piflib.data_util import complete_feature_priors
+from piflib.encoding import encode
+from piflib.entropy import create_conditional_entropy_table
+from piflib.lattice import ProjectionLattice
 
 data = {'A': [1, 2, 3, 4],
         'B': ['a', 'b', 'c', 'd'],
@@ -51,6 +61,14 @@ def test_compute_weighted_cigs():
     assert (w_cigs.A == 0).all()
     assert (w_cigs.B == 0).all()
     assert (w_cigs.C == 0.5).all()
+    # the weights from the bucket counts are those of the conditional entropy table
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.integers(0, [3, 4, 5, 2], (500, 4)), columns=list('ABCD'))
+    df['E'] = df['A'] * 2 + rng.integers(0, 2, 500)
+    table = create_conditional_entropy_table(df)
+    weights = np.nan_to_num(table['H(X|Y)'].values / table['H(X)'])
+    expected = (pif.compute_cigs(df, feature_accuracies={1: 0.8}) * weights).round(2)
+    assert pif.compute_weighted_cigs(df, feature_accuracies={1: 0.8}).equals(expected)
 
 
 def test_compute_csfs():
@@ -78,3 +96,154 @@ def test_compute_pif():
     assert pif.compute_pif(cigs, 99) < pif_100
     pif_50 = pif.compute_pif(cigs, 50)
     assert rigs[2] < pif_50 < rigs[1]
+
+
+def test_compute_cigs_matches_row_wise_calculation():
+    for df in (df_diverse, df_same, df_fully_dependent, df_mix):
+        for accuracies in ({}, {0: 0.5, 2: 0.8}):
+            cigs = pif.compute_cigs(df, feature_accuracies=accuracies)
+            priors = complete_feature_priors(df, {})
+            all_accuracies = {i: accuracies.get(i, 1) for i in range(len(df.columns))}
+            for i, column in enumerate(df.columns):
+                expected = pif.find_kls_for_features(df.values, (i,), priors, all_accuracies)[0]
+                assert list(cigs[column]) == list(expected)
+
+
+def test_frequency_table():
+    data = {'A': [1, 2, 1, 1, 2, 3],
+            'B': ['a', 'b', 'a', 'b', 'b', 'b'],
+            'C': ['blue', 'red', 'blue', 'blue', 'red', 'red']}
+    df = pd.DataFrame(data)
+    table = df.groupby(list(df.columns)).size().reset_index(name='count')
+    dataset = encode(table, counts='count')
+    assert dataset.num_rows == len(table)
+    assert dataset.total == len(df)
+    # position of every row of df in the frequency table
+    table_rows = df.merge(table.reset_index(), on=list(df.columns))['index']
+    for compute in (pif.compute_cigs, pif.compute_csfs):
+        from_table = compute(dataset)
+        from_rows = compute(df)
+        assert (from_table.values[table_rows] == from_rows.values).all()
+    cigs = pif.compute_cigs(dataset)
+    assert pif.compute_pif(cigs, 42, counts=table['count']) == pif.compute_pif(pif.compute_cigs(df), 42)
+
+
+def test_compute_pif_counts():
+    cigs = pif.compute_cigs(df_mix)
+    counts = [3, 1, 2, 5]
+    expanded = cigs.loc[cigs.index.repeat(counts)]
+    for percentile in (0, 10, 33, 50, 90, 99, 100):
+        assert pif.compute_pif(cigs, percentile, counts) == pif.compute_pif(expanded, percentile)
+
+
+def test_compute_cigs_inaccurate_features_with_large_prior():
+    # values in the prior that never occur in the data contribute to every bucket
+    priors = {2: {'blue': 0.1, 'green': 0.2, 'red': 0.1, 'cyan': 0.1, 'pink': 0.3, 'grey': 0.2, 'black': 0.}}
+    accuracies = {0: 0.5, 1: 0.9, 2: 0.8}
+    cigs = pif.compute_cigs(df_mix, feature_priors=priors, feature_accuracies=accuracies)
+    priors = complete_feature_priors(df_mix, priors)
+    for i, column in enumerate(df_mix.columns):
+        expected = pif.find_kls_for_features(df_mix.values, (i,), priors, accuracies)[0]
+        assert np.allclose(cigs[column], expected, rtol=0, atol=1e-12)
+
+
+def test_n_jobs():
+    accuracies = {1: 0.7}
+    for df in (df_mix, df_fully_dependent):
+        cigs = pif.compute_cigs(df, feature_accuracies=accuracies, n_jobs=2)
+        assert (cigs.values == pif.compute_cigs(df, feature_accuracies=accuracies).values).all()
+        csfs = pif.compute_csfs(df, feature_accuracies=accuracies, n_jobs=2)
+        assert (csfs.values == pif.compute_csfs(df, feature_accuracies=accuracies).values).all()
+
+
+def test_n_jobs_without_shared_memory(monkeypatch):
+    # like Python 3.7, where multiprocessing.shared_memory does not exist
+    import multiprocessing
+    monkeypatch.delattr(multiprocessing, 'shared_memory', raising=False)
+    monkeypatch.setitem(sys.modules, 'multiprocessing.shared_memory', None)
+    assert (pif.compute_cigs(df_mix, n_jobs=1).values == pif.compute_cigs(df_mix).values).all()
+    with pytest.raises(RuntimeError, match='Python 3.8'):
+        pif.compute_cigs(df_mix, n_jobs=2)
+
+
+def test_compute_metrics():
+    priors = {2: {'blue': 0.1, 'green': 0.2, 'red': 0.1, 'cyan': 0.1, 'pink': 0.5}}
+    for df in (df_diverse, df_same, df_fully_dependent, df_mix):
+        for kwargs in ({}, {'feature_accuracies': {0: 0.5, 2: 0.8}}, {'feature_priors': priors}):
+            metrics = pif.compute_metrics(df, **kwargs)
+            assert list(metrics) == ['cig', 'wcig', 'csf']
+            assert (metrics['cig'].values == pif.compute_cigs(df, **kwargs).values).all()
+            assert (metrics['wcig'].values == pif.compute_weighted_cigs(df, **kwargs).values).all()
+            assert (metrics['csf'].values == pif.compute_csfs(df, **kwargs).values).all()
+    metrics = pif.compute_metrics(df_mix, metrics=['csf', 'wcig'], n_jobs=2)
+    assert list(metrics) == ['csf', 'wcig']
+    assert (metrics['wcig'].values == pif.compute_weighted_cigs(df_mix).values).all()
+    with pytest.raises(ValueError):
+        pif.compute_metrics(df_mix, metrics=['rig'])
+
+
+def test_compute_cigs_unknown_features():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.integers(0, [3, 4, 2, 5, 3], (200, 5)), columns=list('ABCDE'))
+    accuracies = {1: 0.6}
+    priors = complete_feature_priors(df, {})
+    all_accuracies = {i: accuracies.get(i, 1) for i in range(len(df.columns))}
+    for r in (2, 3, 5):
+        cigs = pif.compute_cigs(df, feature_accuracies=accuracies, unknown_features=r)
+        expected = [np.zeros(len(df)) for _ in df.columns]
+        for is_ in itertools.combinations(range(len(df.columns)), r):
+            for i, kls in zip(is_, pif.find_kls_for_features(df.values, is_, priors, all_accuracies)):
+                expected[i] = expected[i] + kls
+        denominator = pif.binom(len(df.columns) - 1, r - 1)
+        assert np.allclose(cigs.values, np.column_stack(expected) / denominator, rtol=0, atol=1e-12)
+        parallel_cigs = pif.compute_cigs(df, feature_accuracies=accuracies, unknown_features=r, n_jobs=2)
+        assert (parallel_cigs.values == cigs.values).all()
+    with pytest.raises(ValueError):
+        pif.compute_cigs(df, unknown_features=6)
+
+
+def test_projection_lattice():
+    rng = np.random.default_rng(1)
+    dataset = encode(pd.DataFrame(rng.integers(0, 4, (300, 6))))
+    priors = prepare_priors(dataset, complete_feature_priors(dataset, {}))
+    accuracies = {i: 1 for i in range(6)}
+    # a tiny cache evicts projections all the time, which must not change the results
+    for lattice in (ProjectionLattice(dataset), ProjectionLattice(dataset, max_cells=100)):
+        for is_ in itertools.combinations(range(6), 3):
+            expected = feature_kls(dataset, is_, priors, accuracies)
+            for kls, expected_kls in zip(lattice.feature_kls(is_, priors, accuracies), expected):
+                assert (kls == expected_kls).all()
+
+
+def test_sample_is():
+    assert list(pif.sample_is(4, 2, None)) == list(itertools.combinations(range(4), 2))
+    for n, r, samples in ((10, 3, 4), (10, 3, 30), (10, 3, 100), (10, 3, 120), (7, 7, 1), (30, 4, 500)):
+        combinations = list(pif.sample_is(n, r, samples, seed=42))
+        assert combinations == list(pif.sample_is(n, r, samples, seed=42))
+        assert len(set(combinations)) == len(combinations) == samples
+        assert all(len(comb) == r and list(comb) == sorted(comb) for comb in combinations)
+        # every feature is covered
+        assert set(itertools.chain.from_iterable(combinations)) == set(range(n))
+    with pytest.raises(ValueError):
+        list(pif.sample_is(5, 2, 11))
+    with pytest.raises(ValueError):
+        list(pif.sample_is(10, 3, 3))
+
+
+def test_sample_is_balanced():
+    for n, r, samples in ((10, 3, 20), (12, 2, 30), (6, 3, 20)):
+        combinations = list(pif.sample_is(n, r, samples, seed=np.random.default_rng(1), balanced=True))
+        assert len(set(combinations)) == len(combinations) == samples
+        occurrences = np.bincount(list(itertools.chain.from_iterable(combinations)), minlength=n)
+        # the greedy design can get stuck when the remaining combinations of the least used features were all drawn
+        assert occurrences.max() - occurrences.min() <= 2
+
+
+def test_compute_cigs_samples():
+    rng = np.random.default_rng(2)
+    df = pd.DataFrame(rng.integers(0, 3, (100, 6)))
+    cigs = pif.compute_cigs(df, unknown_features=2, samples=8, seed=3)
+    assert (cigs.values == pif.compute_cigs(df, unknown_features=2, samples=8, seed=3).values).all()
+    assert not cigs.isna().any().any()
+    cigs = pif.compute_cigs(df, unknown_features=2, samples=9, seed=3, balanced=True)
+    assert not cigs.isna().any().any()
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+from piflib.pif_calculator import compute_cigs, compute_posterior_distributions
+from piflib.posterior import compute_posteriors
+
+rng = np.random.default_rng(11)
+df = pd.DataFrame({'A': rng.integers(0, 3, 400),
+                   'B': rng.choice(['x', 'y', None], 400),
+                   'C': rng.integers(0, 5, 400)})
+
+
+def test_matches_bucket_distributions():
+    posteriors = compute_posteriors(df, 'C')
+    known = ['A', 'B']
+    groups = df.fillna('-').groupby(known, sort=False)['C']
+    assert posteriors.total == len(posteriors) == groups.ngroups
+    assert list(posteriors.values) == list(df['C'].unique())
+    frame = posteriors.to_frame()
+    assert list(frame.index.names) == known
+    expected = groups.value_counts(normalize=True).unstack(fill_value=0)[list(df['C'].unique())]
+    expected = expected.reindex(pd.MultiIndex.from_frame(posteriors.keys.fillna('-')))
+    assert np.allclose(frame.values, expected.values)
+    assert (posteriors.sizes == groups.size().values).all()
+    # the CIG of a bucket is the CIG of its cells
+    cigs = compute_cigs(df)['C']
+    first_rows = df.fillna('-').reset_index().groupby(known, sort=False)['index'].first()
+    assert np.allclose(posteriors.cigs, cigs[first_rows].values)
+
+
+def test_filter_sort_and_page():
+    every = compute_posteriors(df, 'A')
+    largest = compute_posteriors(df, 'A', min_size=20, sort_by='size', offset=2, limit=3)
+    sizes = np.sort(every.sizes[every.sizes >= 20])[::-1]
+    assert largest.total == len(sizes)
+    assert (largest.sizes == sizes[2:5]).all()
+    riskiest = compute_posteriors(df, 'A', sort_by='cig', limit=4, feature_accuracies={0: 0.5})
+    assert (np.diff(riskiest.cigs) <= 0).all()
+    assert riskiest.keys.index.isin(every.keys.index).all()
+    empty = compute_posteriors(df, 'A', max_size=0)
+    assert empty.total == 0 and empty.probabilities.shape == (0, 3)
+    with pytest.raises(ValueError):
+        compute_posteriors(df, 'A', sort_by='name')
+
+
+def test_sparse():
+    pytest.importorskip('scipy')
+    posteriors = compute_posteriors(df, 'C', sparse=True)
+    assert np.allclose(posteriors.probabilities.toarray(), compute_posteriors(df, 'C').probabilities)
+
+
+def test_compute_posterior_distributions():
+    small = pd.DataFrame({'name': ['Anton', 'Anton', 'Bea', 'Carl'], 'gender': ['m', 'm', 'f', 'm'],
+                          'eyes': ['g', 'b', 'g', 'g']})
+    distributions, values = compute_posterior_distributions('name', small)
+    assert list(values) == ['Anton', 'Bea', 'Carl']
+    assert distributions == {"('m', 'g')": [0.5, 0.0, 0.5], "('m', 'b')": [1.0, 0.0, 0.0],
+                             "('f', 'g')": [0.0, 1.0, 0.0]}
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+from piflib.pif_calculator import compute_cigs, compute_csfs
+from piflib.reference import ReferenceIndex
+
+rng = np.random.default_rng(5)
+reference = pd.DataFrame({'A': rng.integers(0, 3, 500),
+                          'B': rng.choice(['x', 'y', None], 500),
+                          'C': rng.integers(0, 6, 500)})
+# the batch has new values, duplicates and rows of buckets that are not in the reference
+candidates = pd.DataFrame({'A': [0, 0, 1, 3, 2, 0],
+                           'B': ['x', 'x', None, 'y', 'z', 'y'],
+                           'C': [1, 1, 7, 2, 5, 0]}, index=[10, 11, 12, 13, 14, 15])
+
+
+@pytest.mark.parametrize('accuracies', [{}, {1: 0.6, 2: 0.9}])
+def test_added_matches_concatenation(accuracies):
+    index = ReferenceIndex.build(reference)
+    values = index.score(candidates, ['cig', 'csf'], feature_accuracies=accuracies)
+    combined = pd.concat([reference, candidates])
+    assert np.allclose(values['cig'].values, compute_cigs(combined, feature_accuracies=accuracies).values[-6:])
+    assert np.allclose(values['csf'].values, compute_csfs(combined, feature_accuracies=accuracies).values[-6:])
+    assert list(values['cig'].index) == list(candidates.index)
+    assert list(values['cig'].columns) == ['A', 'B', 'C']
+
+
+def test_counts():
+    index = ReferenceIndex.build(reference)
+    weighted = candidates.drop_duplicates().assign(n=[2, 1, 1, 1, 1])
+    values = index.score(weighted, ['cig', 'csf'], counts='n')
+    expected = index.score(candidates, ['cig', 'csf'])
+    assert np.allclose(values['cig'].values, expected['cig'].drop(11).values)
+    assert np.allclose(values['csf'].values, expected['csf'].drop(11).values)
+
+
+def test_against_reference_only():
+    index = ReferenceIndex.build(reference)
+    values = index.score(candidates, ['cig', 'csf'], mode='reference', feature_accuracies={2: 0.5})
+    # a row that agrees with a reference row on all but one feature gets the CIG of that reference row
+    matching = reference[(reference['A'] == 0) & (reference['B'] == 'x')].iloc[0]
+    row = pd.DataFrame([matching.values], columns=reference.columns)
+    expected = compute_cigs(reference, feature_accuracies={2: 0.5}).loc[matching.name, 'C']
+    assert np.isclose(index.score(row, mode='reference', feature_accuracies={2: 0.5})['cig'].iloc[0, 2], expected)
+    # a new value leaves the buckets of the other features without reference rows, these cells are scored 0
+    for metric in ('cig', 'csf'):
+        assert (values[metric].loc[13, ['B', 'C']] == 0).all() and (values[metric].loc[14, ['A', 'C']] == 0).all()
+    assert values['cig'].loc[13, 'A'] > 0
+    # the batch does not influence itself
+    assert np.allclose(values['cig'].loc[10], values['cig'].loc[11])
+    assert np.allclose(index.score(candidates.loc[[12]], mode='reference')['cig'].values,
+                       index.score(candidates, mode='reference')['cig'].loc[[12]].values)
+
+
+def test_save_and_load(tmp_path):
+    index = ReferenceIndex.build(reference)
+    path = str(tmp_path / 'reference.index')
+    index.save(path)
+    loaded = ReferenceIndex.load(path)
+    for mode in ('added', 'reference'):
+        assert np.array_equal(loaded.score(candidates, mode=mode)['cig'].values,
+                              index.score(candidates, mode=mode)['cig'].values)
+
+
+def test_errors():
+    index = ReferenceIndex.build(reference)
+    with pytest.raises(ValueError):
+        index.score(candidates, mode='alone')
+    with pytest.raises(ValueError):
+        index.score(candidates, ['pif'])
+    with pytest.raises(ValueError):
+        index.score(candidates[['A', 'B']])
+
+
+def test_key_collisions(monkeypatch):
+    expected = {mode: ReferenceIndex.build(reference).score(candidates, ['cig', 'csf'], mode=mode)
+                for mode in ('added', 'reference')}
+    # with every bucket on the same key, the lookups have to compare the values
+    monkeypatch.setattr('piflib.reference.leave_one_out_keys',
+                        lambda codes: np.zeros(codes.shape, dtype=np.uint64))
+    index = ReferenceIndex.build(reference)
+    for mode in ('added', 'reference'):
+        values = index.score(candidates, ['cig', 'csf'], mode=mode)
+        assert np.allclose(values['cig'].values, expected[mode]['cig'].values)
+        assert np.allclose(values['csf'].values, expected[mode]['csf'].values)
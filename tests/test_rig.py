@@ -0,0 +1,84 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+import piflib.pif_calculator as pif
+from piflib.rig import QuantileSketch, RigSummary, top_cells, top_rows
+
+rng = np.random.default_rng(0)
+df = pd.DataFrame(rng.integers(0, [3, 5, 4, 6], (2000, 4)), columns=list('ABCD'))
+cigs = pif.compute_cigs(df)
+percentiles = [0, 50, 90, 95, 99, 100]
+
+
+def test_compute_pif_percentiles():
+    pifs = pif.compute_pif(cigs, percentiles)
+    assert list(pifs) == [pif.compute_pif(cigs, percentile) for percentile in percentiles]
+    counts = rng.integers(1, 5, len(cigs))
+    pifs = pif.compute_pif(cigs, percentiles, counts)
+    assert list(pifs) == [pif.compute_pif(cigs, percentile, counts) for percentile in percentiles]
+
+
+def test_quantile_sketch_exact():
+    values = rng.normal(size=150)
+    counts = rng.integers(1, 4, 150)
+    sketch = QuantileSketch(size=1000).update(values[:100]).update(values[100:])
+    assert list(sketch.percentile(percentiles)) == list(np.percentile(values, percentiles))
+    sketch = QuantileSketch(size=1000).update(values, counts)
+    assert list(sketch.percentile(percentiles)) == list(np.percentile(np.repeat(values, counts), percentiles))
+    with pytest.raises(ValueError):
+        QuantileSketch().percentile(50)
+
+
+def test_quantile_sketch_error():
+    values = rng.exponential(size=200000)
+    partitions = [QuantileSketch(size=200, seed=i).update(part) for i, part in enumerate(np.array_split(values, 7))]
+    merged = partitions[0]
+    for sketch in partitions[1:]:
+        merged.merge(pickle.loads(pickle.dumps(sketch)))
+    assert merged.count == len(values)
+    assert sum(len(level) for level in merged._levels) < 1000
+    sorted_values = np.sort(values)
+    for percentile in percentiles:
+        estimate = merged.percentile(percentile)
+        rank = np.searchsorted(sorted_values, estimate) / len(values)
+        assert abs(rank - percentile / 100) < 0.02
+    assert merged.percentile(100) == values.max()
+
+
+def test_rig_summary():
+    summary = RigSummary(percentiles, top_k=50, sketch_size=5000)
+    chunks = [cigs.iloc[start:start + 300] for start in range(0, len(cigs), 300)]
+    for chunk in chunks[:3]:
+        summary.update(chunk)
+    other = RigSummary(percentiles, top_k=50, sketch_size=5000)
+    for chunk in chunks[3:]:
+        other.update(chunk)
+    summary.merge(other)
+    assert list(summary.pif()) == list(pif.compute_pif(cigs, percentiles))
+    expected_rows = top_rows(cigs, 50)
+    assert summary.top_rows().equals(expected_rows)
+    rigs = cigs.sum(axis=1)
+    assert (expected_rows['RIG'] == np.sort(rigs)[::-1][:50]).all()
+    assert (expected_rows.drop(columns='RIG').values == cigs.loc[expected_rows.index].values).all()
+    expected_cells = top_cells(cigs, 50)
+    assert summary.top_cells().reset_index(drop=True).equals(expected_cells.reset_index(drop=True))
+    assert (expected_cells['CIG'] == np.sort(cigs.values.reshape(-1))[::-1][:50]).all()
+    for _, cell in expected_cells.iterrows():
+        assert cigs.at[cell['row'], cell['column']] == cell['CIG']
+
+
+def test_top_cells_ties():
+    # many equal values: ties keep the row-major order, also across chunks
+    values = pd.DataFrame(rng.integers(0, 3, (1000, 5)) / 2, columns=list('VWXYZ'), index=np.arange(1000) * 3)
+    flat = values.to_numpy().reshape(-1)
+    order = np.argsort(-flat, kind='stable')
+    summary = RigSummary(top_k=40)
+    for start in range(0, len(values), 170):
+        summary.update(values.iloc[start:start + 170])
+    for k, cells in ((40, summary.top_cells()), (40, top_cells(values, 40)), (0, top_cells(values, 0)),
+                     (6000, top_cells(values, 6000))):
+        assert list(cells['CIG']) == list(flat[order[:k]])
+        assert list(cells['row']) == list(values.index[order[:k] // 5])
+        assert list(cells['column']) == list(values.columns[order[:k] % 5])
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import queue
+
+import numpy as np
+import pandas as pd
+import piflib.pif_calculator as pif
+from piflib.service import PifService, _run_job, job_key
+
+rng = np.random.default_rng(0)
+df = pd.DataFrame(rng.integers(0, [3, 4, 5], (200, 3)), columns=list('ABC'))
+csv = df.to_csv(index=False)
+wide = pd.DataFrame(rng.integers(0, 50, (20000, 40))).to_csv(index=False)
+
+
+async def _request(method, target, payload=None, port=None, path=None):
+    if path is None:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    else:
+        reader, writer = await asyncio.open_unix_connection(path)
+    body = b'' if payload is None else json.dumps(payload).encode()
+    writer.write('{} {} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {}\r\n\r\n'.format(
+        method, target, len(body)).encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), json.loads(body)
+
+
+async def _wait(job_id, port, statuses=('done', 'failed', 'cancelled')):
+    for _ in range(600):
+        status, job = await _request('GET', '/jobs/' + job_id, port=port)
+        if job['status'] in statuses:
+            return job
+        await asyncio.sleep(0.05)
+    raise AssertionError('job did not finish')
+
+
+def test_service():
+    async def scenario():
+        async with PifService(workers=1, cache_size=2) as service:
+            port = (await service.serve()).sockets[0].getsockname()[1]
+            request = {'function': 'compute_cigs', 'csv': csv, 'params': {'feature_accuracies': {'1': 0.8}}}
+            status, job = await _request('POST', '/jobs', request, port)
+            assert status == 202
+            job = await _wait(job['id'], port)
+            assert job['status'] == 'done' and job['progress'] == 1
+            expected = pif.compute_cigs(df, feature_accuracies={1: 0.8})
+            assert job['result']['columns'] == list('ABC')
+            assert np.array_equal(job['result']['data'], expected.values)
+            # identical submissions are answered from the finished job
+            status, again = await _request('POST', '/jobs', dict(request), port)
+            assert again['id'] == job['id'] and again['status'] == 'done'
+
+            request = {'function': 'compute_pif', 'csv': csv, 'params': {'percentile': [50, 95]}}
+            status, job = await _request('POST', '/jobs', request, port)
+            job = await _wait(job['id'], port)
+            assert job['result']['pif'] == list(pif.compute_pif(pif.compute_cigs(df), [50, 95]))
+
+            # a running job and a queued one behind it, both cancelled
+            _, running = await _request('POST', '/jobs', {'function': 'compute_csfs', 'csv': wide}, port)
+            _, queued = await _request('POST', '/jobs', {'function': 'compute_cigs', 'csv': wide}, port)
+            await _wait(running['id'], port, statuses=('running',))
+            status, job = await _request('DELETE', '/jobs/' + queued['id'], port=port)
+            assert job['status'] == 'cancelled'
+            await _request('DELETE', '/jobs/' + running['id'], port=port)
+            job = await _wait(running['id'], port)
+            assert job['status'] == 'cancelled'
+
+            # only the two most recently used finished jobs are kept
+            status, jobs = await _request('GET', '/jobs', port=port)
+            assert [job['id'] for job in jobs] == [queued['id'], running['id']]
+            assert (await _request('GET', '/jobs/unknown', port=port))[0] == 404
+            assert (await _request('POST', '/jobs', {'function': 'compute_rigs', 'csv': csv}, port))[0] == 400
+            assert (await _request('POST', '/jobs', {'function': 'compute_pif', 'csv': csv}, port))[0] == 400
+
+    asyncio.run(scenario())
+
+
+def test_service_unix_socket(tmp_path):
+    path = str(tmp_path / 'piflib.sock')
+    data = tmp_path / 'data.csv'
+    data.write_text(csv)
+
+    async def scenario():
+        async with PifService(workers=1) as service:
+            await service.serve(path=path)
+            status, job = await _request('POST', '/jobs', {'function': 'compute_csfs', 'path': str(data)}, path=path)
+            assert status == 202
+            for _ in range(600):
+                job = (await _request('GET', '/jobs/' + job['id'], path=path))[1]
+                if job['status'] == 'done':
+                    break
+                await asyncio.sleep(0.05)
+            assert np.array_equal(job['result']['data'], pif.compute_csfs(df).values)
+
+    asyncio.run(scenario())
+
+
+def test_invalid_requests():
+    invalid = [
+        ['not', 'an', 'object'],
+        {'function': ['compute_cigs'], 'csv': csv},
+        {'function': 'compute_cigs', 'csv': 42},
+        {'function': 'compute_cigs', 'path': ['data.csv']},
+        {'function': 'compute_cigs', 'csv': csv, 'params': [1, 2]},
+        # compute_csfs has no combinations of unknown features
+        {'function': 'compute_csfs', 'csv': csv, 'params': {'unknown_features': 2}},
+        {'function': 'compute_cigs', 'csv': csv, 'params': {'percentile': 95}},
+        {'function': 'compute_cigs', 'csv': csv, 'params': {'feature_accuracies': {'B': 0.5}}},
+        {'function': 'compute_cigs', 'csv': csv, 'params': {'feature_accuracies': {'1': 'high'}}},
+        {'function': 'compute_cigs', 'csv': csv, 'params': {'feature_accuracies': {'1': 0.5, '01': 0.7}}},
+        {'function': 'compute_cigs', 'csv': csv, 'params': {'unknown_features': '2'}},
+        {'function': 'compute_cigs', 'csv': csv, 'params': {'samples': 0}},
+        {'function': 'compute_cigs', 'csv': csv, 'params': {'seed': 1.5}},
+        {'function': 'compute_pif', 'csv': csv, 'params': {'percentile': [50, 'max']}},
+    ]
+
+    async def scenario():
+        async with PifService(workers=1) as service:
+            port = (await service.serve()).sockets[0].getsockname()[1]
+            for request in invalid:
+                status, response = await _request('POST', '/jobs', request, port)
+                assert status == 400, request
+            assert not service.jobs
+
+    asyncio.run(scenario())
+
+
+def test_job_key():
+    # feature indices are strings after a JSON round trip, but may be integers when a job is submitted directly
+    params = {'feature_accuracies': {0: 0.5, '2': 0.7}, 'seed': 1}
+    assert job_key(b'data', 'compute_cigs', params) == job_key(b'data', 'compute_cigs',
+                                                               {'seed': 1, 'feature_accuracies': {'0': 0.5, 2: 0.7}})
+    assert job_key(b'data', 'compute_cigs', params) != job_key(b'data', 'compute_cigs', {'seed': 1})
+
+
+def test_progress():
+    data = csv.encode()
+    for function, params in (('compute_cigs', {}), ('compute_csfs', {}), ('compute_cigs', {'unknown_features': 2}),
+                             ('compute_pif', {'unknown_features': 2, 'samples': 2, 'percentile': 95})):
+        messages = queue.Queue()
+        _run_job('job', function, data, 'csv', params, messages, {})
+        progress = []
+        while not messages.empty():
+            progress.append(messages.get_nowait()[2])
+        # progress advances with every unknown feature of every combination, and ends complete
+        assert len(progress) > 2 and progress == sorted(progress) and progress[-1] == 1, (function, params)
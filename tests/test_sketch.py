@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+import piflib.pif_calculator as pif
+from piflib.sketch import sketch_cigs
+
+rng = np.random.default_rng(7)
+df = pd.DataFrame({'A': rng.integers(0, 6, 2000),
+                   'B': rng.choice(['x', 'y', 'z', None], 2000),
+                   'C': rng.integers(0, 30, 2000),
+                   'D': rng.integers(0, 40, 2000)})
+chunks = [df.iloc[start:start + 500] for start in range(0, len(df), 500)]
+
+
+def test_large_memory_is_exact():
+    sketch = sketch_cigs(chunks, feature_accuracies={1: 0.6}, memory=2 ** 24)
+    exact = pif.compute_cigs(df, feature_accuracies={1: 0.6})
+    # every bucket is heavy
+    assert sketch.heavy_threshold == 1
+    cigs = pd.concat([approximate.estimate for approximate in sketch.cigs(chunks)])
+    assert cigs.index.equals(df.index)
+    assert np.allclose(cigs.values, exact.values)
+    estimate = sketch.pif(chunks, [50, 95])
+    assert np.all(estimate.lower <= pif.compute_pif(exact, [50, 95]))
+    assert np.all(estimate.upper >= pif.compute_pif(exact, [50, 95]))
+    assert np.allclose(estimate.estimate, pif.compute_pif(exact, [50, 95]), atol=1e-3)
+
+
+@pytest.mark.parametrize('accuracies', [{}, {0: 0.8, 3: 0.5}])
+@pytest.mark.parametrize('memory, heavy_threshold', [(2 ** 14, None), (2 ** 17, 5)])
+def test_bounds(accuracies, memory, heavy_threshold):
+    sketch = sketch_cigs(chunks, feature_accuracies=accuracies, memory=memory, heavy_threshold=heavy_threshold)
+    assert sketch.error > 1
+    assert (min(sketch.num_heavy) > 0) == (heavy_threshold is not None)
+    exact = pif.compute_cigs(df, feature_accuracies=accuracies).values
+    approximate = [pd.concat(frames) for frames in zip(*sketch.cigs(chunks))]
+    estimate, lower, upper = (frame.values for frame in approximate)
+    assert np.all(lower <= exact + 1e-9)
+    assert np.all(exact <= upper + 1e-9)
+    assert np.all((lower <= estimate + 1e-9) & (estimate <= upper + 1e-9))
+    pif_estimate = sketch.pif(chunks, 95)
+    assert pif_estimate.lower <= pif.compute_pif(pd.DataFrame(exact), 95) <= pif_estimate.upper
+
+
+def test_frequency_table():
+    table = df.fillna('-').groupby(list(df.columns)).size().reset_index(name='n')
+    sketch = sketch_cigs([table], memory=2 ** 24, counts='n')
+    assert sketch.total == len(df)
+    exact = pif.compute_cigs(df.fillna('-'))
+    assert sketch.pif([table], 95).estimate == pytest.approx(pif.compute_pif(exact, 95), abs=1e-3)
@@ -0,0 +1,67 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+import piflib.pif_calculator as pif
+from piflib.streaming import (DistinctRows, compute_cigs_chunked, compute_csfs_chunked, count_distinct_rows,
+                              read_chunks, write_chunks)
+
+rng = np.random.default_rng(0)
+df = pd.DataFrame({'A': rng.integers(0, 4, 500),
+                   'B': rng.choice(['x', 'y', None], 500),
+                   'C': rng.integers(0, 3, 500)})
+chunks = [df.iloc[start:start + 64] for start in range(0, len(df), 64)]
+
+
+def test_compute_cigs_chunked():
+    cigs = pd.concat(compute_cigs_chunked(chunks, feature_accuracies={0: 0.6}))
+    assert cigs.index.equals(df.index)
+    assert (cigs.values == pif.compute_cigs(df, feature_accuracies={0: 0.6}).values).all()
+    cigs = pd.concat(compute_cigs_chunked(chunks, unknown_features=2))
+    assert (cigs.values == pif.compute_cigs(df, unknown_features=2).values).all()
+
+
+def test_compute_csfs_chunked():
+    csfs = pd.concat(compute_csfs_chunked(lambda: iter(chunks)))
+    assert (csfs.values == pif.compute_csfs(df).values).all()
+
+
+def test_chunks_must_be_reiterable():
+    with pytest.raises(ValueError):
+        next(compute_cigs_chunked(iter(chunks)))
+
+
+def test_distinct_rows():
+    distinct = count_distinct_rows(chunks)
+    table = distinct.table()
+    assert table.total == len(df)
+    assert table.num_distinct == len(df.drop_duplicates())
+    rows = distinct.lookup(df)
+    assert (table.codes[rows] == table.codes[distinct.lookup(df.iloc[::-1])][::-1]).all()
+    # merging partial counts gives the same table, also after a round trip through pickle
+    merged = DistinctRows()
+    for chunk in chunks:
+        merged.merge(pickle.loads(pickle.dumps(DistinctRows().update(chunk))))
+    assert (merged.table().codes == table.codes).all()
+    assert (merged.table().weights == table.weights).all()
+    with pytest.raises(ValueError):
+        distinct.lookup(pd.DataFrame({'A': [7], 'B': ['x'], 'C': [0]}))
+
+
+def test_frequency_table_chunks():
+    table = df.fillna('-').groupby(list(df.columns)).size().reset_index(name='n')
+    cigs = pd.concat(compute_cigs_chunked([table.iloc[:5], table.iloc[5:]], counts='n'))
+    assert len(cigs) == len(table)
+    assert pif.compute_pif(cigs, 90, counts=table['n']) == pif.compute_pif(pif.compute_cigs(df.fillna('-')), 90)
+
+
+@pytest.mark.parametrize('suffix', ['.csv', '.parquet'])
+def test_read_write_chunks(tmp_path, suffix):
+    if suffix == '.parquet':
+        pytest.importorskip('pyarrow')
+    path = str(tmp_path / ('data' + suffix))
+    assert write_chunks(chunks, path) == len(df)
+    cigs = pd.concat(compute_cigs_chunked(path))
+    assert (cigs.values == pif.compute_cigs(pd.concat(read_chunks(path))).values).all()
+    assert len(list(read_chunks(path, chunksize=100))) == 5
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import piflib.pif_calculator as pif
+from piflib.data_util import complete_feature_priors
+from piflib.suppression import suggest_suppressions
+
+rng = np.random.default_rng(0)
+df = pd.DataFrame(rng.integers(0, [2, 3, 4, 5, 6], (400, 5)), columns=list('ABCDE'))
+df['F'] = df['A'] * 3 + df['B']
+
+
+def _pif(frame, suppressed, percentile, feature_accuracies={}):
+    # the PIF of the frame without the suppressed columns, with the priors of the full frame
+    priors = complete_feature_priors(frame, {})
+    kept = [i for i, column in enumerate(frame.columns) if column not in suppressed]
+    cigs = pif.compute_cigs(frame.iloc[:, kept], feature_priors={j: priors[i] for j, i in enumerate(kept)},
+                            feature_accuracies={j: feature_accuracies[i] for j, i in enumerate(kept)
+                                                if i in feature_accuracies})
+    return pif.compute_pif(cigs, percentile)
+
+
+def _greedy(frame, target, percentile, feature_accuracies={}):
+    suppressed = []
+    pifs = [_pif(frame, suppressed, percentile, feature_accuracies)]
+    while pifs[-1] > target:
+        best = min((_pif(frame, suppressed + [column], percentile, feature_accuracies), column)
+                   for column in frame.columns if column not in suppressed)
+        suppressed.append(best[1])
+        pifs.append(best[0])
+    return suppressed, pifs
+
+
+def test_suggest_suppressions():
+    for target, percentile, accuracies in ((1.0, 95, {}), (0.2, 50, {2: 0.7})):
+        result = suggest_suppressions(df, target, percentile, feature_accuracies=accuracies)
+        suppressed, pifs = _greedy(df, target, percentile, accuracies)
+        assert list(result['column'][1:]) == suppressed
+        assert np.allclose(result['pif'], pifs, rtol=0, atol=1e-12)
+        assert result['pif'].iloc[-1] <= target < result['pif'].iloc[-2]
+
+
+def test_suggest_suppressions_options():
+    result = suggest_suppressions(df, 0.0, 95, candidates=['A', 'B'])
+    assert set(result['column'][1:]) <= {'A', 'B'}
+    assert len(suggest_suppressions(df, 0.0, 95, max_suppressions=2)) <= 3
+    greedy = suggest_suppressions(df, 1.0, 95)
+    beam = suggest_suppressions(df, 1.0, 95, beam_width=4)
+    assert len(beam) <= len(greedy)
+    assert beam['pif'].iloc[-1] <= 1.0
+    assert suggest_suppressions(df, 100, 95)['pif'].tolist() == [pif.compute_pif(pif.compute_cigs(df), 95)]